@@ -0,0 +1,145 @@
+# batched AccessLog writer: git endpoints enqueue, one background task writes
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from .metrics import registry
+from .models import Action
+
+ACCESS_LOG_QUEUE_SIZE = int(os.getenv("ACCESS_LOG_QUEUE_SIZE", "10000"))
+ACCESS_LOG_BATCH_SIZE = int(os.getenv("ACCESS_LOG_BATCH_SIZE", "500"))
+ACCESS_LOG_FLUSH_INTERVAL = float(os.getenv("ACCESS_LOG_FLUSH_INTERVAL", "1.0"))
+# how long record() may hold up a request when the queue is full before the event is dropped
+ACCESS_LOG_PUT_TIMEOUT = float(os.getenv("ACCESS_LOG_PUT_TIMEOUT", "0.05"))
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()  # queue marker: flush what came before it and exit
+
+ACCESS_LOG_EVENTS = registry.counter(
+    "access_log_events_total", "Access log events by outcome.", ("outcome",))
+ACCESS_LOG_FLUSH_SECONDS = registry.histogram(
+    "access_log_flush_duration_seconds", "Time to write one access log batch.")
+ACCESS_LOG_QUEUE_DEPTH = registry.gauge(
+    "access_log_queue_depth", "Access log events waiting for the flusher.")
+
+
+class AccessLogger:
+    """
+    Bounded asyncio.Queue in front of crud.write_access_logs().
+    A batch goes out when it reaches batch_size or flush_interval after its
+    first event, whichever comes first. A full queue pushes back on callers
+    for at most put_timeout, then the event is dropped (and counted): an
+    access log entry is never worth failing a clone over.
+    """
+
+    def __init__(self,
+                 queue_size: int = ACCESS_LOG_QUEUE_SIZE,
+                 batch_size: int = ACCESS_LOG_BATCH_SIZE,
+                 flush_interval: float = ACCESS_LOG_FLUSH_INTERVAL,
+                 put_timeout: float = ACCESS_LOG_PUT_TIMEOUT):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        self.queue = asyncio.Queue(self.queue_size)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def record(self, repo_id: int, user_id: int, action: Action) -> None:
+        if self.queue is None or self._closing:
+            return
+        event = {"repo_id": repo_id, "user_id": user_id, "action": action,
+                 # naive UTC, when it happened rather than when the batch lands
+                 "updated_at": datetime.now(timezone.utc).replace(tzinfo=None)}
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self.queue.put(event), self.put_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                ACCESS_LOG_EVENTS.inc(outcome="dropped")
+                return
+        ACCESS_LOG_EVENTS.inc(outcome="queued")
+
+    async def _next_batch(self) -> tuple[list[dict], bool]:
+        """Up to batch_size events, waiting at most flush_interval after the first; True once stop() was seen."""
+        batch = []
+        item = await self.queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while item is not _STOP:
+            batch.append(item)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.batch_size or remaining <= 0:
+                return batch, False
+            try:
+                item = await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return batch, False
+        return batch, True
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: list[dict]) -> None:
+        # imported here: database_sessions pulls in the engines, which this module shouldn't at import
+        from .crud import write_access_logs
+        from .database_sessions import AsyncSessionLocal
+
+        try:
+            with ACCESS_LOG_FLUSH_SECONDS.time():
+                async with AsyncSessionLocal() as db:
+                    await write_access_logs(db, batch)
+        except Exception:
+            self.failed += len(batch)
+            ACCESS_LOG_EVENTS.inc(len(batch), outcome="failed")
+            logger.exception("access log batch failed", extra={"events": len(batch)})
+        else:
+            self.written += len(batch)
+            ACCESS_LOG_EVENTS.inc(len(batch), outcome="written")
+
+    async def stop(self) -> None:
+        """Stop taking events and write out everything already queued (lifespan shutdown)."""
+        if self._task is None:
+            return
+        self._closing = True
+        await self.queue.put(_STOP)   # queued behind every pending event
+        await self._task
+        queue, self.queue, self._task = self.queue, None, None
+        # stragglers that were blocked in put() while the stop marker went in
+        leftovers = []
+        while not queue.empty():
+            item = queue.get_nowait()
+            if item is not _STOP:
+                leftovers.append(item)
+        for start in range(0, len(leftovers), self.batch_size):
+            await self._flush(leftovers[start:start + self.batch_size])
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "queue_size": self.queue_size,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+access_logger = AccessLogger()
+registry.add_collector(lambda: ACCESS_LOG_QUEUE_DEPTH.set(access_logger.stats()["queue_depth"]))
@@ -0,0 +1,108 @@
+# bulk import: NDJSON request bodies -> chunks -> crud.import_* (multi-row inserts), per-line error report
+import json
+import logging
+import os
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Optional
+
+from pydantic import BaseModel, ValidationError
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))     # records per INSERT / transaction
+IMPORT_MAX_LINE = int(os.getenv("IMPORT_MAX_LINE", str(1024 * 1024)))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))     # reported, the rest are only counted
+
+logger = logging.getLogger(__name__)
+
+# takes one chunk of records, returns an error message (or None) for each, in order
+ChunkWriter = Callable[[list], Awaitable[list[Optional[str]]]]
+
+
+async def read_ndjson(stream: AsyncIterable[bytes], max_line: int = IMPORT_MAX_LINE) -> AsyncIterator[tuple[int, Optional[bytes]]]:
+    """
+    (line number, raw line) for every non-blank line of the body, holding at
+    most one line in memory. A line longer than max_line comes out as None.
+    """
+    pending, line_no, too_long = b"", 0, False
+    async for data in stream:
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_no += 1
+            if too_long or len(line) > max_line:
+                too_long = False
+                yield line_no, None
+            elif line.strip():
+                yield line_no, line
+        if len(pending) > max_line:
+            pending, too_long = b"", True
+    if too_long:
+        yield line_no + 1, None
+    elif pending.strip():
+        yield line_no + 1, pending
+
+
+def parse_line(raw: Optional[bytes], model: type[BaseModel]) -> tuple[Optional[BaseModel], Optional[str]]:
+    if raw is None:
+        return None, f"Line longer than {IMPORT_MAX_LINE} bytes"
+    try:
+        return model.model_validate(json.loads(raw)), None
+    except ValueError as e:   # ValidationError and JSONDecodeError are both ValueErrors
+        if isinstance(e, ValidationError):
+            first = e.errors()[0]
+            return None, f"{'.'.join(str(p) for p in first['loc']) or 'record'}: {first['msg']}"
+        return None, f"Invalid JSON: {e}"
+
+
+class ImportResult:
+    def __init__(self, max_errors: int = IMPORT_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.imported = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+
+    def fail(self, line: int, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": error})
+
+    def report(self) -> dict:
+        # parse errors are found before the write errors of their chunk, so re-sort
+        return {"imported": self.imported, "failed": self.failed,
+                "errors": sorted(self.errors, key=lambda e: e["line"]),
+                "errors_truncated": self.failed > len(self.errors)}
+
+
+async def _write(chunk: list[tuple[int, BaseModel]], writer: ChunkWriter, result: ImportResult) -> None:
+    try:
+        errors = await writer([record for _, record in chunk])
+    except Exception:
+        # the chunk's transaction was rolled back: none of it landed
+        logger.exception("import chunk failed", extra={"first_line": chunk[0][0], "records": len(chunk)})
+        errors = ["Chunk failed to import, nothing from it was saved"] * len(chunk)
+    for (line_no, _), error in zip(chunk, errors):
+        if error is None:
+            result.imported += 1
+        else:
+            result.fail(line_no, error)
+
+
+async def run_import(stream: AsyncIterable[bytes], model: type[BaseModel], writer: ChunkWriter,
+                     chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+    """
+    Parse the NDJSON body as it arrives and hand it to writer() chunk_size
+    records at a time, so memory stays at one chunk whatever the body size.
+    Each chunk is its own transaction: a failure costs that chunk only.
+    """
+    result = ImportResult()
+    chunk: list[tuple[int, BaseModel]] = []
+    async for line_no, raw in read_ndjson(stream):
+        record, error = parse_line(raw, model)
+        if error is not None:
+            result.fail(line_no, error)
+            continue
+        chunk.append((line_no, record))
+        if len(chunk) >= chunk_size:
+            await _write(chunk, writer, result)
+            chunk = []
+    if chunk:
+        await _write(chunk, writer, result)
+    return result.report()
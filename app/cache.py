@@ -0,0 +1,176 @@
+# read-through cache for hot metadata lookups (repo ids/paths, usernames, roles)
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+# "local" is an LRU per worker; "redis" is shared, so every uvicorn worker sees an invalidation at once
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+# "not found" (None) is kept this long only: with the local backend, a repo or user created
+# through another worker must not stay invisible here for a whole CACHE_TTL
+CACHE_MISS_TTL = float(os.getenv("CACHE_MISS_TTL", "1"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "cornhub:")
+
+# "not in the cache", as opposed to a cached None (e.g. "this user has no role here")
+MISSING = object()
+
+
+class LocalCache:
+    """TTL + LRU dict. Sync endpoints run in the threadpool, hence the lock."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl: float = CACHE_TTL) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    # same calls for async code; nothing here ever waits
+    async def aget(self, key: str) -> Any:
+        return self.get(key)
+
+    async def aset(self, key: str, value: Any, ttl: float = CACHE_TTL) -> None:
+        self.set(key, value, ttl)
+
+    async def adelete(self, *keys: str) -> None:
+        self.delete(*keys)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class RedisCache:
+    """
+    Shared backend (needs `pip install redis`). Values are stored as JSON, so
+    cached things must be plain dicts/lists/strings/numbers/None.
+    """
+
+    def __init__(self, url: str = CACHE_URL, prefix: str = CACHE_PREFIX):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis needs the redis package installed") from e
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self.aclient = redis.asyncio.Redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+
+    def _decode(self, raw) -> Any:
+        if raw is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return json.loads(raw)
+
+    def get(self, key: str) -> Any:
+        return self._decode(self.client.get(self.prefix + key))
+
+    def set(self, key: str, value: Any, ttl: float = CACHE_TTL) -> None:
+        self.client.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self.prefix + k for k in keys))
+
+    async def aget(self, key: str) -> Any:
+        return self._decode(await self.aclient.get(self.prefix + key))
+
+    async def aset(self, key: str, value: Any, ttl: float = CACHE_TTL) -> None:
+        await self.aclient.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    async def adelete(self, *keys: str) -> None:
+        if keys:
+            await self.aclient.delete(*(self.prefix + k for k in keys))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def make_cache(backend: str = CACHE_BACKEND):
+    if backend == "redis":
+        return RedisCache()
+    if backend == "local":
+        return LocalCache()
+    raise ValueError(f"Unknown CACHE_BACKEND {backend!r}")
+
+
+# shared metadata cache (backend per CACHE_BACKEND)
+cache = make_cache()
+# always in-process: for facts about this host's filesystem, which every worker can re-check itself
+local_cache = LocalCache()
+
+
+def _ttl(value: Any, ttl: float) -> float:
+    return min(ttl, CACHE_MISS_TTL) if value is None else ttl
+
+
+def read_through(key: str, loader: Callable[[], Any], ttl: float = CACHE_TTL) -> Any:
+    value = cache.get(key)
+    if value is MISSING:
+        value = loader()
+        cache.set(key, value, _ttl(value, ttl))
+    return value
+
+
+async def aread_through(key: str, loader: Callable[[], Awaitable[Any]], ttl: float = CACHE_TTL) -> Any:
+    value = await cache.aget(key)
+    if value is MISSING:
+        value = await loader()
+        await cache.aset(key, value, _ttl(value, ttl))
+    return value
+
+
+def invalidate(*keys: str) -> None:
+    cache.delete(*keys)
+
+
+async def ainvalidate(*keys: str) -> None:
+    await cache.adelete(*keys)
+
+
+# ~~~ key families, so writers and readers can't drift apart
+def repo_key(repo_id: int) -> str:
+    return f"repo:{repo_id}"
+
+
+def repo_name_key(reponame: str) -> str:
+    return f"repo-name:{reponame}"
+
+
+def username_key(user_id: int) -> str:
+    return f"username:{user_id}"
+
+
+def roles_key(user_id: int, repo_id: int) -> str:
+    return f"roles:{user_id}:{repo_id}"
@@ -0,0 +1,125 @@
+"""
+Deploy-time jobs, kept out of the app's import and startup path.
+
+    python -m app.cli migrate            # run before starting (or rolling) the workers
+    python -m app.cli backfill-search    # one-off, fills issue_search from Mongo
+
+migrate creates missing tables, adds missing columns to existing ones (only
+nullable ones or ones with a server default, anything else needs a hand-written
+migration) and missing indexes (and drops retired ones), then backfills the repository counters if they
+were just added. On SQLite it also pads timestamps written before models.utcnow.
+Running it again on an up-to-date schema changes nothing.
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from . import crud, models
+from .database_sessions import engine, SessionLocal, AsyncSessionLocal
+
+# columns whose values have to be computed from the existing rows once they are added
+COUNTER_BACKFILLS = {
+    ("repository", "next_issue_num"): crud.backfill_issue_counters,
+    ("repository", "next_log_no"): crud.backfill_log_counters,
+}
+
+
+def _add_column(conn, table, column) -> None:
+    if not column.nullable and column.server_default is None:
+        raise SystemExit(f"{table.name}.{column.name} is NOT NULL without a server default: "
+                         f"that one needs a hand-written migration")
+    spec = CreateColumn(column).compile(dialect=conn.dialect)
+    name = conn.dialect.identifier_preparer.format_table(table)
+    conn.execute(text(f"ALTER TABLE {name} ADD COLUMN {spec}"))
+
+
+# indexes models.py no longer has, dropped when found: (table, index)
+RETIRED_INDEXES = (("issue_search", "ix_issue_search_document"),)   # replaced by ix_issue_search_repo_document
+
+
+# timestamps SQLite got from CURRENT_TIMESTAMP before models.utcnow: padded to the
+# six-digit form bound datetimes use, so they order right against keyset cursors
+SQLITE_TIMESTAMPS = (("issue", "created_at"), ("issue", "updated_at"), ("accesslog", "updated_at"))
+
+
+def _pad_sqlite_timestamps(conn) -> list[str]:
+    changes = []
+    for table, column in SQLITE_TIMESTAMPS:
+        result = conn.execute(text(f"UPDATE {table} SET {column} = {column} || '.000000' "
+                                   f"WHERE length({column}) = 19"))
+        if result.rowcount:
+            changes.append(f"padded {result.rowcount} {table}.{column} timestamps")
+    return changes
+
+
+def migrate() -> list[str]:
+    """Bring the database up to models.py. Returns what changed, one line each."""
+    changes, backfills = [], []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing = set(inspector.get_table_names())
+        for table in models.Base.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    _add_column(conn, table, column)
+                    changes.append(f"added column {table.name}.{column.name}")
+                    if (table.name, column.name) in COUNTER_BACKFILLS:
+                        backfills.append(COUNTER_BACKFILLS[table.name, column.name])
+            indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+            for name in indexes & {ix for t, ix in RETIRED_INDEXES if t == table.name}:
+                conn.execute(text(f"DROP INDEX {conn.dialect.identifier_preparer.quote(name)}"))
+                changes.append(f"dropped index {name}")
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)   # ddl_if still applies: the GIN index is skipped off postgres
+                    if index.name in {ix["name"] for ix in inspect(conn).get_indexes(table.name)}:
+                        changes.append(f"created index {index.name}")
+        # new tables come with their indexes
+        models.Base.metadata.create_all(conn)
+        changes.extend(f"created table {t.name}" for t in models.Base.metadata.sorted_tables if t.name not in existing)
+        if conn.dialect.name == "sqlite":
+            changes.extend(_pad_sqlite_timestamps(conn))
+
+    with SessionLocal() as db:
+        for backfill in backfills:
+            backfill(db)
+            changes.append(f"ran {backfill.__name__}")
+    return changes
+
+
+async def backfill_search(batch: int) -> int:
+    from . import mongo_store
+
+    await mongo_store.init_store()
+    try:
+        async with AsyncSessionLocal() as db:
+            return await crud.backfill_issue_search(db, batch)
+    finally:
+        await mongo_store.close_store()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="create/alter the schema to match models.py")
+    search = commands.add_parser("backfill-search", help="index issues created before issue_search existed")
+    search.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        changes = migrate()
+        for change in changes:
+            print(change)
+        print(f"schema up to date ({len(changes)} changes)")
+    elif args.command == "backfill-search":
+        print(f"indexed {asyncio.run(backfill_search(args.batch))} issues")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# content encodings: compressed JSON responses, gzip request bodies from git clients
+import os
+import zlib
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import zstandard
+except ImportError:   # optional: without it everything is gzip
+    zstandard = None
+
+# smaller bodies go out as they are: not worth the CPU or the header bytes
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_ZSTD_LEVEL = int(os.getenv("COMPRESS_ZSTD_LEVEL", "3"))
+# only these get compressed; packs and blobs are already compressed (or big and binary)
+COMPRESS_TYPES = tuple(t.strip() for t in os.getenv("COMPRESS_TYPES", "application/json").split(",") if t.strip())
+# decompressed request data is handed on in pieces of at most this size
+DECODE_CHUNK_SIZE = 64 * 1024
+
+
+def accepted_encodings(header: str) -> set[str]:
+    """Accept-Encoding -> the codings it allows (q=0 means refused)."""
+    accepted = set()
+    for item in header.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip())
+    return accepted
+
+
+def pick_encoding(header: str) -> Optional[str]:
+    accepted = accepted_encodings(header)
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # 16+: gzip framing
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+
+class _Zstd:
+    def __init__(self, level: int):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+
+def _encoder(encoding: str):
+    return _Zstd(COMPRESS_ZSTD_LEVEL) if encoding == "zstd" else _Gzip(COMPRESS_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    Pure ASGI middleware compressing COMPRESS_TYPES responses (JSON) with zstd
+    when the client takes it and zstandard is installed, gzip otherwise.
+    Streams: each body chunk goes through the compressor as it is sent, nothing
+    is buffered past the first chunk. A single-chunk body under
+    COMPRESS_MIN_BYTES is left alone; git and blob responses are never touched.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES, types: tuple = COMPRESS_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.types = types
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = pick_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None      # held back until the first body chunk says whether to compress
+        encoder = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                passthrough = (message["status"] in (204, 304)
+                               or "content-encoding" in headers
+                               or not headers.get("content-type", "").startswith(self.types))
+                if passthrough:
+                    await send(message)
+                else:
+                    start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body, more = message.get("body", b""), message.get("more_body", False)
+            if start is not None:
+                if not more and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                headers = MutableHeaders(raw=start["headers"])
+                del headers["content-length"]
+                headers["content-encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                await send(start)
+                start, encoder = None, _encoder(encoding)
+            data = encoder.compress(body)
+            if not more:
+                data += encoder.flush()
+            if data or not more:
+                await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# ~~~ request bodies
+async def gunzip_stream(stream: AsyncIterator[bytes], chunk_size: int = DECODE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    Inflate a gzip body as it arrives. Output comes in pieces of at most
+    chunk_size, so a small, highly compressed body can't balloon in memory.
+    """
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        async for data in stream:
+            while data and not inflater.eof:
+                out = inflater.decompress(data, chunk_size)
+                if out:
+                    yield out
+                data = inflater.unconsumed_tail
+        tail = inflater.flush()
+    except zlib.error as e:
+        raise HTTPException(status_code=400, detail=f"Malformed gzip request body: {e}")
+    if tail:
+        yield tail
+    if not inflater.eof:
+        raise HTTPException(status_code=400, detail="Truncated gzip request body")
+
+
+def request_body(request: Request) -> AsyncIterator[bytes]:
+    """The request body with its Content-Encoding undone (git gzips big fetch negotiations)."""
+    encoding = request.headers.get("content-encoding", "identity").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+        return gunzip_stream(request.stream())
+    if encoding in ("", "identity"):
+        return request.stream()
+    raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
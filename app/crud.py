@@ -1,14 +1,28 @@
+import asyncio
+import base64
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
 from typing import Optional
 
-from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import delete, func, insert, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from starlette.concurrency import run_in_threadpool
 from math import ceil
-from .models import User, Repository, Issue
-from .json_dto import UserCreate, UserResponse, RepoCreate, RepoResponse, IssueCreate, IssueDetailResponse, IssuePage, IssueItem, PageMeta, RepoPage, RepoItem
-from .git_ops import init_bare
-from .mongo_store import create_issue_doc, add_comment, get_issue
-import bcrypt
+from .models import User, Repository, Issue, IssueSearch, IssueStatus, Role, AccessLog, user_repo_roles, utcnow
+from .json_dto import UserCreate, UserResponse, RepoCreate, RepoResponse, RepoSettings, IssueCreate, IssueDetailResponse, IssuePage, PageMeta, RepoPage, IssueSearchPage, UserImport, IssueImport
+from .git_ops import init_bare, get_repo_path, valid_repo_name, apply_upload_settings
+from .forks import create_fork_repo
+from .issue_search import index_issue, index_issues, index_comment, unindex_issue, search_stmt
+from .mongo_store import create_issue_doc, create_issue_docs, delete_issue_docs, thread_doc, add_comment, get_issue, get_comments
+from .passwords import password_hasher
+from .cache import read_through, aread_through, invalidate, ainvalidate, repo_key, repo_name_key, username_key, roles_key
+from bson import ObjectId
 
 def create_user(db : Session ,user : UserCreate) -> User:
     hashed = hash_pwd(user.password)
@@ -16,14 +30,45 @@ def create_user(db : Session ,user : UserCreate) -> User:
     db.add(actual_user)
     db.commit()
     db.refresh(actual_user)
+    invalidate(username_key(actual_user.user_id))  # may hold a cached "no such user"
     return actual_user
 
+async def create_user_async(db: AsyncSession, user: UserCreate) -> User:
+    hashed = await password_hasher.hash(user.password)  # process pool, the loop never runs bcrypt
+    actual_user = User(username=user.username, email=user.email, password_hash=hashed)
+    db.add(actual_user)
+    try:
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    await db.refresh(actual_user)
+    await ainvalidate(username_key(actual_user.user_id))
+    return actual_user
+
+async def authenticate(db: AsyncSession, username: str, password: str) -> Optional[User]:
+    """The user if the password matches, else None. Hashes below BCRYPT_ROUNDS are upgraded here."""
+    user = await get_user_by_name_async(db, username)
+    ok, upgraded = await password_hasher.verify(password, user.password_hash if user else None)
+    if not ok:
+        return None
+    if upgraded is not None:
+        user.password_hash = upgraded
+        await db.commit()
+    return user
+
 def get_user_by_name(db,username) -> Optional[User]:
     return db.query(User).filter(User.username==username).first()
 
+async def get_user_by_name_async(db: AsyncSession, username: str) -> Optional[User]:
+    return await db.scalar(select(User).where(User.username == username))
+
 def get_user_by_id(db, user_id) -> Optional[User]:
     return db.query(User).filter(User.user_id==user_id).first()
 
+async def get_user_by_id_async(db: AsyncSession, user_id: int) -> Optional[User]:
+    return await db.scalar(select(User).where(User.user_id == user_id))
+
 # ~~~
 def create_repo(db: Session, repo_in: RepoCreate) -> Repository:
     db_repo = Repository(
@@ -38,34 +83,141 @@ def create_repo(db: Session, repo_in: RepoCreate) -> Repository:
         db.add(db_repo)
         db.commit()
         db.refresh(db_repo)
+        forget_count("repos")
+        invalidate(repo_key(db_repo.repo_id), repo_name_key(db_repo.reponame))
         return db_repo
     except Exception as e:
         db.rollback()
         raise e
 
-def list_repos(db: Session, page: int = 1, size: int = 20) -> RepoPage:
-    offset = (page - 1) * size
-    total  = db.query(func.count(Repository.repo_id)).scalar()
-    rows   = (db.query(Repository, User.username)
-                .join(User, User.user_id == Repository.maintainer_id)
-                .order_by(Repository.repo_id.desc())
-                .offset(offset)
-                .limit(size)
-                .all())
-
-    pages = ceil(total / size) if total else 1
-
-    return RepoPage(
-        meta=PageMeta(page=page, size=size, total_size=total, total_pages=pages),
-        items=[
-            RepoItem(
-                repo_id=repo.repo_id,
-                reponame=repo.reponame,
-                maintainer_name=username
-            )
-            for repo, username in rows
+def update_repo_settings(db: Session, repo_id: int, settings: RepoSettings) -> Repository:
+    """Store the upload-pack flags and write them into the bare repo's config."""
+    db_repo = get_repo_by_id(db, repo_id)
+    if db_repo is None:
+        raise LookupError("Repository not found")
+    changes = settings.model_dump(exclude_none=True)
+    if not changes:
+        return db_repo
+    previous = {name: getattr(db_repo, name) for name in changes}
+    repo_path = get_repo_path(db_repo.reponame)
+    for name, value in changes.items():
+        setattr(db_repo, name, value)
+    try:
+        apply_upload_settings(repo_path, changes)
+        db.commit()
+    except Exception:
+        db.rollback()
+        apply_upload_settings(repo_path, previous)  # the DB is the source of truth, put git back
+        raise
+    db.refresh(db_repo)
+    return db_repo
+
+def fork_network(db: Session, repo_id: int) -> tuple[int, list[tuple[int, str]]]:
+    """Root repo id of repo_id's fork network, and (repo_id, reponame) of every repo in it."""
+    root = get_repo_by_id(db, repo_id)
+    while root.fork_of_id is not None:
+        root = get_repo_by_id(db, root.fork_of_id)
+    members, frontier = [(root.repo_id, root.reponame)], [root.repo_id]
+    while frontier:
+        rows = db.execute(select(Repository.repo_id, Repository.reponame)
+                            .where(Repository.fork_of_id.in_(frontier))).all()
+        members.extend((r.repo_id, r.reponame) for r in rows)
+        frontier = [r.repo_id for r in rows]
+    return root.repo_id, members
+
+def fork_repo(db: Session, source_id: int, fork_in: RepoCreate) -> Repository:
+    source = get_repo_by_id(db, source_id)
+    if source is None:
+        raise LookupError("Repository not found")
+    network_id, _ = fork_network(db, source_id)
+    try:
+        fork_path = create_fork_repo(get_repo_path(source.reponame), fork_in.reponame, network_id)
+    except FileExistsError:
+        raise ValueError("Repository folder already exists on disk")
+    db_repo = Repository(reponame=fork_in.reponame, maintainer_id=fork_in.maintainer_id, fork_of_id=source_id)
+    try:
+        db.add(db_repo)
+        db.commit()
+        db.refresh(db_repo)
+    except Exception:
+        db.rollback()
+        shutil.rmtree(fork_path, ignore_errors=True)
+        raise
+    forget_count("repos")
+    invalidate(repo_key(db_repo.repo_id), repo_name_key(db_repo.reponame))
+    return db_repo
+
+def _repos_stmt(page: int, size: int, after: Optional[str]):
+    stmt = (select(Repository.repo_id, Repository.reponame, User.username)
+              .join(User, User.user_id == Repository.maintainer_id)
+              .order_by(Repository.repo_id.desc()))
+    if after:
+        # keyset: walk the primary key instead of skipping rows
+        (last_repo_id,) = decode_cursor(after, 1, (int,))
+        stmt = stmt.where(Repository.repo_id < last_repo_id)
+    else:
+        stmt = stmt.offset((page - 1) * size)
+    return stmt.limit(size + 1)
+
+# page builders: rows -> plain dicts -> one model_validate for the whole page. That's a single
+# pydantic-core pass (cheaper than a constructor call per item, model_construct included), and the
+# endpoints hand the page to responses.DTOResponse, so it is never validated a second time
+def _repos_page(rows, page: int, size: int, total: Optional[int]) -> RepoPage:
+    next_cursor = encode_cursor(rows[size - 1].repo_id) if len(rows) > size else None
+    return RepoPage.model_validate({
+        "meta": page_meta(page, size, total, next_cursor),
+        "items": [
+            {"repo_id": repo_id, "reponame": reponame, "maintainer_name": username}
+            for repo_id, reponame, username in rows[:size]
         ]
-    )
+    })
+
+def list_repos(db: Session,
+               page: int = 1,
+               size: int = 20,
+               after: Optional[str] = None,
+               with_total: bool = True) -> RepoPage:
+    rows = db.execute(_repos_stmt(page, size, after)).all()
+    total = None
+    if with_total:
+        total = cached_count(("repos",))
+        if total is None:
+            total = remember_count(("repos",), db.execute(select(func.count(Repository.repo_id))).scalar())
+    return _repos_page(rows, page, size, total)
+
+async def list_repos_async(db: AsyncSession,
+                           page: int = 1,
+                           size: int = 20,
+                           after: Optional[str] = None,
+                           with_total: bool = True) -> RepoPage:
+    rows = (await db.execute(_repos_stmt(page, size, after))).all()
+    total = None
+    if with_total:
+        total = cached_count(("repos",))
+        if total is None:
+            total = remember_count(("repos",), await db.scalar(select(func.count(Repository.repo_id))))
+    return _repos_page(rows, page, size, total)
+
+# versions for conditional GETs (ETag / If-None-Match): one indexed lookup instead of the page
+def repo_list_version(db: Session) -> Optional[int]:
+    """Newest repo id: repos are only ever added (nothing renames or deletes them), so that's enough."""
+    return db.scalar(select(func.max(Repository.repo_id)))
+
+async def issue_list_version_async(db: AsyncSession, repo_id: int) -> Optional[tuple]:
+    """
+    (issue counter, newest updated_at) of a repo: moves on every new or
+    imported issue (the counter) and every comment (updated_at), via
+    ix_issue_repo_updated_num. None for an unknown repo.
+    """
+    newest = (select(func.max(Issue.updated_at)).where(Issue.repo_id == repo_id)).scalar_subquery()
+    row = (await db.execute(select(Repository.next_issue_num, newest)
+                              .where(Repository.repo_id == repo_id))).first()
+    return tuple(row) if row is not None else None
+
+async def issue_version_async(db: AsyncSession, repo_id: int, issue_num: int) -> Optional[datetime]:
+    # loads the row into the session, so the thread read that follows a miss doesn't fetch it again
+    issue_obj = await db.get(Issue, (repo_id, issue_num))
+    return issue_obj.updated_at if issue_obj is not None else None
 
 def get_repo_by_name(db,reponame) -> Optional[Repository]:
     temp=db.query(Repository).filter(Repository.reponame==reponame).first()
@@ -76,55 +228,280 @@ def get_repo_by_id(db,repo_id) -> Optional[Repository]:
     temp=db.query(Repository).filter(Repository.repo_id==repo_id).first()
     return temp
 
+async def get_repo_by_id_async(db: AsyncSession, repo_id: int) -> Optional[Repository]:
+    return await db.scalar(select(Repository).where(Repository.repo_id == repo_id))
+
+
+# cached lookups ~~~
+# read-through (see cache.py): plain dicts/values so the shared backend can hold them,
+# misses are cached too and dropped by the writers below
+def _repo_meta(repo: Optional[Repository]) -> Optional[dict]:
+    if repo is None:
+        return None
+    return {"repo_id": repo.repo_id, "reponame": repo.reponame,
+            "maintainer_id": repo.maintainer_id, "fork_of_id": repo.fork_of_id}
+
+def get_repo_meta(db: Session, repo_id: int) -> Optional[dict]:
+    return read_through(repo_key(repo_id), lambda: _repo_meta(get_repo_by_id(db, repo_id)))
+
+async def get_repo_meta_async(db: AsyncSession, repo_id: int) -> Optional[dict]:
+    async def load():
+        return _repo_meta(await get_repo_by_id_async(db, repo_id))
+    return await aread_through(repo_key(repo_id), load)
+
+def get_repo_id_by_name(db: Session, reponame: str) -> Optional[int]:
+    return read_through(repo_name_key(reponame),
+                        lambda: db.scalar(select(Repository.repo_id)
+                                            .where(Repository.reponame == reponame)
+                                            .order_by(Repository.repo_id).limit(1)))
+
+async def get_repo_id_by_name_async(db: AsyncSession, reponame: str) -> Optional[int]:
+    async def load():
+        return await db.scalar(select(Repository.repo_id)
+                                 .where(Repository.reponame == reponame)
+                                 .order_by(Repository.repo_id).limit(1))
+    return await aread_through(repo_name_key(reponame), load)
+
+def get_username(db: Session, user_id: int) -> Optional[str]:
+    return read_through(username_key(user_id),
+                        lambda: db.scalar(select(User.username).where(User.user_id == user_id)))
+
+async def get_username_async(db: AsyncSession, user_id: int) -> Optional[str]:
+    async def load():
+        return await db.scalar(select(User.username).where(User.user_id == user_id))
+    return await aread_through(username_key(user_id), load)
+
+def _roles_stmt(user_id: int, repo_id: int):
+    return (select(Role.rolename)
+              .join(user_repo_roles, user_repo_roles.c.role_id == Role.role_id)
+              .where(user_repo_roles.c.user_id == user_id, user_repo_roles.c.repo_id == repo_id)
+              .order_by(Role.rolename))
+
+def get_roles(db: Session, user_id: int, repo_id: int) -> list[str]:
+    """Role names a user holds on a repo, [] for none."""
+    return read_through(roles_key(user_id, repo_id),
+                        lambda: list(db.scalars(_roles_stmt(user_id, repo_id))))
+
+async def get_roles_async(db: AsyncSession, user_id: int, repo_id: int) -> list[str]:
+    async def load():
+        return list(await db.scalars(_roles_stmt(user_id, repo_id)))
+    return await aread_through(roles_key(user_id, repo_id), load)
+
+def grant_role(db: Session, user_id: int, repo_id: int, rolename: str) -> list[str]:
+    role = db.scalar(select(Role).where(Role.rolename == rolename))
+    if role is None:
+        role = Role(rolename=rolename)
+        db.add(role)
+        db.flush()
+    exists = db.scalar(select(user_repo_roles.c.role_id)
+                         .where(user_repo_roles.c.user_id == user_id,
+                                user_repo_roles.c.repo_id == repo_id,
+                                user_repo_roles.c.role_id == role.role_id))
+    if exists is None:
+        db.execute(user_repo_roles.insert().values(user_id=user_id, repo_id=repo_id, role_id=role.role_id))
+    db.commit()
+    invalidate(roles_key(user_id, repo_id))
+    return get_roles(db, user_id, repo_id)
+
+def revoke_role(db: Session, user_id: int, repo_id: int, rolename: Optional[str] = None) -> list[str]:
+    """Drop one role, or every role when rolename is None."""
+    stmt = user_repo_roles.delete().where(user_repo_roles.c.user_id == user_id,
+                                          user_repo_roles.c.repo_id == repo_id)
+    if rolename is not None:
+        stmt = stmt.where(user_repo_roles.c.role_id.in_(select(Role.role_id).where(Role.rolename == rolename)))
+    db.execute(stmt)
+    db.commit()
+    invalidate(roles_key(user_id, repo_id))
+    return get_roles(db, user_id, repo_id)
+
+
+# pagination helpers ~~~
+# totals are an estimate: COUNT(*) costs as much as the page itself, so it is
+# cached per process for a few seconds and dropped when we insert
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", "30"))
+_count_cache: dict[tuple, tuple[float, int]] = {}
+
+def cached_count(key: tuple) -> Optional[int]:
+    hit = _count_cache.get(key)
+    if hit is not None and time.monotonic() - hit[0] < COUNT_CACHE_TTL:
+        return hit[1]
+    return None
+
+def remember_count(key: tuple, total: int) -> int:
+    _count_cache[key] = (time.monotonic(), total)
+    return total
+
+def forget_count(*key) -> None:
+    _count_cache.pop(key, None)
+
+def encode_cursor(*values) -> str:
+    """Opaque keyset cursor: urlsafe base64 of the last row's sort key."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def _cursor_value_ok(value, kind: type) -> bool:
+    # JSON true/false would pass as ints, and a float key may come back as an int
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, (int, float) if kind is float else kind)
+
+def decode_cursor(cursor: str, arity: int, types: Optional[tuple] = None) -> list:
+    """Cursor -> its values; types (one per value) are checked before anything reaches SQL."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != arity:
+        raise ValueError("Invalid cursor")
+    if types is not None and not all(_cursor_value_ok(v, t) for v, t in zip(values, types)):
+        raise ValueError("Invalid cursor")
+    return values
+
+def page_meta(page: int, size: int, total: Optional[int], next_cursor: Optional[str]) -> PageMeta:
+    pages = (ceil(total / size) if total else 1) if total is not None else None
+    return PageMeta(page=page, size=size, total_size=total, total_pages=pages, next_cursor=next_cursor)
 
 # helper ~~~
 def hash_pwd(plaintext: str) -> str:
-    return bcrypt.hashpw(plaintext.encode(), bcrypt.gensalt()).decode()
+    # blocking, for sync callers; async code awaits password_hasher.hash() instead
+    return password_hasher.hash_blocking(plaintext)
 
 # ~~~
-def create_issue(db: Session,
-                 repo_id: int,
-                 author_id: int,
-                 issue_in: IssueCreate) -> Issue:
-    max_num = db.query(func.max(Issue.issue_num)).filter_by(repo_id=repo_id).scalar() or 0
-    next_num = max_num + 1
-    author_name = get_user_by_id(db, author_id).username
-    db_issue = Issue(repo_id=repo_id, author_id=author_id, issue_num=next_num, title=issue_in.title)
-    db.add(db_issue)
-    db.flush()
-
-    mongo_id = create_issue_doc(db_issue.issue_num, issue_in.title, issue_in.body, author_name)
-    db_issue.nosql_thread_id = str(mongo_id)
+# issue functions run on the AsyncSession (and the async Mongo store), so the
+# issue endpoints never touch the threadpool
+async def allocate_issue_nums(db: AsyncSession, repo_id: int, count: int = 1) -> int:
+    """
+    Reserve `count` consecutive issue numbers for a repo and return the first.
+    One atomic UPDATE ... RETURNING on the repo's counter: no MAX() scan, no
+    retry on (repo_id, issue_num) conflicts. The row lock is held only until
+    the surrounding (short) transaction commits; a rollback leaves a gap.
+    """
+    stmt = (update(Repository)
+              .where(Repository.repo_id == repo_id)
+              .values(next_issue_num=Repository.next_issue_num + count)
+              .returning(Repository.next_issue_num)
+              .execution_options(synchronize_session=False))
+    new_next = (await db.execute(stmt)).scalar_one_or_none()
+    if new_next is None:
+        raise ValueError("Repository not found")
+    return new_next - count
 
+def backfill_issue_counters(db: Session) -> None:
+    """One-off for databases created before repository.next_issue_num existed."""
+    max_num = (select(func.max(Issue.issue_num))
+                 .where(Issue.repo_id == Repository.repo_id)
+                 .scalar_subquery())
+    db.execute(update(Repository)
+                 .values(next_issue_num=func.coalesce(max_num, 0) + 1)
+                 .execution_options(synchronize_session=False))
     db.commit()
-    db.refresh(db_issue)
-    return db_issue
 
-def append_comment(db: Session,
-                   repo_id: int,
-                   issue_num: int,
-                   author_id: int,
-                   body: str) -> Issue:
+def backfill_log_counters(db: Session) -> None:
+    """Same, for repository.next_log_no."""
+    max_no = (select(func.max(AccessLog.log_no))
+                .where(AccessLog.repo_id == Repository.repo_id)
+                .scalar_subquery())
+    db.execute(update(Repository)
+                 .values(next_log_no=func.coalesce(max_no, 0) + 1)
+                 .execution_options(synchronize_session=False))
+    db.commit()
+
+# access log ~~~
+async def allocate_log_nos(db: AsyncSession, repo_id: int, count: int) -> int:
+    """Reserve a block of `count` log numbers for a repo, like allocate_issue_nums()."""
+    stmt = (update(Repository)
+              .where(Repository.repo_id == repo_id)
+              .values(next_log_no=Repository.next_log_no + count)
+              .returning(Repository.next_log_no)
+              .execution_options(synchronize_session=False))
+    new_next = (await db.execute(stmt)).scalar_one_or_none()
+    if new_next is None:
+        raise ValueError("Repository not found")
+    return new_next - count
+
+async def write_access_logs(db: AsyncSession, events: list[dict]) -> int:
+    """
+    Insert a batch of {repo_id, user_id, action, updated_at} events in one
+    transaction: one counter bump per repo, then a single multi-row INSERT.
+    """
+    by_repo: dict[int, list[dict]] = {}
+    for event in events:
+        by_repo.setdefault(event["repo_id"], []).append(event)
+    rows = []
     try:
-        issue_obj = db.query(Issue).filter_by(repo_id=repo_id,issue_num=issue_num).one()
-    except NoResultFound as e:
-        raise ValueError("Issue not found") from e
+        # fixed lock order on the repository rows, so two flushers can't deadlock
+        for repo_id in sorted(by_repo):
+            first = await allocate_log_nos(db, repo_id, len(by_repo[repo_id]))
+            rows.extend(dict(e, log_no=first + i) for i, e in enumerate(by_repo[repo_id]))
+        await db.execute(insert(AccessLog).values(rows))  # one INSERT ... VALUES (...), (...), ...
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return len(rows)
 
-    author = db.query(User).filter_by(user_id=author_id).one()
-    add_comment(issue_obj.nosql_thread_id, author.username, body)
-    issue_obj.updated_at = func.now() # -> set last-updated field
-    db.commit()
-    db.refresh(issue_obj)
+async def _find_issue(db: AsyncSession, repo_id: int, issue_num: int) -> Issue:
+    issue_obj = await db.get(Issue, (repo_id, issue_num))
+    if issue_obj is None:
+        raise ValueError("Issue not found")
     return issue_obj
 
-def get_issue_thread(db: Session,
-                     repo_id: int,
-                     issue_num: int) -> IssueDetailResponse:
+async def create_issue(db: AsyncSession,
+                       repo_id: int,
+                       author_id: int,
+                       issue_in: IssueCreate) -> Issue:
+    author = await get_username_async(db, author_id)
+    if author is None:
+        raise ValueError("Author not found")
+    # SQL commits first with a pre-generated thread id, so a failed commit never
+    # leaves an orphan thread; if the Mongo insert fails we undo the row instead
+    thread_id = ObjectId()
+    try:
+        next_num = await allocate_issue_nums(db, repo_id)
+        db_issue = Issue(repo_id=repo_id, author_id=author_id, issue_num=next_num,
+                         title=issue_in.title, nosql_thread_id=str(thread_id))
+        db.add(db_issue)
+        await db.flush()
+        await index_issue(db, repo_id, next_num, issue_in.title, issue_in.body)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    await db.refresh(db_issue)
     try:
-        issue_obj = db.query(Issue).filter_by(repo_id=repo_id,issue_num=issue_num).one()
-    except NoResultFound as e:
-        raise ValueError("Issue not found") from e
-    thread_doc = get_issue(issue_obj.nosql_thread_id)
+        await create_issue_doc(db_issue.issue_num, issue_in.title, issue_in.body, author,
+                               thread_id=thread_id)
+    except Exception:
+        await unindex_issue(db, repo_id, db_issue.issue_num)
+        await db.delete(db_issue)
+        await db.commit()
+        raise
+    forget_count("issues", repo_id)
+    return db_issue
+
+async def append_comment(db: AsyncSession,
+                         repo_id: int,
+                         issue_num: int,
+                         author_id: int,
+                         body: str) -> Issue:
+    issue_obj = await _find_issue(db, repo_id, issue_num)
+    author = await get_username_async(db, author_id)
+    if author is None:
+        raise ValueError("Author not found")
+    await add_comment(issue_obj.nosql_thread_id, author, body)
+    issue_obj.updated_at = utcnow() # -> set last-updated field
+    await index_comment(db, repo_id, issue_num, body)
+    await db.commit()
+    await db.refresh(issue_obj)
+    return issue_obj
+
+async def get_issue_thread(db: AsyncSession,
+                           repo_id: int,
+                           issue_num: int,
+                           comments_cursor: int = 0,
+                           comments_limit: int = 50) -> IssueDetailResponse:
+    issue_obj = await _find_issue(db, repo_id, issue_num)
+    thread_doc = await get_issue(issue_obj.nosql_thread_id)
+    comments, next_cursor = await get_comments(thread_doc, comments_cursor, comments_limit)
     return IssueDetailResponse(
         repo_id=repo_id,
         issue_num=issue_num,
@@ -132,23 +509,339 @@ def get_issue_thread(db: Session,
         author_id=issue_obj.author_id,
         body=thread_doc['body'],
         created_at=issue_obj.created_at,
-        comments=thread_doc['comments']
+        comment_count=thread_doc['comment_count'],
+        comments=comments,
+        next_comments_cursor=next_cursor
     )
 
+# sort= -> ordering column; both are keyset-paginated together with issue_num
+ISSUE_SORTS = {"created": Issue.created_at, "updated": Issue.updated_at}
+
+def _issues_stmt(repo_id: int, page: int, size: int, after: Optional[str],
+                 status: Optional[IssueStatus] = None,
+                 assignee_id: Optional[int] = None,
+                 author_id: Optional[int] = None,
+                 sort: str = "created"):
+    # only what IssueItem (and the cursor) needs: no ORM entities, no nosql_thread_id
+    sort_col = ISSUE_SORTS[sort]
+    stmt = (select(Issue.issue_num, Issue.title, Issue.author_id, Issue.status, Issue.created_at,
+                   sort_col.label("sort_key"))
+              .where(Issue.repo_id == repo_id)
+              .order_by(sort_col.desc(), Issue.issue_num.desc()))
+    # served straight off an ix_issue_repo_* index (models.py), filter and order at once: no filter,
+    # status alone (either sort), assignee or author alone with sort=created. Everything else
+    # (assignee/author with sort=updated, two or three filters) is the planner's pick of one of
+    # those, a filter on the remaining columns and, unless it kept the sort index, a sort of the
+    # repo's matching rows before the limit. Fine at the sizes we see; add an index if one shows up
+    if status is not None:
+        stmt = stmt.where(Issue.status == status)
+    if assignee_id is not None:
+        stmt = stmt.where(Issue.assignee_id == assignee_id)
+    if author_id is not None:
+        stmt = stmt.where(Issue.author_id == author_id)
+    if after:
+        # keyset on (sort column, issue_num)
+        sort_value, issue_num = decode_cursor(after, 2, (str, int))
+        try:
+            sort_value = datetime.fromisoformat(sort_value)
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid cursor") from e
+        stmt = stmt.where(tuple_(sort_col, Issue.issue_num) < (sort_value, issue_num))
+    else:
+        stmt = stmt.offset((page - 1) * size)
+    return stmt.limit(size + 1)
+
+def _issues_page(rows, page: int, size: int, total: Optional[int]) -> IssuePage:
+    next_cursor = None
+    if len(rows) > size:
+        last = rows[size - 1]
+        next_cursor = encode_cursor(last.sort_key.isoformat(), last.issue_num)
+    return IssuePage.model_validate({
+        "meta": page_meta(page, size, total, next_cursor),
+        "items": [
+            {"issue_num": r.issue_num, "title": r.title, "author_id": r.author_id,
+             "status": r.status.value, "created_at": r.created_at}
+            for r in rows[:size]
+        ]
+    })
+
+def _issue_count_key(repo_id: int, status, assignee_id, author_id) -> tuple:
+    # the unfiltered key is the one create_issue forgets; filtered totals just age out
+    if status is None and assignee_id is None and author_id is None:
+        return ("issues", repo_id)
+    return ("issues", repo_id, status, assignee_id, author_id)
+
+def _issue_count_stmt(repo_id: int, status=None, assignee_id=None, author_id=None):
+    stmt = select(func.count()).select_from(Issue).where(Issue.repo_id == repo_id)
+    if status is not None:
+        stmt = stmt.where(Issue.status == status)
+    if assignee_id is not None:
+        stmt = stmt.where(Issue.assignee_id == assignee_id)
+    if author_id is not None:
+        stmt = stmt.where(Issue.author_id == author_id)
+    return stmt
+
 def list_issues(db: Session,
                 repo_id: int,
                 page: int = 1,
-                size: int = 20) -> IssuePage:
-    offset = (page - 1) * size
-    total = db.query(func.count(Issue.issue_num)).filter_by(repo_id=repo_id).scalar()
-    rows = (db.query(Issue)
-              .filter_by(repo_id=repo_id)
-              .order_by(Issue.created_at.desc())
-              .offset(offset)
-              .limit(size)
-              .all())
-    pages = ceil(total / size) if total else 1
-    return IssuePage(
-        meta=PageMeta(page=page, size=size, total_size=total, total_pages=pages),
-        items=[IssueItem.model_validate(r) for r in rows]
-    )
\ No newline at end of file
+                size: int = 20,
+                after: Optional[str] = None,
+                with_total: bool = True,
+                status: Optional[IssueStatus] = None,
+                assignee_id: Optional[int] = None,
+                author_id: Optional[int] = None,
+                sort: str = "created") -> IssuePage:
+    rows = db.execute(_issues_stmt(repo_id, page, size, after, status, assignee_id, author_id, sort)).all()
+    total = None
+    if with_total:
+        key = _issue_count_key(repo_id, status, assignee_id, author_id)
+        total = cached_count(key)
+        if total is None:
+            total = remember_count(key, db.execute(_issue_count_stmt(repo_id, status, assignee_id, author_id)).scalar())
+    return _issues_page(rows, page, size, total)
+
+async def list_issues_async(db: AsyncSession,
+                            repo_id: int,
+                            page: int = 1,
+                            size: int = 20,
+                            after: Optional[str] = None,
+                            with_total: bool = True,
+                            status: Optional[IssueStatus] = None,
+                            assignee_id: Optional[int] = None,
+                            author_id: Optional[int] = None,
+                            sort: str = "created") -> IssuePage:
+    rows = (await db.execute(_issues_stmt(repo_id, page, size, after, status, assignee_id, author_id, sort))).all()
+    total = None
+    if with_total:
+        key = _issue_count_key(repo_id, status, assignee_id, author_id)
+        total = cached_count(key)
+        if total is None:
+            total = remember_count(key, await db.scalar(_issue_count_stmt(repo_id, status, assignee_id, author_id)))
+    return _issues_page(rows, page, size, total)
+
+# issue search ~~~
+async def search_issues(db: AsyncSession,
+                        repo_id: int,
+                        q: str,
+                        size: int = 20,
+                        after: Optional[str] = None) -> IssueSearchPage:
+    """Ranked hits from the issue_search index (see issue_search.py); Mongo is never read."""
+    cursor = None
+    if after:
+        rank, issue_num = decode_cursor(after, 2, (float, int))
+        cursor = (float(rank), issue_num)
+    rows = (await db.execute(search_stmt(db, repo_id, q, size, cursor))).all()
+    next_cursor = encode_cursor(rows[size - 1].rank, rows[size - 1].issue_num) if len(rows) > size else None
+    return IssueSearchPage.model_validate({
+        "items": [{"issue_num": r.issue_num, "title": r.title, "author_id": r.author_id,
+                   "status": r.status.value, "created_at": r.created_at, "rank": r.rank}
+                  for r in rows[:size]],
+        "next_cursor": next_cursor
+    })
+
+async def backfill_issue_search(db: AsyncSession, batch: int = 500) -> int:
+    """
+    One-off for issues created before issue_search existed: reads each missing
+    issue's thread (body and every comment) once. Returns how many were indexed.
+    """
+    done = 0
+    while True:
+        missing = (await db.execute(
+            select(Issue.repo_id, Issue.issue_num, Issue.title, Issue.nosql_thread_id)
+              .outerjoin(IssueSearch, (IssueSearch.repo_id == Issue.repo_id)
+                                      & (IssueSearch.issue_num == Issue.issue_num))
+              .where(IssueSearch.repo_id.is_(None))
+              .limit(batch))).all()
+        if not missing:
+            return done
+        for repo_id, issue_num, title, thread_id in missing:
+            thread = await get_issue(thread_id)
+            await index_issue(db, repo_id, issue_num, title or "", thread["body"])
+            start = 0
+            while start is not None:
+                comments, start = await get_comments(thread, start, 200)
+                for comment in comments:
+                    await index_comment(db, repo_id, issue_num, comment["body"])
+        await db.commit()
+        done += len(missing)
+
+# bulk import ~~~
+# each import_* takes one chunk of records (see bulk_import.py), writes it in one
+# transaction with multi-row INSERTs and returns an error (or None) per record
+def _insert_skipping_conflicts(db: AsyncSession, model):
+    """INSERT whose rows that hit a unique constraint are skipped (and so missing from RETURNING)."""
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        return pg_insert(model).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite_insert(model).on_conflict_do_nothing()
+    return insert(model)  # anywhere else one conflict fails the whole chunk
+
+def _first_of(keys: list) -> list[bool]:
+    """True for the first occurrence of each key: later duplicates within a chunk are rejected up front."""
+    seen = set()
+    firsts = []
+    for key in keys:
+        firsts.append(key not in seen)
+        seen.add(key)
+    return firsts
+
+async def _existing_users(db: AsyncSession, user_ids: set) -> dict[int, str]:
+    user_ids.discard(None)
+    if not user_ids:
+        return {}
+    rows = await db.execute(select(User.user_id, User.username).where(User.user_id.in_(user_ids)))
+    return dict(rows.all())
+
+async def _import_hash(user: UserImport) -> tuple[Optional[str], Optional[str]]:
+    if user.password_hash is not None:
+        if not user.password_hash.startswith("$2"):
+            return None, "password_hash: not a bcrypt hash"
+        return user.password_hash, None
+    if user.password is None:
+        return None, "password or password_hash is required"
+    try:
+        # no queue timeout: an import may wait its turn; it is capped below the login cap, see PasswordHasher
+        return await password_hasher.hash(user.password, bounded_wait=False), None
+    except ValueError as e:
+        return None, str(e)
+
+async def import_users(db: AsyncSession, users: list[UserImport]) -> list[Optional[str]]:
+    errors: list[Optional[str]] = [None] * len(users)
+    hashes = await asyncio.gather(*(_import_hash(u) for u in users))
+    rows, positions = [], {}
+    for i, (user, first, (hashed, error)) in enumerate(zip(users, _first_of([u.username for u in users]), hashes)):
+        if not first:
+            errors[i] = "Duplicate username in this import"
+        elif error is not None:
+            errors[i] = error
+        else:
+            positions[user.username] = i
+            rows.append({"username": user.username, "email": user.email, "password_hash": hashed})
+    if not rows:
+        return errors
+    try:
+        stmt = _insert_skipping_conflicts(db, User).values(rows).returning(User.user_id, User.username)
+        created = (await db.execute(stmt)).all()
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    created_names = {r.username for r in created}
+    for username, i in positions.items():
+        if username not in created_names:
+            errors[i] = "Username or email already exists"
+    await ainvalidate(*(username_key(r.user_id) for r in created))
+    return errors
+
+def _init_bare_dirs(reponames: list[str]) -> tuple[list, dict[str, str]]:
+    """init_bare() each name; returns the paths made and name -> error for the rest."""
+    made, failed = [], {}
+    for reponame in reponames:
+        try:
+            made.append(init_bare(reponame))
+        except FileExistsError:
+            failed[reponame] = "Repository folder already exists on disk"
+        except (ValueError, OSError) as e:
+            failed[reponame] = str(e)
+    return made, failed
+
+async def import_repos(db: AsyncSession, repos: list[RepoCreate]) -> list[Optional[str]]:
+    errors: list[Optional[str]] = [None] * len(repos)
+    maintainers = await _existing_users(db, {r.maintainer_id for r in repos})
+    rows, positions = [], {}
+    # folder names are global, so duplicates are by name alone
+    for i, (repo, first) in enumerate(zip(repos, _first_of([r.reponame for r in repos]))):
+        if not first:
+            errors[i] = "Duplicate reponame in this import"
+        elif not valid_repo_name(repo.reponame):
+            errors[i] = "Invalid repository name"
+        elif repo.maintainer_id not in maintainers:
+            errors[i] = "Maintainer not found"
+        else:
+            positions[repo.reponame] = i
+            rows.append({"reponame": repo.reponame, "maintainer_id": repo.maintainer_id})
+    if not rows:
+        return errors
+    made = []
+    try:
+        stmt = (_insert_skipping_conflicts(db, Repository).values(rows)
+                  .returning(Repository.repo_id, Repository.reponame))
+        created = (await db.execute(stmt)).all()
+        # folders only for rows that made it in; rows whose folder can't be made go again
+        made, failed = await run_in_threadpool(_init_bare_dirs, [r.reponame for r in created])
+        if failed:
+            await db.execute(delete(Repository).where(Repository.repo_id.in_(
+                [r.repo_id for r in created if r.reponame in failed])))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        for repo_path in made:
+            shutil.rmtree(repo_path, ignore_errors=True)
+        raise
+    created_names = {r.reponame for r in created}
+    for reponame, i in positions.items():
+        if reponame in failed:
+            errors[i] = failed[reponame]
+        elif reponame not in created_names:
+            errors[i] = "Repository already exists"
+    forget_count("repos")
+    await ainvalidate(*(key for r in created for key in (repo_key(r.repo_id), repo_name_key(r.reponame))))
+    return errors
+
+def _naive_utc(when: Optional[datetime]):
+    # timestamp columns are naive UTC; None -> now, like a normal insert
+    if when is None:
+        return utcnow()
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when
+
+async def import_issues(db: AsyncSession, repo_id: int, issues: list[IssueImport]) -> list[Optional[str]]:
+    """
+    Like create_issue() for a whole chunk: one block of issue numbers, one
+    INSERT for the rows, one for the search index, one insert_many for the
+    threads. SQL commits first; if the threads can't be written the chunk's
+    rows are deleted again.
+    """
+    errors: list[Optional[str]] = [None] * len(issues)
+    users = await _existing_users(db, {i.author_id for i in issues} | {i.assignee_id for i in issues})
+    valid = []
+    for n, issue in enumerate(issues):
+        if issue.author_id not in users:
+            errors[n] = "Author not found"
+        elif issue.assignee_id is not None and issue.assignee_id not in users:
+            errors[n] = "Assignee not found"
+        else:
+            valid.append(issue)
+    if not valid:
+        return errors
+    thread_ids = [ObjectId() for _ in valid]
+    try:
+        first = await allocate_issue_nums(db, repo_id, len(valid))
+        nums = list(range(first, first + len(valid)))
+        await db.execute(insert(Issue).values([
+            {"repo_id": repo_id, "issue_num": num, "author_id": issue.author_id,
+             "assignee_id": issue.assignee_id, "title": issue.title, "status": issue.status,
+             "nosql_thread_id": str(thread_id),
+             "created_at": _naive_utc(issue.created_at), "updated_at": _naive_utc(issue.created_at)}
+            for num, issue, thread_id in zip(nums, valid, thread_ids)
+        ]))
+        await index_issues(db, repo_id, [(num, issue.title, issue.body) for num, issue in zip(nums, valid)])
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    try:
+        await create_issue_docs([
+            thread_doc(num, issue.title, issue.body, users[issue.author_id], thread_id, issue.created_at)
+            for num, issue, thread_id in zip(nums, valid, thread_ids)
+        ])
+    except Exception:
+        await db.execute(delete(IssueSearch).where(IssueSearch.repo_id == repo_id, IssueSearch.issue_num.in_(nums)))
+        await db.execute(delete(Issue).where(Issue.repo_id == repo_id, Issue.issue_num.in_(nums)))
+        await db.commit()
+        await delete_issue_docs(thread_ids)  # any that did land (insert_many is unordered)
+        raise
+    forget_count("issues", repo_id)
+    return errors
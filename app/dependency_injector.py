@@ -1,7 +1,8 @@
 # database url, other dependencies go here
-from typing import Generator
+from typing import AsyncGenerator, Generator
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .database_sessions import SessionLocal   # the sessionmaker you already have
+from .database_sessions import SessionLocal, AsyncSessionLocal   # the sessionmakers you already have
 
 def get_db() -> Generator[Session, None, None]:
     """Provide a transactional database session per request."""
@@ -11,6 +12,11 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()                   # always returned to pool
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """Same thing for async handlers: no threadpool hop around the session."""
+    async with AsyncSessionLocal() as db:   # returned to the pool on exit
+        yield db
+
 def fake_current_user() -> int:
     """Hard-coded user 1 until real auth is wired."""
     return 5
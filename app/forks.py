@@ -0,0 +1,104 @@
+# forks share objects: a fork starts as refs + an alternates file, objects live in a per-network pool
+import asyncio
+import logging
+import os
+import shutil
+from pathlib import Path
+
+from fastapi import HTTPException
+
+from .git_ops import REPO_ROOT, GitScheduler, git_scheduler, init_bare, spawn_git
+
+# one bare "pool" repo per fork network (the root repo and every fork below it), never served over HTTP
+POOL_ROOT = Path(os.getenv("POOL_ROOT", REPO_ROOT / ".pools"))
+POOL_FETCH_TIMEOUT = float(os.getenv("POOL_FETCH_TIMEOUT", "600"))
+
+logger = logging.getLogger(__name__)
+
+_pool_locks: dict[int, asyncio.Lock] = {}
+
+
+def pool_path(network_id: int) -> Path:
+    return POOL_ROOT / f"network-{network_id}.git"
+
+
+def write_alternates(repo_path: Path, object_dirs: list[Path]) -> None:
+    """Point a repo at other object stores; written atomically since git may be reading it."""
+    info = repo_path / "objects" / "info"
+    info.mkdir(parents=True, exist_ok=True)
+    tmp = info / "alternates.tmp"
+    tmp.write_text("".join(f"{d.resolve()}\n" for d in object_dirs))
+    os.replace(tmp, info / "alternates")
+
+
+def create_fork_repo(source_path: Path, fork_name: str, network_id: int) -> Path:
+    """
+    Bare repo whose objects are borrowed, never copied: alternates point at the
+    network pool and, until the pool has caught up, at the source itself.
+    Only refs and HEAD are copied, so this costs the same for any repo size.
+    """
+    fork_path = init_bare(fork_name)
+    try:
+        sources = [pool_path(network_id) / "objects", source_path / "objects"]
+        write_alternates(fork_path, [d for d in sources if d.exists()])
+        if (source_path / "packed-refs").exists():
+            shutil.copy2(source_path / "packed-refs", fork_path / "packed-refs")
+        shutil.copytree(source_path / "refs", fork_path / "refs", dirs_exist_ok=True)
+        shutil.copy2(source_path / "HEAD", fork_path / "HEAD")
+    except Exception:
+        shutil.rmtree(fork_path, ignore_errors=True)
+        raise
+    return fork_path
+
+
+async def _git(*args: str, cwd: Path) -> None:
+    process = await spawn_git(*args, cwd=cwd)
+    process.stdin.close()
+    try:
+        _, error = await asyncio.wait_for(process.communicate(), POOL_FETCH_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise RuntimeError(f"git {args[0]} timed out")
+    if process.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {error.decode(errors='replace')}")
+
+
+async def _ensure_pool(pool: Path) -> None:
+    if (pool / "HEAD").exists():
+        return
+    pool.parent.mkdir(parents=True, exist_ok=True)
+    await _git("init", "--bare", "--quiet", str(pool), cwd=pool.parent)
+    # the pool is the only copy of shared objects: never let git prune it on its own
+    for key, value in (("gc.auto", "0"), ("gc.pruneExpire", "never"), ("core.logAllRefUpdates", "false")):
+        await _git("config", key, value, cwd=pool)
+
+
+async def refresh_pool(network_id: int, members: list[tuple[int, Path]]) -> None:
+    """
+    Fetch every member's refs into the pool under refs/members/<repo_id>/, then
+    point each member's alternates at the pool alone. Every object some member
+    can reach is then reachable from a pool ref, so repacking the members with
+    -l (and the pool without pruning) can never drop an object a fork needs.
+    Order matters: a member only stops borrowing from its source once the pool
+    holds everything the source had.
+    """
+    lock = _pool_locks.setdefault(network_id, asyncio.Lock())
+    async with lock:
+        pool = pool_path(network_id)
+        async with git_scheduler.slot(pool, GitScheduler.WRITE):
+            await _ensure_pool(pool)
+            for repo_id, member in members:
+                await _git("fetch", "--quiet", "--prune", "--no-tags", "--no-write-fetch-head", str(member),
+                           f"+refs/*:refs/members/{repo_id}/*", cwd=pool)
+        for _, member in members:
+            write_alternates(member, [pool / "objects"])
+        logger.info("fork pool refreshed", extra={"network": network_id, "members": len(members)})
+
+
+async def refresh_pool_quietly(network_id: int, members: list[tuple[int, Path]]) -> None:
+    """refresh_pool() for background tasks: forks work without it, so failures are only logged."""
+    try:
+        await refresh_pool(network_id, members)
+    except (HTTPException, RuntimeError, OSError):
+        logger.exception("fork pool refresh failed", extra={"network": network_id})
@@ -0,0 +1,334 @@
+# read-only access to git objects through long-lived `git cat-file --batch-command` processes
+import asyncio
+import logging
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+
+from .git_ops import spawn_git
+
+# decoded commits/trees/small blobs, shared by every repo (same SHA, same content)
+GIT_OBJECT_CACHE_BYTES = int(os.getenv("GIT_OBJECT_CACHE_BYTES", str(64 * 1024 * 1024)))
+# blobs bigger than this never go through the shared pipe or the cache; they stream from their own git
+GIT_BLOB_INLINE_MAX = int(os.getenv("GIT_BLOB_INLINE_MAX", str(1024 * 1024)))
+# idle cat-file processes beyond this many are closed, least recently used first
+GIT_CATFILE_MAX_PROCESSES = int(os.getenv("GIT_CATFILE_MAX_PROCESSES", "64"))
+GIT_CATFILE_TIMEOUT = float(os.getenv("GIT_CATFILE_TIMEOUT", "10"))
+
+logger = logging.getLogger(__name__)
+
+SHA_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+class ObjectMissing(LookupError):
+    """The revision/path doesn't name an object in this repository."""
+
+
+class GitTimeout(TimeoutError):
+    """A one-shot git command ran past GIT_CATFILE_TIMEOUT (and was killed)."""
+
+
+class ObjectInfo(NamedTuple):
+    sha: str
+    type: str
+    size: int
+
+
+class CatFile:
+    """
+    One `git cat-file --batch-command` for one repository.
+    Requests are serialised on a lock (the protocol is strictly request/reply);
+    a process that misbehaves is killed and respawned on the next request.
+    """
+
+    def __init__(self, repo_path: Path):
+        self.repo_path = repo_path
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.lock = asyncio.Lock()
+
+    async def _ensure(self) -> asyncio.subprocess.Process:
+        if self.process is None or self.process.returncode is not None:
+            self.process = await spawn_git("cat-file", "--batch-command", cwd=self.repo_path)
+        return self.process
+
+    async def _header(self, command: str, rev: str) -> tuple[asyncio.subprocess.Process, Optional[ObjectInfo]]:
+        if "\n" in rev or not rev:
+            raise ObjectMissing(rev)
+        process = await self._ensure()
+        process.stdin.write(f"{command} {rev}\n".encode())
+        await process.stdin.drain()
+        header = (await process.stdout.readline()).decode().rstrip("\n")
+        parts = header.split(" ")
+        if len(parts) == 3 and SHA_RE.match(parts[0]):
+            return process, ObjectInfo(parts[0], parts[1], int(parts[2]))
+        if header.endswith((" missing", " ambiguous")):
+            return process, None
+        raise RuntimeError(f"Unexpected cat-file reply: {header!r}")
+
+    async def _call(self, command: str, rev: str):
+        async with self.lock:
+            try:
+                return await asyncio.wait_for(self._exchange(command, rev), GIT_CATFILE_TIMEOUT)
+            except ObjectMissing:
+                raise
+            except (Exception, asyncio.CancelledError):
+                # a half-read reply would desync every later request: start over
+                await self.close()
+                raise
+
+    async def _exchange(self, command: str, rev: str):
+        process, info = await self._header(command, rev)
+        if info is None:
+            raise ObjectMissing(rev)
+        if command == "info":
+            return info
+        data = await process.stdout.readexactly(info.size + 1)
+        return info, data[:-1]
+
+    async def info(self, rev: str) -> ObjectInfo:
+        return await self._call("info", rev)
+
+    async def contents(self, rev: str) -> tuple[ObjectInfo, bytes]:
+        return await self._call("contents", rev)
+
+    async def close(self) -> None:
+        process, self.process = self.process, None
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.stdin.close()
+            await asyncio.wait_for(process.wait(), 1)
+        except (Exception, asyncio.CancelledError):
+            process.kill()
+            await process.wait()
+
+
+# ~~~ object decoding
+def _parse_person(value: str) -> dict:
+    # "Name <email> 1700000000 +0100"
+    name, _, rest = value.partition(" <")
+    email, _, stamp = rest.partition("> ")
+    seconds, _, offset = stamp.partition(" ")
+    try:
+        sign = -1 if offset.startswith("-") else 1
+        tz = timezone(sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])))
+        when = datetime.fromtimestamp(int(seconds), tz)
+    except (ValueError, IndexError):
+        when = None
+    return {"name": name, "email": email, "date": when}
+
+
+def parse_commit(sha: str, data: bytes) -> dict:
+    head, _, message = data.partition(b"\n\n")
+    commit = {"sha": sha, "tree": None, "parents": [], "author": None, "committer": None}
+    for line in head.decode(errors="replace").split("\n"):
+        key, _, value = line.partition(" ")
+        if key == "tree":
+            commit["tree"] = value
+        elif key == "parent":
+            commit["parents"].append(value)
+        elif key in ("author", "committer"):
+            commit[key] = _parse_person(value)
+    commit["message"] = message.decode(errors="replace")
+    return commit
+
+
+_MODE_TYPES = {b"40000": "tree", b"160000": "commit"}
+
+
+def parse_tree(data: bytes) -> list[dict]:
+    """Binary tree format: `<mode> <name>\\0<20-byte sha>` repeated."""
+    entries, pos = [], 0
+    while pos < len(data):
+        space = data.index(b" ", pos)
+        nul = data.index(b"\0", space)
+        mode = data[pos:space]
+        entries.append({
+            "name": data[space + 1:nul].decode(errors="surrogateescape"),
+            "mode": mode.decode().zfill(6),
+            "type": _MODE_TYPES.get(mode, "blob"),
+            "sha": data[nul + 1:nul + 21].hex(),
+        })
+        pos = nul + 21
+    return entries
+
+
+def _decode(info: ObjectInfo, data: bytes) -> Any:
+    if info.type == "commit":
+        return parse_commit(info.sha, data)
+    if info.type == "tree":
+        return parse_tree(data)
+    return data
+
+
+class GitObjectStore:
+    """
+    Per-repo cat-file processes plus a byte-bounded LRU of decoded objects keyed
+    by SHA. Objects are immutable, so the cache is never invalidated; only
+    resolving a name (ref, `rev:path`) goes back to git every time.
+    """
+
+    def __init__(self,
+                 max_bytes: int = GIT_OBJECT_CACHE_BYTES,
+                 max_processes: int = GIT_CATFILE_MAX_PROCESSES):
+        self.max_bytes = max_bytes
+        self.max_processes = max_processes
+        self._processes: "OrderedDict[str, CatFile]" = OrderedDict()
+        self._objects: "OrderedDict[str, tuple[ObjectInfo, Any]]" = OrderedDict()
+        self._closing: set[asyncio.Task] = set()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _catfile(self, repo_path: Path) -> CatFile:
+        key = str(repo_path)
+        catfile = self._processes.get(key)
+        if catfile is None:
+            self._trim_processes(self.max_processes - 1)
+            catfile = self._processes[key] = CatFile(repo_path)
+        self._processes.move_to_end(key)
+        return catfile
+
+    def _trim_processes(self, keep: int) -> None:
+        idle = [k for k, c in self._processes.items() if not c.lock.locked()]
+        for key in idle[:max(0, len(self._processes) - keep)]:
+            task = asyncio.get_running_loop().create_task(self._processes.pop(key).close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def resolve(self, repo_path: Path, rev: str) -> ObjectInfo:
+        """
+        Name -> (sha, type, size), always asked of the repo's own git: the object
+        cache is shared, so this is also what proves the object is in *this* repo.
+        """
+        return await self._catfile(repo_path).info(rev)
+
+    async def read(self, repo_path: Path, rev: str, expect: Optional[str] = None) -> tuple[ObjectInfo, Any]:
+        """
+        Decoded object: commit -> dict, tree -> list of entries, blob -> bytes.
+        Only for SHAs that came out of resolve() or out of objects read from the
+        same repo (parents, tree entries), never straight from a request.
+        """
+        cached = self._objects.get(rev) if SHA_RE.match(rev) else None
+        if cached is None:
+            self.misses += 1
+            info, data = await self._catfile(repo_path).contents(rev)
+            cached = (info, _decode(info, data))
+            self._remember(cached)
+        else:
+            self.hits += 1
+            self._objects.move_to_end(rev)
+        if expect is not None and cached[0].type != expect:
+            raise ObjectMissing(f"{rev} is a {cached[0].type}, not a {expect}")
+        return cached
+
+    def _remember(self, entry: tuple[ObjectInfo, Any]) -> None:
+        info = entry[0]
+        if info.size > self.max_bytes // 8 or info.sha in self._objects:
+            return
+        self._objects[info.sha] = entry
+        self.total_bytes += info.size
+        while self.total_bytes > self.max_bytes and self._objects:
+            _, (old, _) = self._objects.popitem(last=False)
+            self.total_bytes -= old.size
+            self.evictions += 1
+
+    async def commit(self, repo_path: Path, rev: str) -> dict:
+        info = await self.resolve(repo_path, f"{rev}^{{commit}}")
+        return (await self.read(repo_path, info.sha, "commit"))[1]
+
+    async def log(self, repo_path: Path, head: str, skip: int, limit: int) -> tuple[list[dict], bool]:
+        """
+        Commits reachable from `head`, `git log --date-order` style: newest committer
+        date first, but never a parent before all of its children, so same-second
+        merges and skewed clocks keep a stable order. git picks the SHAs (skip/limit
+        over one fixed head, so a page boundary never repeats or drops a commit),
+        the commits themselves come from the object cache. Returns (page, more).
+        """
+        returncode, output, error = await _run_git(repo_path, "rev-list", "--date-order", f"--skip={skip}",
+                                                   f"--max-count={limit + 1}", head)
+        if returncode != 0:
+            raise RuntimeError(error.decode(errors="replace"))
+        shas = output.decode().split()
+        page = [(await self.read(repo_path, sha, "commit"))[1] for sha in shas[:limit]]
+        return page, len(shas) > limit
+
+    async def split_ref_path(self, repo_path: Path, ref_and_path: str) -> tuple[ObjectInfo, str]:
+        """
+        `main/src/app.py` or `feature/x/src/app.py` -> (commit, path). Refs may
+        contain slashes, so the shortest leading run of segments that names a
+        commit wins, same as the web UIs do.
+        """
+        parts = ref_and_path.strip("/").split("/")
+        for i in range(1, len(parts) + 1):
+            try:
+                commit = await self.resolve(repo_path, "/".join(parts[:i]) + "^{commit}")
+            except ObjectMissing:
+                continue
+            return commit, "/".join(parts[i:])
+        raise ObjectMissing(ref_and_path)
+
+    async def close(self) -> None:
+        processes, self._processes = list(self._processes.values()), OrderedDict()
+        await asyncio.gather(*(c.close() for c in processes), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "processes": len(self._processes),
+            "objects": len(self._objects),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+object_store = GitObjectStore()
+
+
+async def _run_git(repo_path: Path, *args: str) -> tuple[int, bytes, bytes]:
+    """A one-shot git command: (returncode, stdout, stderr), killed like CatFile if it hangs."""
+    process = await spawn_git(*args, cwd=repo_path)
+    try:
+        output, error = await asyncio.wait_for(process.communicate(), timeout=GIT_CATFILE_TIMEOUT)
+    except (Exception, asyncio.CancelledError) as e:
+        # timed out, or the request went away: don't leave the child running
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        if isinstance(e, asyncio.TimeoutError):
+            raise GitTimeout(f"git {args[0]} timed out after {GIT_CATFILE_TIMEOUT:g}s") from e
+        raise
+    return process.returncode, output, error
+
+
+async def list_refs(repo_path: Path) -> bytes:
+    """`git for-each-ref` output, one `<sha> <type> <refname>` per line, plus HEAD's target."""
+    returncode, output, error = await _run_git(repo_path, "for-each-ref",
+                                               "--format=%(objectname) %(objecttype) %(refname)",
+                                               "refs/heads", "refs/tags")
+    if returncode != 0:
+        raise RuntimeError(error.decode(errors="replace"))
+    _, target, _ = await _run_git(repo_path, "symbolic-ref", "-q", "HEAD")
+    return b"HEAD " + target.strip() + b"\n" + output
+
+
+def parse_refs(raw: bytes) -> tuple[Optional[str], list[dict]]:
+    """list_refs() output -> (HEAD's branch or None, [{name, sha, type}])."""
+    lines = raw.decode(errors="replace").splitlines()
+    head = lines[0].partition(" ")[2] if lines and lines[0].startswith("HEAD ") else ""
+    refs = []
+    for line in lines[1:]:
+        sha, kind, name = line.split(" ", 2)
+        refs.append({"name": name, "sha": sha, "type": kind})
+    return head or None, refs
+
+
+def looks_binary(data: bytes) -> bool:
+    # same heuristic as git: a NUL in the first 8000 bytes
+    return b"\0" in data[:8000]
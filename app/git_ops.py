@@ -1,23 +1,64 @@
-import subprocess
 import asyncio
+import logging
+import re
+import subprocess
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import AsyncGenerator, AsyncIterator
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Optional
 
+import anyio
 from fastapi import HTTPException
-from git import Repo
+from starlette.responses import StreamingResponse
 import os
 
+from .cache import MISSING, local_cache
+from .metrics import GIT_BYTES_IN, GIT_BYTES_OUT, GIT_PACK_BYTES, GIT_RUN_SECONDS, GIT_SPAWN_SECONDS
+
 BASE_DIR = Path(__file__).resolve().parent.parent
-REPO_ROOT = BASE_DIR / "tmp" / "repos"
+REPO_ROOT = Path(os.getenv("REPO_ROOT", BASE_DIR / "tmp" / "repos"))
+# pass the client's Git-Protocol header on to git (protocol v2: ls-refs with ref-prefix, v2 fetch)
+GIT_PROTOCOL_PASSTHROUGH = os.getenv("GIT_PROTOCOL_PASSTHROUGH", "true").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger(__name__)
 
 # ~~~ helper
+def valid_repo_name(repo_name: str) -> bool:
+    """No empty, `..` or dot-prefixed segments: keeps names inside REPO_ROOT and away from .pools"""
+    return all(part and not part.startswith(".") for part in repo_name.split("/"))
+
 def get_repo_path(repo_name: str) -> Path:
     """Get the filesystem path for a repository"""
+    # only hits are cached (in-process), so a freshly created repo is never hidden
+    key = f"repo-path:{repo_name}"
+    cached = local_cache.get(key)
+    if cached is not MISSING:
+        return cached
     repo_path = REPO_ROOT / f"{repo_name}.git"
-    if not repo_path.exists():
+    if not valid_repo_name(repo_name) or not repo_path.exists():
         raise HTTPException(status_code=404, detail="Repository not found")
+    local_cache.set(key, repo_path)
     return repo_path
 
+_PROTOCOL_ITEM_RE = re.compile(r"^[A-Za-z0-9._-]+(=[A-Za-z0-9._-]+)?$")
+
+def git_protocol(header: Optional[str]) -> Optional[str]:
+    """
+    Git-Protocol header -> GIT_PROTOCOL value: colon-separated `key[=value]`
+    items (e.g. `version=2`), anything that doesn't look like one is dropped.
+    None when there's nothing to pass on.
+    """
+    if not header or not GIT_PROTOCOL_PASSTHROUGH:
+        return None
+    return ":".join(item for item in header.split(":") if _PROTOCOL_ITEM_RE.match(item)) or None
+
+def is_protocol_v2(protocol: Optional[str]) -> bool:
+    return protocol is not None and "version=2" in protocol.split(":")
+
+def protocol_env(protocol: Optional[str]) -> Optional[dict]:
+    return {"GIT_PROTOCOL": protocol} if protocol else None
+
 def packet_line(data: str) -> bytes:
     """
     Create a Git packet-line format string.
@@ -29,53 +70,439 @@ def packet_line(data: str) -> bytes:
         return f"{size:04x}".encode() + data.encode()
     return b"0000"  # flush packet
 
+async def advertise_refs(repo_path: Path, service: str, timeout: float = 10,
+                         protocol: Optional[str] = None) -> bytes:
+    """
+    Run `git <service> --advertise-refs` and return the full smart-HTTP
+    advertisement body (service announcement + flush + refs).
+    For a protocol v2 upload-pack that is just git's capability list, without
+    any refs or the service line (same as git http-backend does).
+    """
+    process = await spawn_git(service.replace("git-", ""), "--stateless-rpc", "--advertise-refs",
+                              str(repo_path), cwd=repo_path, env=protocol_env(protocol))
+    try:
+        output, error = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        _observe_exit(process, "timeout")
+        logger.warning("ref advertisement timed out", extra={"repo": str(repo_path), "service": service})
+        raise HTTPException(status_code=504, detail="Git ref advertisement timed out")
+
+    if process.returncode != 0:
+        _observe_exit(process, "error")
+        error_msg = error.decode(errors="replace") if error else "Unknown error"
+        logger.error("ref advertisement failed", extra={"repo": str(repo_path), "service": service,
+                                                          "returncode": process.returncode, "stderr": error_msg})
+        raise HTTPException(status_code=500, detail=f"Git command failed: {error_msg}")
+    _observe_exit(process, "ok")
+    GIT_BYTES_OUT.inc(len(output), command=process.git_command)
+    GIT_PACK_BYTES.observe(len(output), command=process.git_command)
+
+    if service == "git-upload-pack" and is_protocol_v2(protocol):
+        return output
+    # Build response in Git packet-line format
+    return packet_line(f"# service={service}\n") + b"0000" + output
+
+async def run_upload_pack(repo_path: Path, body: bytes, protocol: Optional[str], timeout: float = 10) -> bytes:
+    """One buffered `upload-pack --stateless-rpc` round, for small replies such as v2 ls-refs."""
+    process = await spawn_git("upload-pack", "--stateless-rpc", str(repo_path), cwd=repo_path,
+                              env=protocol_env(protocol))
+    GIT_BYTES_IN.inc(len(body), command=process.git_command)
+    try:
+        output, error = await asyncio.wait_for(process.communicate(body), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        _observe_exit(process, "timeout")
+        raise HTTPException(status_code=504, detail="Git upload-pack timed out")
+    if process.returncode != 0:
+        _observe_exit(process, "error")
+        error_msg = error.decode(errors="replace") if error else "Unknown error"
+        logger.error("upload-pack failed", extra={"repo": str(repo_path), "returncode": process.returncode,
+                                                  "stderr": error_msg})
+        raise HTTPException(status_code=500, detail=f"Git command failed: {error_msg}")
+    _observe_exit(process, "ok")
+    GIT_BYTES_OUT.inc(len(output), command=process.git_command)
+    return output
+
 # git init a bare repo
 def init_bare(repo_name: str) -> Path:
+    if not valid_repo_name(repo_name):
+        raise ValueError("Invalid repository name")
     repo_path = REPO_ROOT / f"{repo_name}.git"
     repo_path.parent.mkdir(parents=True, exist_ok=True)
     if repo_path.exists():
         raise FileExistsError("Bare repo already exists")
+    from git import Repo   # GitPython is only needed here: importing it on first use keeps worker boot fast
+
     Repo.init(repo_path, bare=True)
     return repo_path.resolve()
 
+# Repository column -> upload-pack config key. Shallow clones (--depth, deepen-since/not) need
+# no switch: upload-pack always negotiates them. These two are off by default in git.
+UPLOAD_SETTINGS = {
+    "allow_filter": "uploadpack.allowFilter",                   # clone/fetch --filter=blob:none, tree:0...
+    "allow_any_sha1_in_want": "uploadpack.allowAnySHA1InWant",  # a partial clone fetching missing blobs by id
+}
+
+def apply_upload_settings(repo_path: Path, settings: dict) -> None:
+    """
+    Write UPLOAD_SETTINGS flags into the bare repo's config, so every
+    upload-pack (and the capabilities it advertises) picks them up without
+    a DB lookup per request. git swaps config in through a lock file, which
+    also moves the ref cache fingerprint.
+    """
+    for name, value in settings.items():
+        subprocess.run(["git", "--git-dir", str(repo_path), "config", UPLOAD_SETTINGS[name],
+                        "true" if value else "false"],
+                       check=True, capture_output=True, timeout=10)
+
+# ~~~ git process scheduler
+GIT_MAX_PROCESSES = int(os.getenv("GIT_MAX_PROCESSES", "32"))
+GIT_MAX_PER_REPO = int(os.getenv("GIT_MAX_PER_REPO", "8"))
+GIT_MAX_QUEUE = int(os.getenv("GIT_MAX_QUEUE", "64"))
+GIT_QUEUE_TIMEOUT = float(os.getenv("GIT_QUEUE_TIMEOUT", "30"))
+GIT_RETRY_AFTER = int(os.getenv("GIT_RETRY_AFTER", "5"))
+
+
+class GitSlot:
+    """Permission to run one git process; release() is idempotent."""
+
+    def __init__(self, scheduler: "GitScheduler", repo: str, kind: str):
+        self.scheduler = scheduler
+        self.repo = repo
+        self.kind = kind
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class GitScheduler:
+    """
+    Caps how many git processes run at once: a global budget, a per-repository
+    cap, and separate FIFO queues for reads (upload-pack) and writes
+    (receive-pack) that are served round-robin so neither side starves.
+    A full queue or a wait longer than queue_timeout is a 503 with Retry-After.
+    maintenance() takes a repo out of the write rotation until it's done.
+    """
+    READ = "read"
+    WRITE = "write"
+
+    def __init__(self,
+                 max_processes: int = GIT_MAX_PROCESSES,
+                 max_per_repo: int = GIT_MAX_PER_REPO,
+                 max_queue: int = GIT_MAX_QUEUE,
+                 queue_timeout: float = GIT_QUEUE_TIMEOUT):
+        self.max_processes = max_processes
+        self.max_per_repo = max_per_repo
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.active_per_repo: Counter = Counter()
+        self.queues: dict[str, deque] = {self.READ: deque(), self.WRITE: deque()}
+        self._next_kind = self.READ
+        # repos under maintenance take no new writes; maintenance waits for running ones
+        self.active_writes: Counter = Counter()
+        self.maintaining: set[str] = set()
+        self._writes_drained: dict[str, asyncio.Future] = {}
+        # tuning stats
+        self.granted = Counter()
+        self.rejected = Counter()
+        self.timed_out = Counter()
+        self.wait_seconds_total = Counter()
+        self.wait_seconds_max = Counter()
+
+    def _has_capacity(self, repo: str, kind: str) -> bool:
+        return (self.active < self.max_processes and self.active_per_repo[repo] < self.max_per_repo
+                and not (kind == self.WRITE and repo in self.maintaining))
+
+    def _grant(self, repo: str, kind: str, enqueued_at: float) -> GitSlot:
+        waited = time.monotonic() - enqueued_at
+        self.active += 1
+        self.active_per_repo[repo] += 1
+        if kind == self.WRITE:
+            self.active_writes[repo] += 1
+        self.granted[kind] += 1
+        self.wait_seconds_total[kind] += waited
+        self.wait_seconds_max[kind] = max(self.wait_seconds_max[kind], waited)
+        return GitSlot(self, repo, kind)
+
+    def _busy(self, kind: str) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail=f"Too many git {kind} operations in flight, try again shortly",
+            headers={"Retry-After": str(GIT_RETRY_AFTER)},
+        )
+
+    async def acquire(self, repo_path: Path, kind: str) -> GitSlot:
+        repo = str(repo_path)
+        queue = self.queues[kind]
+        enqueued_at = time.monotonic()
+        if not queue and self._has_capacity(repo, kind):
+            return self._grant(repo, kind, enqueued_at)
+        if len(queue) >= self.max_queue:
+            self.rejected[kind] += 1
+            raise self._busy(kind)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (repo, future, enqueued_at)
+        queue.append(waiter)
+        try:
+            return await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out[kind] += 1
+            raise self._busy(kind)
+        except asyncio.CancelledError:
+            # granted at the same moment we were cancelled: hand the slot straight back
+            if future.done() and not future.cancelled():
+                future.result().release()
+            raise
+        finally:
+            if waiter in queue:
+                queue.remove(waiter)
+
+    @asynccontextmanager
+    async def slot(self, repo_path: Path, kind: str):
+        slot = await self.acquire(repo_path, kind)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def _release(self, slot: GitSlot) -> None:
+        self.active -= 1
+        self.active_per_repo[slot.repo] -= 1
+        if self.active_per_repo[slot.repo] <= 0:
+            del self.active_per_repo[slot.repo]
+        if slot.kind == self.WRITE:
+            self.active_writes[slot.repo] -= 1
+            if self.active_writes[slot.repo] <= 0:
+                del self.active_writes[slot.repo]
+                drained = self._writes_drained.pop(slot.repo, None)
+                if drained is not None and not drained.done():
+                    drained.set_result(None)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def maintenance(self, repo_path: Path):
+        """
+        Exclusive against writes to one repo: new writes queue up (and 503 after
+        queue_timeout like any other wait), in-flight ones are waited out first.
+        Reads carry on. Maintenance itself doesn't take a process slot; the
+        maintenance worker runs one job at a time at low priority.
+        """
+        repo = str(repo_path)
+        if repo in self.maintaining:
+            raise RuntimeError(f"{repo} is already under maintenance")
+        self.maintaining.add(repo)
+        try:
+            if self.active_writes[repo]:
+                drained = self._writes_drained[repo] = asyncio.get_running_loop().create_future()
+                await drained
+            yield
+        finally:
+            self.maintaining.discard(repo)
+            self._writes_drained.pop(repo, None)
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.active < self.max_processes:
+            picked = self._pick()
+            if picked is None:
+                return
+            kind, (repo, future, enqueued_at) = picked
+            future.set_result(self._grant(repo, kind, enqueued_at))
+
+    def _pick(self):
+        """First runnable waiter, alternating between the read and write queues."""
+        other = self.WRITE if self._next_kind == self.READ else self.READ
+        for kind in (self._next_kind, other):
+            queue = self.queues[kind]
+            for waiter in queue:
+                repo, future, _ = waiter
+                if future.done():
+                    continue
+                if self.active_per_repo[repo] < self.max_per_repo and not (
+                        kind == self.WRITE and repo in self.maintaining):
+                    queue.remove(waiter)
+                    self._next_kind = self.WRITE if kind == self.READ else self.READ
+                    return kind, waiter
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "active_repos": len(self.active_per_repo),
+            "maintaining": len(self.maintaining),
+            "max_processes": self.max_processes,
+            "max_per_repo": self.max_per_repo,
+            "queues": {
+                kind: {
+                    "depth": len(self.queues[kind]),
+                    "granted": self.granted[kind],
+                    "rejected": self.rejected[kind],
+                    "timed_out": self.timed_out[kind],
+                    "wait_seconds_total": round(self.wait_seconds_total[kind], 6),
+                    "wait_seconds_max": round(self.wait_seconds_max[kind], 6),
+                }
+                for kind in (self.READ, self.WRITE)
+            },
+        }
+
+
+git_scheduler = GitScheduler()
+
+
 # git stuff
+GIT_CHUNK_SIZE = 64 * 1024
+GIT_STDERR_LIMIT = 8 * 1024
+
+
+class GitStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for the smart-HTTP endpoints.
+    It owns the git process (and its scheduler slot, if any): the request body is
+    pumped into git while the reply streams out, and whatever happens to the
+    connection the process is reaped and the slot handed back.
+    on_success runs once the whole reply is out and git exited 0 (unlike
+    background, which also runs after a failed git).
+    """
+    def __init__(self,
+                 process: asyncio.subprocess.Process,
+                 request_stream: Optional[AsyncIterable[bytes]] = None,
+                 slot: Optional["GitSlot"] = None,
+                 sink=None,
+                 on_success: Optional[Callable[[], Awaitable[None]]] = None,
+                 **kwargs):
+        super().__init__(stream_git_process(process, request_stream, sink), **kwargs)
+        self.process = process
+        self.slot = slot
+        self.on_success = on_success
+
+    async def listen_for_disconnect(self, receive) -> None:
+        # receive() belongs to the request body pump, not to starlette's disconnect listener
+        await anyio.sleep_forever()
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.process.returncode is None:
+                self.process.kill()
+                await self.process.wait()
+            if self.slot is not None:
+                self.slot.release()
+        if self.on_success is not None and self.process.returncode == 0:
+            await self.on_success()
+
+
+async def spawn_git(*args: str, cwd: Optional[Path] = None, env: Optional[dict] = None) -> asyncio.subprocess.Process:
+    """Start a git subprocess with all three pipes attached (never blocks the loop); env is added to ours."""
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        "git", *args,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=str(cwd) if cwd else None,
+        env={**os.environ, **env} if env else None,
+    )
+    # remembered on the process for the run-time and byte metrics
+    process.git_command = args[0]
+    process.spawned_at = started
+    GIT_SPAWN_SECONDS.observe(time.perf_counter() - started, command=process.git_command)
+    return process
+
+
+def _observe_exit(process: asyncio.subprocess.Process, outcome: str) -> None:
+    GIT_RUN_SECONDS.observe(time.perf_counter() - process.spawned_at,
+                            command=process.git_command, outcome=outcome)
+
+
+async def _feed_stdin(process: asyncio.subprocess.Process,
+                      request_stream: Optional[AsyncIterable[bytes]]) -> None:
+    """Copy request chunks into git's stdin as they arrive, honouring pipe backpressure."""
+    try:
+        if request_stream is not None:
+            async for chunk in request_stream:
+                if not chunk:
+                    continue
+                process.stdin.write(chunk)
+                GIT_BYTES_IN.inc(len(chunk), command=process.git_command)
+                await process.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # git stopped reading early; its exit code tells the real story
+        pass
+    finally:
+        process.stdin.close()
+
+
+async def _drain_stderr(process: asyncio.subprocess.Process) -> bytes:
+    """Read stderr concurrently so a chatty git can't fill the pipe and deadlock; keep the tail."""
+    tail = b""
+    while True:
+        chunk = await process.stderr.read(GIT_CHUNK_SIZE)
+        if not chunk:
+            return tail
+        tail = (tail + chunk)[-GIT_STDERR_LIMIT:]
+
+
 async def stream_git_process(
-        process: subprocess.Popen,
-        request_body: bytes = None
+        process: asyncio.subprocess.Process,
+        request_stream: Optional[AsyncIterable[bytes]] = None,
+        sink=None
 ) -> AsyncIterator[bytes]:
     """
     Stream data through a Git subprocess.
-    Optionally sends request_body to stdin, then yields stdout.
+    request_stream is pumped into stdin while stdout is yielded back at the same time,
+    so only a few chunks per request are ever held in memory.
+    An optional sink (write/commit/abort, e.g. a pack cache writer) gets a copy of
+    stdout and is only committed when git exits cleanly.
     """
+    feeder = asyncio.create_task(_feed_stdin(process, request_stream))
+    stderr_reader = asyncio.create_task(_drain_stderr(process))
+    committed = False
+    outcome = "aborted"
+    sent = 0
     try:
-        # If we have request body, write it to git's stdin
-        if request_body:
-            process.stdin.write(request_body)
-            process.stdin.close()
-
-        # Stream the output back
         while True:
-            chunk = process.stdout.read(8192)
+            chunk = await process.stdout.read(GIT_CHUNK_SIZE)
             if not chunk:
                 break
+            if sink is not None:
+                await sink.write(chunk)
+            sent += len(chunk)
             yield chunk
 
-        # Wait for process to complete
-        process.wait()
-
-        # Check for errors
-        if process.returncode != 0:
-            stderr_output = process.stderr.read()
-            print(f"Git process error: {stderr_output.decode()}")
-
-    except Exception as e:
-        print(f"Error streaming git process: {e}")
-        if process.poll() is None:
+        await feeder
+        returncode = await process.wait()
+        stderr_output = await stderr_reader
+        if returncode != 0:
+            outcome = "error"
+            logger.error("git process failed", extra={"command": process.git_command, "returncode": returncode,
+                                                      "stderr": stderr_output.decode(errors="replace")})
+        else:
+            outcome = "ok"
+            if sink is not None:
+                await sink.commit()
+                committed = True
+    except BaseException:
+        # client went away or the pump failed; don't leave git running
+        if process.returncode is None:
             process.kill()
         raise
     finally:
-        if process.stdout:
-            process.stdout.close()
-        if process.stderr:
-            process.stderr.close()
-            process.stderr.close()
\ No newline at end of file
+        GIT_BYTES_OUT.inc(sent, command=process.git_command)
+        GIT_PACK_BYTES.observe(sent, command=process.git_command)
+        for task in (feeder, stderr_reader):
+            if not task.done():
+                task.cancel()
+        if process.returncode is None:
+            await process.wait()
+        _observe_exit(process, outcome)
+        if sink is not None and not committed:
+            await sink.abort()
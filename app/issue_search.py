@@ -0,0 +1,95 @@
+# issue search: an inverted index in SQL (issue_search table), fed as issues and comments come in
+import os
+import re
+from typing import Optional
+
+from sqlalchemy import Float, and_, delete, func, insert, literal, literal_column, select, tuple_, update
+from sqlalchemy.dialects.postgresql import TSVECTOR, to_tsvector, websearch_to_tsquery
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Issue, IssueSearch
+
+SEARCH_CONFIG = os.getenv("SEARCH_CONFIG", "english")   # postgres text search configuration
+# only this much of any one body/comment is indexed (to_tsvector on megabytes is slow and can overflow)
+SEARCH_MAX_TEXT = int(os.getenv("SEARCH_MAX_TEXT", "65536"))
+# once an issue's tsvector is this big, later comments stop being indexed (postgres caps a tsvector at 1 MB)
+SEARCH_MAX_DOC_BYTES = int(os.getenv("SEARCH_MAX_DOC_BYTES", str(512 * 1024)))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _is_postgres(db: AsyncSession) -> bool:
+    return db.bind.dialect.name == "postgresql"
+
+
+def _weighted(text: str, weight: str):
+    return func.setweight(to_tsvector(SEARCH_CONFIG, text[:SEARCH_MAX_TEXT]), literal_column(f"'{weight}'"),
+                          type_=TSVECTOR)
+
+
+def _tokens(text: str) -> str:
+    # fallback document: space-padded lowercase words, so " word " matches whole words only
+    return " " + " ".join(_WORD_RE.findall(text[:SEARCH_MAX_TEXT].lower())) + " "
+
+
+def _document(db: AsyncSession, title: str, body: str):
+    if _is_postgres(db):
+        return _weighted(title, "A").op("||", return_type=TSVECTOR)(_weighted(body, "B"))
+    return _tokens(title) + _tokens(body)
+
+
+async def index_issue(db: AsyncSession, repo_id: int, issue_num: int, title: str, body: str) -> None:
+    """Index row for a new issue; runs inside the caller's transaction."""
+    await index_issues(db, repo_id, [(issue_num, title, body)])
+
+
+async def index_issues(db: AsyncSession, repo_id: int, issues: list[tuple[int, str, str]]) -> None:
+    """Same for many (issue_num, title, body) at once: one multi-row INSERT."""
+    if issues:
+        await db.execute(insert(IssueSearch).values([
+            {"repo_id": repo_id, "issue_num": num, "document": _document(db, title, body)}
+            for num, title, body in issues
+        ]))
+
+
+async def index_comment(db: AsyncSession, repo_id: int, issue_num: int, body: str) -> None:
+    """Append a comment to the issue's index row in place: no re-read of the thread."""
+    stmt = update(IssueSearch).where(IssueSearch.repo_id == repo_id, IssueSearch.issue_num == issue_num)
+    if _is_postgres(db):
+        stmt = (stmt.where(func.pg_column_size(IssueSearch.document) < SEARCH_MAX_DOC_BYTES)
+                    .values(document=IssueSearch.document.op("||", return_type=TSVECTOR)(_weighted(body, "C"))))
+    else:
+        stmt = stmt.values(document=IssueSearch.document + _tokens(body))
+    await db.execute(stmt.execution_options(synchronize_session=False))
+
+
+async def unindex_issue(db: AsyncSession, repo_id: int, issue_num: int) -> None:
+    await db.execute(delete(IssueSearch).where(IssueSearch.repo_id == repo_id, IssueSearch.issue_num == issue_num))
+
+
+def search_stmt(db: AsyncSession, repo_id: int, q: str, size: int, after: Optional[tuple[float, int]]):
+    """
+    Postgres: `document @@ websearch_to_tsquery(q)` through the (repo_id, document) GIN index,
+    ranked by ts_rank (title hits beat body hits beat comment hits).
+    Elsewhere: every word of q must appear, unranked (rank is always 0);
+    good enough for dev databases, it scans the repo's index rows.
+    Keyset on (rank desc, issue_num desc) either way.
+    """
+    if _is_postgres(db):
+        query = websearch_to_tsquery(SEARCH_CONFIG, q)
+        match = IssueSearch.document.op("@@")(query)
+        rank = func.ts_rank(IssueSearch.document, query, type_=Float)
+    else:
+        words = _WORD_RE.findall(q.lower())
+        match = and_(*(IssueSearch.document.contains(f" {w} ", autoescape=True) for w in words)) \
+            if words else literal(False)
+        rank = literal(0.0, Float)
+    rank = rank.label("rank")
+    stmt = (select(Issue.issue_num, Issue.title, Issue.author_id, Issue.status, Issue.created_at, rank)
+              .join(IssueSearch, and_(IssueSearch.repo_id == Issue.repo_id,
+                                      IssueSearch.issue_num == Issue.issue_num))
+              .where(IssueSearch.repo_id == repo_id, match)
+              .order_by(rank.desc(), Issue.issue_num.desc()))
+    if after is not None:
+        stmt = stmt.where(tuple_(rank.element, Issue.issue_num) < tuple_(literal(after[0], Float), after[1]))
+    return stmt.limit(size + 1)
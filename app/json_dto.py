@@ -1,8 +1,11 @@
 # pydantic schemas / dtos
 from datetime import datetime
+from typing import Optional
 
 from pydantic import BaseModel, ConfigDict
 
+from .models import IssueStatus, RoleName
+
 
 class RepoCreate(BaseModel):
     reponame: str
@@ -12,9 +15,17 @@ class RepoResponse(BaseModel):
     repo_id: int
     reponame: str
     maintainer_id : int
+    fork_of_id: Optional[int] = None
+    allow_filter: bool = False
+    allow_any_sha1_in_want: bool = False
     class Config:
         from_attributes=True
 
+# PATCH body: only the fields that are sent change
+class RepoSettings(BaseModel):
+    allow_filter: Optional[bool] = None
+    allow_any_sha1_in_want: Optional[bool] = None
+
 class RepoItem(BaseModel):
     repo_id: int
     reponame: str
@@ -25,6 +36,10 @@ class UserCreate(BaseModel):
     email: str
     password: str
 
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+
 class UserResponse(BaseModel):
     user_id : int
     username: str
@@ -33,6 +48,15 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes=True
 
+# ~~~
+class RoleGrant(BaseModel):
+    role: RoleName
+
+class RolesResponse(BaseModel):
+    user_id: int
+    repo_id: int
+    roles: list[str]
+
 # ~~~
 class IssueCreate(BaseModel):
     title: str
@@ -56,7 +80,7 @@ class CommentItem(BaseModel):
     body: str
     timestamp: datetime
 
-# to see issue and its comment thread
+# to see issue and one page of its comment thread
 class IssueDetailResponse(BaseModel):
     repo_id: int
     issue_num: int
@@ -64,14 +88,17 @@ class IssueDetailResponse(BaseModel):
     author_id: int
     body: str
     created_at: datetime
+    comment_count: int
     comments: list[CommentItem]
+    next_comments_cursor: Optional[int] = None # pass back as comments_cursor, None on the last page
 
 # issue page
 class PageMeta(BaseModel):
     page: int
     size: int
-    total_size: int
-    total_pages: int
+    total_size: Optional[int] = None   # cached estimate, None when with_total=false
+    total_pages: Optional[int] = None
+    next_cursor: Optional[str] = None  # pass back as after= for the next page, None on the last one
 
 # issue details in the page that shows all issues
 class IssueItem(BaseModel):
@@ -86,6 +113,79 @@ class IssuePage(BaseModel):
     meta: PageMeta
     items: list[IssueItem]
 
+# search hit: an issue item plus its rank (higher is better; always 0 without postgres)
+class IssueSearchItem(IssueItem):
+    rank: float
+
+class IssueSearchPage(BaseModel):
+    items: list[IssueSearchItem]
+    next_cursor: Optional[str] = None  # pass back as after=, None on the last page
+
 class RepoPage(BaseModel):
     meta: PageMeta
-    items: list[RepoItem]
\ No newline at end of file
+    items: list[RepoItem]
+
+# ~~~ bulk import, one of these per NDJSON line
+class UserImport(BaseModel):
+    username: str
+    email: str
+    password: Optional[str] = None
+    password_hash: Optional[str] = None  # an existing bcrypt hash, taken as is (no re-hashing)
+
+class IssueImport(BaseModel):
+    title: str
+    body: str
+    author_id: int
+    assignee_id: Optional[int] = None
+    status: IssueStatus = IssueStatus.OPEN
+    created_at: Optional[datetime] = None  # keep the original date when migrating
+
+class ImportRecordError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: list[ImportRecordError]  # first IMPORT_MAX_ERRORS only
+    errors_truncated: bool = False
+
+# ~~~ git object browsing
+class RefItem(BaseModel):
+    name: str
+    sha: str
+    type: str
+
+class RefList(BaseModel):
+    head: Optional[str] = None  # branch HEAD points at
+    items: list[RefItem]
+
+class GitPerson(BaseModel):
+    name: str
+    email: str
+    date: Optional[datetime] = None
+
+class CommitItem(BaseModel):
+    sha: str
+    tree: Optional[str] = None
+    parents: list[str]
+    author: Optional[GitPerson] = None
+    committer: Optional[GitPerson] = None
+    message: str
+
+class CommitPage(BaseModel):
+    items: list[CommitItem]
+    next_cursor: Optional[str] = None  # pass back as after=, None once history runs out
+
+class TreeEntry(BaseModel):
+    name: str
+    path: str
+    mode: str
+    type: str  # blob, tree or commit (submodule)
+    sha: str
+
+class TreeResponse(BaseModel):
+    commit: str
+    sha: str
+    path: str
+    entries: list[TreeEntry]
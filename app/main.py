@@ -1,24 +1,87 @@
+import hashlib
 import os
 import logging
-import subprocess
+from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
+from typing import Optional
 
-from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from starlette.background import BackgroundTask
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from starlette.responses import StreamingResponse
 
-from . import models, json_dto, crud, git_ops
+from . import models, json_dto, crud, bulk_import, forks, git_ops, git_objects, mongo_store
+from .cache import cache
+from .compression import CompressionMiddleware, request_body
+from .access_log import access_logger, ACCESS_LOG_EVENTS
+from .maintenance import maintenance_worker
 from .crud import get_issue_thread
-from .dependency_injector import get_db, fake_current_user
-from .database_sessions import engine
-from .git_ops import get_repo_path
-
-from .json_dto import RepoCreate, IssueCreate, CommentCreate, IssueDetailResponse, IssuePage, RepoPage
-
-app = FastAPI(title="Private Repo Manager")
-models.Base.metadata.create_all(bind=engine)
+from .dependency_injector import get_db, get_async_db, fake_current_user
+from .database_sessions import engine, async_engine, AsyncSessionLocal
+from .git_ops import get_repo_path, GitStreamingResponse, GitScheduler, git_scheduler
+from .ref_cache import ref_cache
+from .pack_cache import pack_cache, peek_request, replay, clone_cache_key, ls_refs_key, pkt_lines, PackSniffer
+from .git_objects import object_store, ObjectMissing, GitTimeout
+from .log_config import configure_logging
+from .passwords import password_hasher
+from .readiness import readiness
+from .responses import DTOResponse
+from .metrics import MetricsMiddleware, registry, stats_collector
+
+from .json_dto import RepoCreate, IssueCreate, CommentCreate, IssueDetailResponse, IssuePage, IssueSearchPage, RepoPage
+from .json_dto import RefList, CommitPage, TreeResponse, RoleGrant, RolesResponse, ImportReport
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # stores come up here, not at import; /ready says when they are (see readiness.py)
+    await readiness.start()
+    await access_logger.start()
+    await maintenance_worker.start()
+    yield
+    await maintenance_worker.stop()
+    await access_logger.stop()   # flush queued access logs while the engine is still up
+    await readiness.stop()
+    await object_store.close()
+    await mongo_store.close_store()
+    await async_engine.dispose()
+    engine.dispose()
+    password_hasher.shutdown()
+
+configure_logging()
+app = FastAPI(title="Private Repo Manager", lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)   # outermost: its timings include compression
+# no create_all here: the schema is the job of `python -m app.cli migrate`, once per deploy
 logger = logging.getLogger(__name__)
 
+# component stats, refreshed into gauges on every scrape
+stats_collector("git_scheduler", "Git process scheduler", git_scheduler.stats)
+stats_collector("ref_cache", "Ref advertisement cache", ref_cache.stats)
+stats_collector("pack_cache", "Full-clone pack cache", pack_cache.stats)
+stats_collector("git_objects", "Git object cache", object_store.stats)
+stats_collector("metadata_cache", "Repo/user/role lookup cache", cache.stats)
+stats_collector("passwords", "bcrypt process pool", password_hasher.stats)
+
+# ~~~ conditional GETs
+# weak ETags: same JSON, but the bytes differ with the Content-Encoding picked for each client
+def make_etag(*parts) -> str:
+    return 'W/"' + hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest() + '"'
+
+def cache_headers(etag: Optional[str]) -> dict:
+    # no-cache: clients keep the body but revalidate every time
+    return {"ETag": etag, "Cache-Control": "private, no-cache"} if etag else {}
+
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    """A 304 if the client's If-None-Match already has etag, else None."""
+    candidates = request.headers.get("if-none-match")
+    if etag and candidates is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in candidates.split(",")}
+        if "*" in tags or etag.removeprefix("W/") in tags:
+            return Response(status_code=304, headers=cache_headers(etag))
+    return None
+
 # repo endpoints
 # making new repository
 @app.post("/repos", response_model=json_dto.RepoResponse, tags=["repos"])
@@ -33,57 +96,319 @@ def init_repo(payload: RepoCreate, db: Session = Depends(get_db)):
 
 # get all repos
 @app.get("/repos", response_model=RepoPage, tags=["repos"])
-def read_repos(page: int = Query(1, ge=1),
+def read_repos(request: Request,
+               page: int = Query(1, ge=1),
                size: int = Query(20, ge=1, le=100),
+               after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+               with_total: bool = Query(True),
                db: Session = Depends(get_db)):
-    return crud.list_repos(db, page, size)
+    etag = make_etag("repos", crud.repo_list_version(db), request.url.query)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    try:
+        return DTOResponse(crud.list_repos(db, page, size, after, with_total), headers=cache_headers(etag))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# forking: constant time, objects are shared through the network's pool (see forks.py)
+@app.post("/repos/{repo_id}/fork", response_model=json_dto.RepoResponse, tags=["repos"])
+def fork_repo(repo_id: int, payload: RepoCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    try:
+        fork = crud.fork_repo(db, repo_id, payload)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # pull the new fork (and everyone else in the network) into the pool after responding
+    network_id, members = crud.fork_network(db, fork.repo_id)
+    background_tasks.add_task(forks.refresh_pool_quietly, network_id,
+                              [(member_id, get_repo_path(name)) for member_id, name in members])
+    background_tasks.add_task(access_logger.record, repo_id, payload.maintainer_id, models.Action.FORK)
+    return fork
+
+# per-repo upload-pack switches: partial clone (--filter) and lazy blob fetches
+@app.patch("/repos/{repo_id}/settings", response_model=json_dto.RepoResponse, tags=["repos"])
+def update_repo_settings(repo_id: int, payload: json_dto.RepoSettings, db: Session = Depends(get_db)):
+    try:
+        repo = crud.update_repo_settings(db, repo_id, payload)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    # capabilities changed: drop advertisements and packs negotiated under the old ones
+    repo_path = get_repo_path(repo.reponame)
+    ref_cache.invalidate(repo_path)
+    pack_cache.invalidate(repo_path)
+    return repo
 
 # Issues Endpoints
 # making new issue
 @app.post("/repos/{repo_id}/issues", response_model=json_dto.IssueResponse, tags=["repos"])
-def new_issue(repo_id: int,
-              payload: IssueCreate,
-              current_user_id: int = Depends(fake_current_user),
-              db: Session = Depends(get_db)):
-    return crud.create_issue(db=db, repo_id=repo_id, author_id=current_user_id, issue_in=payload)
+async def new_issue(repo_id: int,
+                    payload: IssueCreate,
+                    current_user_id: int = Depends(fake_current_user),
+                    db: AsyncSession = Depends(get_async_db)):
+    try:
+        return await crud.create_issue(db=db, repo_id=repo_id, author_id=current_user_id, issue_in=payload)
+    except ValueError as e:   # repository or author not found
+        raise HTTPException(status_code=404, detail=str(e))
 
 # adding a comment to issue
 @app.post("/repos/{repo_id}/issues/{issue_num}/comments")
-def add_comment(repo_id: int,
-                issue_num: int,
-                payload: CommentCreate,
-                current_user_id: int = Depends(fake_current_user),
-                db: Session = Depends(get_db)):
-    crud.append_comment(db, repo_id, issue_num, current_user_id, payload.body)
+async def add_comment(repo_id: int,
+                      issue_num: int,
+                      payload: CommentCreate,
+                      current_user_id: int = Depends(fake_current_user),
+                      db: AsyncSession = Depends(get_async_db)):
+    try:
+        await crud.append_comment(db, repo_id, issue_num, current_user_id, payload.body)
+    except ValueError as e:   # issue or author not found
+        raise HTTPException(status_code=404, detail=str(e))
     return {"reply": "comment added"}
 
+# full-text search over titles, bodies and comments (declared before /issues/{issue_num})
+@app.get("/repos/{repo_id}/issues/search", response_model=IssueSearchPage)
+async def search_issues(repo_id: int,
+                        request: Request,
+                        q: str = Query(..., min_length=1, max_length=256),
+                        size: int = Query(20, ge=1, le=100),
+                        after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+                        db: AsyncSession = Depends(get_async_db)):
+    # comments bump updated_at too, and they are part of what's searched
+    version = await crud.issue_list_version_async(db, repo_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Repository not found")
+    etag = make_etag("search", repo_id, version, request.url.query)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    try:
+        return DTOResponse(await crud.search_issues(db, repo_id, q, size, after), headers=cache_headers(etag))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # opening and viewing an issue thread
 @app.get("/repos/{repo_id}/issues/{issue_num}", response_model=IssueDetailResponse)
-def read_issue(repo_id: int,
-               issue_num: int,
-               db: Session = Depends(get_db)):
-    return get_issue_thread(db, repo_id, issue_num)
+async def read_issue(repo_id: int,
+                     issue_num: int,
+                     request: Request,
+                     comments_cursor: int = Query(0, ge=0),
+                     comments_limit: int = Query(50, ge=1, le=200),
+                     db: AsyncSession = Depends(get_async_db)):
+    # updated_at moves with every comment: a 304 skips the Mongo thread read altogether
+    version = await crud.issue_version_async(db, repo_id, issue_num)
+    etag = make_etag("issue", repo_id, issue_num, version, request.url.query) if version is not None else None
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    try:
+        thread = await get_issue_thread(db, repo_id, issue_num, comments_cursor, comments_limit)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return DTOResponse(thread, headers=cache_headers(etag))
 # view all issue
 @app.get("/repos/{repo_id}/issues", response_model=IssuePage)
-def read_issues(repo_id: int,
-                page: int = Query(1, ge=1),
-                size: int = Query(20, ge=1, le=100),
-                db: Session = Depends(get_db)):
-    return crud.list_issues(db, repo_id, page, size)
+async def read_issues(repo_id: int,
+                      request: Request,
+                      page: int = Query(1, ge=1),
+                      size: int = Query(20, ge=1, le=100),
+                      after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+                      with_total: bool = Query(True),
+                      status: Optional[models.IssueStatus] = Query(None),
+                      assignee: Optional[int] = Query(None, description="assignee user id"),
+                      author: Optional[int] = Query(None, description="author user id"),
+                      sort: str = Query("created", pattern="^(created|updated)$"),
+                      db: AsyncSession = Depends(get_async_db)):
+    version = await crud.issue_list_version_async(db, repo_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Repository not found")
+    etag = make_etag("issues", repo_id, version, request.url.query)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    try:
+        issues = await crud.list_issues_async(db, repo_id, page, size, after, with_total,
+                                              status=status, assignee_id=assignee, author_id=author, sort=sort)
+        return DTOResponse(issues, headers=cache_headers(etag))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 # User endpoints
 # making new users
 @app.post("/users", response_model=json_dto.UserResponse, tags=["users"])
-def create_user(user: json_dto.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_name(db, user.username)
+async def create_user(user: json_dto.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await crud.get_user_by_name_async(db, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username exists")
-    return crud.create_user(db, user)
+    try:
+        return await crud.create_user_async(db, user)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+# checking a password (bcrypt in passwords.py's process pool); no sessions/tokens yet
+@app.post("/login", response_model=json_dto.UserResponse, tags=["users"])
+async def login(payload: json_dto.LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await crud.authenticate(db, payload.username, payload.password)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    return user
+
+# Bulk import endpoints ~~~
+# NDJSON bodies (one JSON object per line), written in chunks as they stream in (see bulk_import.py)
+@app.post("/import/users", response_model=ImportReport, tags=["import"])
+async def import_users(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Lines are UserImport: password, or an existing bcrypt password_hash."""
+    return await bulk_import.run_import(request.stream(), json_dto.UserImport,
+                                        lambda users: crud.import_users(db, users))
+
+@app.post("/import/repos", response_model=ImportReport, tags=["import"])
+async def import_repos(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Lines are RepoCreate; each new repo gets its bare repository on disk."""
+    return await bulk_import.run_import(request.stream(), RepoCreate,
+                                        lambda repos: crud.import_repos(db, repos))
+
+@app.post("/repos/{repo_id}/import/issues", response_model=ImportReport, tags=["import"])
+async def import_issues(repo_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Lines are IssueImport; numbers are handed out in line order."""
+    if await crud.get_repo_meta_async(db, repo_id) is None:
+        raise HTTPException(status_code=404, detail="Repository not found")
+    return await bulk_import.run_import(request.stream(), json_dto.IssueImport,
+                                        lambda issues: crud.import_issues(db, repo_id, issues))
+
+# Role endpoints
+@app.get("/repos/{repo_id}/roles/{user_id}", response_model=RolesResponse, tags=["users"])
+async def read_roles(repo_id: int, user_id: int, db: AsyncSession = Depends(get_async_db)):
+    return {"user_id": user_id, "repo_id": repo_id, "roles": await crud.get_roles_async(db, user_id, repo_id)}
+
+def check_role_change(db: Session, repo_id: int, user_id: int, current_user_id: int) -> None:
+    """Both ends must exist, and only the repo's maintainer hands out or takes back roles."""
+    repo = crud.get_repo_meta(db, repo_id)
+    if repo is None or crud.get_username(db, user_id) is None:
+        raise HTTPException(status_code=404, detail="Repository or user not found")
+    if repo["maintainer_id"] != current_user_id:
+        raise HTTPException(status_code=403, detail="Only the repository maintainer can change roles")
+
+@app.put("/repos/{repo_id}/roles/{user_id}", response_model=RolesResponse, tags=["users"])
+def grant_role(repo_id: int, user_id: int, payload: RoleGrant,
+               current_user_id: int = Depends(fake_current_user), db: Session = Depends(get_db)):
+    check_role_change(db, repo_id, user_id, current_user_id)
+    return {"user_id": user_id, "repo_id": repo_id, "roles": crud.grant_role(db, user_id, repo_id, payload.role.value)}
+
+@app.delete("/repos/{repo_id}/roles/{user_id}", response_model=RolesResponse, tags=["users"])
+def revoke_role(repo_id: int, user_id: int, role: Optional[models.RoleName] = None,
+                current_user_id: int = Depends(fake_current_user), db: Session = Depends(get_db)):
+    check_role_change(db, repo_id, user_id, current_user_id)
+    return {"user_id": user_id, "repo_id": repo_id,
+            "roles": crud.revoke_role(db, user_id, repo_id, role.value if role else None)}
+
+# Git browsing endpoints ~~~
+# read straight from the bare repos through git_objects, no clone needed
+async def repo_path_for(db: AsyncSession, repo_id: int) -> Path:
+    repo = await crud.get_repo_meta_async(db, repo_id)
+    if repo is None:
+        raise HTTPException(status_code=404, detail="Repository not found")
+    return get_repo_path(repo["reponame"])
+
+@app.get("/repos/{repo_id}/refs", response_model=RefList, tags=["git"])
+async def read_refs(repo_id: int, db: AsyncSession = Depends(get_async_db)):
+    repo_path = await repo_path_for(db, repo_id)
+
+    async def load() -> bytes:
+        async with git_scheduler.slot(repo_path, GitScheduler.READ):
+            return await git_objects.list_refs(repo_path)
+
+    # same fingerprint-checked cache as the smart-HTTP advertisement
+    try:
+        raw = await ref_cache.get_or_load(repo_path, "for-each-ref", load)
+    except GitTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    head, refs = git_objects.parse_refs(raw)
+    return {"head": head, "items": refs}
+
+@app.get("/repos/{repo_id}/commits", response_model=CommitPage, tags=["git"])
+async def read_commits(repo_id: int,
+                       ref: str = Query("HEAD"),
+                       limit: int = Query(30, ge=1, le=100),
+                       after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+                       db: AsyncSession = Depends(get_async_db)):
+    repo_path = await repo_path_for(db, repo_id)
+    skip = 0
+    if after:
+        # (head the first page resolved to, commits already shown): the same walk, further along
+        try:
+            head, skip = crud.decode_cursor(after, 2, (str, int))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not git_objects.SHA_RE.match(head) or skip < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        ref = head   # re-checked against this repo like any ref
+    try:
+        head = (await object_store.resolve(repo_path, f"{ref}^{{commit}}")).sha
+        async with git_scheduler.slot(repo_path, GitScheduler.READ):
+            commits, more = await object_store.log(repo_path, head, skip, limit)
+    except ObjectMissing:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    except GitTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    return {"items": commits, "next_cursor": crud.encode_cursor(head, skip + limit) if more else None}
+
+@app.get("/repos/{repo_id}/tree/{ref_path:path}", response_model=TreeResponse, tags=["git"])
+async def read_tree(repo_id: int, ref_path: str, db: AsyncSession = Depends(get_async_db)):
+    """Directory listing at `<ref>/<path>`; the ref may itself contain slashes."""
+    repo_path = await repo_path_for(db, repo_id)
+    try:
+        commit, path = await object_store.split_ref_path(repo_path, ref_path)
+        tree = await object_store.resolve(repo_path, f"{commit.sha}:{path}")
+        _, entries = await object_store.read(repo_path, tree.sha, "tree")
+    except ObjectMissing:
+        raise HTTPException(status_code=404, detail="Path not found or not a directory")
+    prefix = f"{path}/" if path else ""
+    return {"commit": commit.sha, "sha": tree.sha, "path": path,
+            "entries": [dict(e, path=prefix + e["name"]) for e in entries]}
+
+@app.get("/repos/{repo_id}/blob/{ref_path:path}", tags=["git"])
+async def read_blob(repo_id: int, ref_path: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Raw file contents at `<ref>/<path>`. The blob SHA is a strong ETag, so a
+    revalidation after the ref moved but the file didn't is a cheap 304.
+    """
+    repo_path = await repo_path_for(db, repo_id)
+    try:
+        commit, path = await object_store.split_ref_path(repo_path, ref_path)
+        blob = await object_store.resolve(repo_path, f"{commit.sha}:{path}")
+    except ObjectMissing:
+        raise HTTPException(status_code=404, detail="File not found")
+    if blob.type != "blob":
+        raise HTTPException(status_code=404, detail="Not a file")
+
+    etag = f'"{blob.sha}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "X-Content-Type-Options": "nosniff"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    if blob.size <= git_objects.GIT_BLOB_INLINE_MAX:
+        _, data = await object_store.read(repo_path, blob.sha, "blob")
+        media_type = "application/octet-stream" if git_objects.looks_binary(data) else "text/plain; charset=utf-8"
+        return Response(content=data, media_type=media_type, headers=headers)
+
+    # big blobs stream from their own git instead of tying up the shared cat-file pipe
+    slot = await git_scheduler.acquire(repo_path, GitScheduler.READ)
+    try:
+        process = await git_ops.spawn_git("cat-file", "blob", blob.sha, cwd=repo_path)
+        return GitStreamingResponse(
+            process,
+            slot=slot,
+            media_type="application/octet-stream",
+            headers={**headers, "Content-Length": str(blob.size)}
+        )
+    except Exception as e:
+        slot.release()
+        raise HTTPException(status_code=500, detail=f"Reading blob failed: {str(e)}")
 
 # GIT ENDPOINTS ~~~
 @app.get("/{repo_name:path}.git/info/refs")
-async def git_info_refs(repo_name: str, service: str):
+async def git_info_refs(repo_name: str, service: str, request: Request):
     """
     Step 1 : Handle info/refs for both clone and push operations.
 
@@ -92,84 +417,82 @@ async def git_info_refs(repo_name: str, service: str):
     - For push: service=git-receive-pack
     """
 
-    print(f"DEBUG: Received info/refs request for repo: {repo_name}, service: {service}")
-
     # Validate service parameter
     if service not in ["git-upload-pack", "git-receive-pack"]:
         raise HTTPException(status_code=400, detail="Invalid service")
-    git_command = service.replace("git-", "")
+    repo_path = get_repo_path(repo_name)
+    # v2 clients get git's capability list here and ask for refs later, through ls-refs
+    protocol = git_ops.git_protocol(request.headers.get("git-protocol"))
+
+    async def advertise() -> bytes:
+        async with git_scheduler.slot(repo_path, GitScheduler.READ):
+            return await git_ops.advertise_refs(repo_path, service, protocol=protocol)
+
+    # Advertise refs, served from cache while the repo's refs are unchanged
     try:
-        repo_path = get_repo_path(repo_name)
-        print(f"DEBUG: Repository path: {repo_path}")
-        print(f"DEBUG: Path exists: {repo_path.exists()}")
-    except HTTPException as e:
-        print(f"DEBUG: Repository not found: {e.detail}")
+        response_body = await ref_cache.get_or_load(repo_path, (service, protocol), advertise)
+    except HTTPException:
         raise
-
-    # Execute git command to advertise refs
+    except Exception:
+        logger.exception("ref advertisement crashed", extra={"repo": repo_name, "service": service})
+        raise HTTPException(status_code=500, detail="Ref advertisement failed")
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("info/refs", extra={"repo": repo_name, "service": service, "protocol": protocol,
+                                         "bytes": len(response_body)})
+
+    # Set appropriate content-type
+    content_type = f"application/x-{service}-advertisement"
+    return Response(
+        content=response_body,
+        media_type=content_type,
+        headers={
+            "Cache-Control": "no-cache",
+            "Expires": "Fri, 01 Jan 1980 00:00:00 GMT",
+            "Pragma": "no-cache"
+        }
+    )
+
+
+async def record_access(repo_name: str, user_id: int, action: models.Action) -> None:
+    """
+    Queue an AccessLog row; repo name -> id comes from the metadata cache.
+    Runs after git succeeded and the reply is out, and never raises: a
+    database blip costs the log entry (counted), not the clone or push.
+    """
     try:
-        cmd = ["git", git_command, "--stateless-rpc", "--advertise-refs", str(repo_path)]
-        print(f"DEBUG: Executing command: {' '.join(cmd)}")
-
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=str(repo_path)  # Execute in repo directory
-        )
-
-        output, error = process.communicate(timeout=10)  # Add timeout
-
-        print(f"DEBUG: Git command return code: {process.returncode}")
-        print(f"DEBUG: Git stdout length: {len(output)} bytes")
-        print(f"DEBUG: Git stdout (first 200 chars): {output[:200]}")
-        if error:
-            print(f"DEBUG: Git stderr: {error.decode()}")
-
-        if process.returncode != 0:
-            error_msg = error.decode() if error else "Unknown error"
-            print(f"ERROR: Git command failed with code {process.returncode}: {error_msg}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Git command failed: {error_msg}"
-            )
-
-        # Build response in Git packet-line format
-        service_announcement = git_ops.packet_line(f"# service={service}\n")
-        flush = b"0000"
-        response_body = service_announcement + flush + output
-
-        print(f"DEBUG: Response body length: {len(response_body)} bytes")
-        print(f"DEBUG: Response body (first 100 chars): {response_body[:100]}")
-
-        # Set appropriate content-type
-        content_type = f"application/x-{service}-advertisement"
-        print(f"DEBUG: Content-Type: {content_type}")
-
-        return Response(
-            content=response_body,
-            media_type=content_type,
-            headers={
-                "Cache-Control": "no-cache",
-                "Expires": "Fri, 01 Jan 1980 00:00:00 GMT",
-                "Pragma": "no-cache"
-            }
-        )
-
-    except subprocess.SubprocessError as e:
-        print(f"DEBUG: Subprocess error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Subprocess error: {str(e)}")
-    except Exception as e:
-        print(f"DEBUG: Unexpected error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+        async with AsyncSessionLocal() as db:   # no connection is taken on a cache hit
+            repo_id = await crud.get_repo_id_by_name_async(db, repo_name)
+    except Exception:
+        ACCESS_LOG_EVENTS.inc(outcome="lookup_failed")
+        logger.warning("access log: repo lookup failed", exc_info=True, extra={"repo": repo_name})
+        return
+    if repo_id is not None:
+        await access_logger.record(repo_id, user_id, action)
+
+def upload_pack_action(body: bytes, complete: bool) -> Optional[models.Action]:
+    """
+    CLONE for a have-less negotiation, PULL otherwise. Only the final round
+    (the one carrying `done`) is logged, so a multi-round fetch counts once.
+    Protocol v2 is the exception: the server may end the negotiation itself
+    (`ready`), so every v2 fetch round with haves is a PULL, and ls-refs is
+    never logged. A body too big to peek (a long have list) can't be told
+    apart here: None, and the route logs a PULL only if the reply has the pack.
+    """
+    if not complete:
+        return None
+    try:
+        lines = pkt_lines(body)
+    except ValueError:
+        return None
+    has_haves = any(line.startswith(b"have ") for line in lines)
+    if b"done" not in lines:
+        return models.Action.PULL if has_haves and lines[0] == b"command=fetch" else None
+    return models.Action.PULL if has_haves else models.Action.CLONE
 
 
 @app.post("/{repo_name:path}.git/git-upload-pack")
-async def git_upload_pack(repo_name: str, request: Request):
+async def git_upload_pack(repo_name: str, request: Request, current_user_id: int = Depends(fake_current_user)):
     """
     This is to handle git-upload-pack (clone/fetch operations).
 
@@ -177,32 +500,76 @@ async def git_upload_pack(repo_name: str, request: Request):
     Client sends what it wants, we send back the Git objects.
     """
     repo_path = get_repo_path(repo_name)
-    # Read the request body (client's want/have negotiation)
-    request_body = await request.body()
+    protocol = git_ops.git_protocol(request.headers.get("git-protocol"))
+    headers = {
+        "Cache-Control": "no-cache",
+        "Expires": "Fri, 01 Jan 1980 00:00:00 GMT",
+        "Pragma": "no-cache"
+    }
+    # git gzips big negotiations (long have lists, many wants from a partial clone's lazy fetch):
+    # inflate as it streams, so the peek and the cache key see the real pkt-lines
+    request_stream = request_body(request)
+    prefix, complete = await peek_request(request_stream)
+
+    # v2 ls-refs: the client's ref-prefix filter is applied by git, and the
+    # filtered reply is cached like an advertisement until the refs move
+    variant = ls_refs_key(prefix) if complete and git_ops.is_protocol_v2(protocol) else None
+    if variant is not None:
+        async def list_refs() -> bytes:
+            async with git_scheduler.slot(repo_path, GitScheduler.READ):
+                return await git_ops.run_upload_pack(repo_path, prefix, protocol)
+
+        body = await ref_cache.get_or_load(repo_path, ("ls-refs", variant), list_refs)
+        return Response(content=body, media_type="application/x-git-upload-pack-result", headers=headers)
+
+    # A full clone is a short, have-less negotiation: peek at it and serve
+    # the pack from disk if we've already computed it for the same wants
+    cache_key = clone_cache_key(prefix, protocol or "") if complete else None
+    # logged once the pack is out, so rejected (503) and failed fetches never show up
+    action = upload_pack_action(prefix, complete)
+    record = partial(record_access, repo_name, current_user_id, action) if action is not None else None
+    if cache_key:
+        cached = pack_cache.lookup(repo_path, cache_key)
+        if cached is not None:
+            return FileResponse(cached, media_type="application/x-git-upload-pack-result", headers=headers,
+                                background=BackgroundTask(record) if record else None)
+    sink = pack_cache.writer(repo_path, cache_key) if cache_key else None
+    if not complete:
+        sink = PackSniffer()
+
+        async def record():
+            if sink.saw_pack:   # the round that ended the negotiation
+                await record_access(repo_name, current_user_id, models.Action.PULL)
+
+    # Wait for a process slot (503 + Retry-After when the queue is full)
+    slot = await git_scheduler.acquire(repo_path, GitScheduler.READ)
     try:
         # Start git upload-pack process
-        process = subprocess.Popen(
-            ["git", "upload-pack", "--stateless-rpc", str(repo_path)],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        # Stream the response
-        return StreamingResponse(
-            git_ops.stream_git_process(process, request_body),
+        process = await git_ops.spawn_git("upload-pack", "--stateless-rpc", str(repo_path),
+                                          env=git_ops.protocol_env(protocol))
+        # Stream the response; the client's want/have negotiation is piped into git as it arrives
+        return GitStreamingResponse(
+            process,
+            replay(prefix, request_stream),
+            slot=slot,
+            sink=sink,
+            on_success=record,
             media_type="application/x-git-upload-pack-result",
-            headers={
-                "Cache-Control": "no-cache",
-                "Expires": "Fri, 01 Jan 1980 00:00:00 GMT",
-                "Pragma": "no-cache"
-            }
+            headers=headers
         )
     except Exception as e:
+        slot.release()
         raise HTTPException(status_code=500, detail=f"Upload pack failed: {str(e)}")
 
 
+def after_push(repo_name: str, repo_path: Path) -> None:
+    ref_cache.invalidate(repo_path)
+    pack_cache.invalidate(repo_path)
+    maintenance_worker.note_push(repo_name)
+
+
 @app.post("/{repo_name}.git/git-receive-pack")
-async def git_receive_pack(repo_name: str, request: Request):
+async def git_receive_pack(repo_name: str, request: Request, current_user_id: int = Depends(fake_current_user)):
     """
     this is to handle git-receive-pack (push operations).
 
@@ -210,29 +577,43 @@ async def git_receive_pack(repo_name: str, request: Request):
     Client sends new commits/objects, we update the repository.
     """
     repo_path = get_repo_path(repo_name)
-    # Read the request body (packfile + ref updates)
-    request_body = await request.body()
+    protocol = git_ops.git_protocol(request.headers.get("git-protocol"))
+    # Wait for a process slot (503 + Retry-After when the queue is full)
+    slot = await git_scheduler.acquire(repo_path, GitScheduler.WRITE)
     try:
         # Start git receive-pack process
-        process = subprocess.Popen(
-            ["git", "receive-pack", "--stateless-rpc", str(repo_path)],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        # Stream the response
-        return StreamingResponse(
-            git_ops.stream_git_process(process, request_body),
+        process = await git_ops.spawn_git("receive-pack", "--stateless-rpc", str(repo_path),
+                                          env=git_ops.protocol_env(protocol))
+        # Stream the response; the packfile + ref updates are piped into git as they arrive
+        return GitStreamingResponse(
+            process,
+            request_body(request),
+            slot=slot,
             media_type="application/x-git-receive-pack-result",
             headers={
                 "Cache-Control": "no-cache",
                 "Expires": "Fri, 01 Jan 1980 00:00:00 GMT",
                 "Pragma": "no-cache"
-            }
+            },
+            # refs just moved: drop cached advertisements and packs right away, queue maintenance
+            background=BackgroundTask(after_push, repo_name, repo_path),
+            on_success=partial(record_access, repo_name, current_user_id, models.Action.PUSH)
         )
     except Exception as e:
+        slot.release()
         raise HTTPException(status_code=500, detail=f"Receive pack failed: {str(e)}")
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text exposition of everything in metrics.registry."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# readiness probe: 503 until the SQL pools are warm and Mongo is open
+@app.get("/ready", include_in_schema=False)
+def ready():
+    status = readiness.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.get("/health")
 def health_check():
     return {"status": str(get_repo_path("repo1"))}
\ No newline at end of file
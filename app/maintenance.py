@@ -0,0 +1,220 @@
+# background repo maintenance: geometric repacks, bitmaps and commit-graphs for repos that took pushes
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from .git_ops import git_scheduler
+from .metrics import registry
+
+MAINT_ENABLED = os.getenv("MAINT_ENABLED", "true").lower() in ("1", "true", "yes")
+MAINT_TICK = float(os.getenv("MAINT_TICK", "10"))
+# a repo is due once it has been quiet this long after a push...
+MAINT_QUIET_SECONDS = float(os.getenv("MAINT_QUIET_SECONDS", "60"))
+# ...or right away once this many pushes piled up, quiet or not
+MAINT_MAX_PUSHES = int(os.getenv("MAINT_MAX_PUSHES", "50"))
+# average share of one core maintenance may use; each run is single-threaded and niced
+MAINT_CPU_BUDGET = float(os.getenv("MAINT_CPU_BUDGET", "0.25"))
+MAINT_PACK_THREADS = int(os.getenv("MAINT_PACK_THREADS", "1"))
+MAINT_NICE = int(os.getenv("MAINT_NICE", "19"))
+MAINT_TIMEOUT = float(os.getenv("MAINT_TIMEOUT", "3600"))
+
+logger = logging.getLogger(__name__)
+
+MAINT_RUNS = registry.counter("maintenance_runs_total", "Maintenance runs by outcome.", ("outcome",))
+MAINT_SECONDS = registry.histogram("maintenance_duration_seconds", "Wall time of one repo's maintenance.")
+MAINT_PENDING = registry.gauge("maintenance_pending_repos", "Repos with pushes not yet maintained.")
+
+
+def alternates_of(repo_path: Path) -> list[Path]:
+    try:
+        text = (repo_path / "objects" / "info" / "alternates").read_text()
+    except FileNotFoundError:
+        return []
+    return [Path(line) for line in text.splitlines() if line and not line.startswith("#")]
+
+
+class RepoLock:
+    """flock on <repo>/maintenance.lock, so several uvicorn workers never maintain one repo twice."""
+
+    def __init__(self, repo_path: Path):
+        self.path = repo_path / "maintenance.lock"
+        self.fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            os.close(self.fd)
+            self.fd = None
+            return False
+
+    def release(self) -> None:
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+async def run_maint_git(*args: str, cwd: Path) -> None:
+    """git at low CPU priority with single-threaded packing; raises on failure or timeout."""
+    process = await asyncio.create_subprocess_exec(
+        "git", "-c", f"pack.threads={MAINT_PACK_THREADS}", *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=str(cwd),
+        preexec_fn=lambda: os.nice(MAINT_NICE),
+    )
+    try:
+        _, error = await asyncio.wait_for(process.communicate(), MAINT_TIMEOUT)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {error.decode(errors='replace')}")
+
+
+async def maintain_standalone(repo_path: Path) -> None:
+    """
+    Geometric repack: rolls loose objects and small packs into progressively
+    bigger ones instead of rewriting everything, with a multi-pack-index and
+    its reachability bitmap. Never drops an object, reachable or not.
+    """
+    await run_maint_git("pack-refs", "--all", cwd=repo_path)
+    await run_maint_git("repack", "-d", "--geometric=2", "--write-midx", "--write-bitmap-index", cwd=repo_path)
+    await run_maint_git("commit-graph", "write", "--reachable", "--split", cwd=repo_path)
+
+
+async def maintain_member(repo_path: Path) -> None:
+    """
+    Fork network member: objects it shares live in the pool, so a local (-l)
+    repack drops the duplicates and keeps only what was pushed here since the
+    pool last caught up. No bitmaps: they can't cover objects in alternates.
+    Only safe right after refresh_pool(), which the worker guarantees.
+    """
+    await run_maint_git("pack-refs", "--all", cwd=repo_path)
+    await run_maint_git("repack", "-a", "-d", "-l", cwd=repo_path)
+    await run_maint_git("commit-graph", "write", "--reachable", "--split", cwd=repo_path)
+
+
+class MaintenanceWorker:
+    """
+    Counts pushes per repo (note_push() from git_receive_pack) and maintains
+    due repos one at a time: a repo is due when it's been quiet for
+    quiet_seconds, or has taken max_pushes. Each job holds the scheduler's
+    maintenance gate for its repo, so it never overlaps a push to it, and the
+    worker then sleeps long enough to keep average CPU under cpu_budget.
+    """
+
+    def __init__(self,
+                 tick: float = MAINT_TICK,
+                 quiet_seconds: float = MAINT_QUIET_SECONDS,
+                 max_pushes: int = MAINT_MAX_PUSHES,
+                 cpu_budget: float = MAINT_CPU_BUDGET):
+        self.tick = tick
+        self.quiet_seconds = quiet_seconds
+        self.max_pushes = max_pushes
+        self.cpu_budget = cpu_budget
+        # repo name -> [pushes, last push (monotonic)]
+        self.pending: dict[str, list] = {}
+        self._task: Optional[asyncio.Task] = None
+        registry.add_collector(lambda: MAINT_PENDING.set(len(self.pending)))
+
+    def note_push(self, repo_name: str) -> None:
+        entry = self.pending.setdefault(repo_name, [0, 0.0])
+        entry[0] += 1
+        entry[1] = time.monotonic()
+
+    def due(self) -> list[str]:
+        now = time.monotonic()
+        ready = [(pushes, name) for name, (pushes, last) in self.pending.items()
+                 if pushes >= self.max_pushes or now - last >= self.quiet_seconds]
+        return [name for _, name in sorted(ready, reverse=True)]
+
+    async def start(self) -> None:
+        if MAINT_ENABLED:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            for repo_name in self.due():
+                started = time.monotonic()
+                await self.maintain(repo_name)
+                # one job uses at most about one core, so a duty cycle caps average CPU
+                busy = time.monotonic() - started
+                await asyncio.sleep(busy * (1 / self.cpu_budget - 1))
+
+    async def maintain(self, repo_name: str) -> None:
+        from .git_ops import REPO_ROOT
+
+        pushes = self.pending.pop(repo_name, [0, 0.0])
+        repo_path = REPO_ROOT / f"{repo_name}.git"
+        if not repo_path.exists():
+            return
+        lock = RepoLock(repo_path)
+        if not lock.acquire():
+            MAINT_RUNS.inc(outcome="skipped")
+            return
+        started = time.monotonic()
+        try:
+            if alternates_of(repo_path):
+                await self._maintain_network(repo_name)
+            else:
+                async with git_scheduler.maintenance(repo_path):
+                    await maintain_standalone(repo_path)
+        except asyncio.CancelledError:
+            self.pending.setdefault(repo_name, pushes)
+            raise
+        except Exception:
+            MAINT_RUNS.inc(outcome="error")
+            logger.exception("maintenance failed", extra={"repo": repo_name})
+        else:
+            MAINT_RUNS.inc(outcome="ok")
+            logger.info("maintenance done", extra={"repo": repo_name, "pushes": pushes[0],
+                                                   "seconds": round(time.monotonic() - started, 3)})
+        finally:
+            MAINT_SECONDS.observe(time.monotonic() - started)
+            lock.release()
+
+    async def _maintain_network(self, repo_name: str) -> None:
+        """Pool first (it must hold everything before any member sheds objects), then the member, then the pool's packs."""
+        from . import crud, forks
+        from .database_sessions import SessionLocal
+        from .git_ops import get_repo_path
+
+        def network() -> tuple[int, list[tuple[int, str]]]:
+            with SessionLocal() as db:
+                repo_id = crud.get_repo_id_by_name(db, repo_name)
+                return crud.fork_network(db, repo_id)
+
+        network_id, members = await run_in_threadpool(network)
+        member_paths = [(member_id, get_repo_path(name)) for member_id, name in members]
+        await forks.refresh_pool(network_id, member_paths)
+        repo_path = get_repo_path(repo_name)
+        async with git_scheduler.maintenance(repo_path):
+            await maintain_member(repo_path)
+        pool = forks.pool_path(network_id)
+        async with git_scheduler.maintenance(pool):
+            await maintain_standalone(pool)
+
+
+maintenance_worker = MaintenanceWorker()
@@ -0,0 +1,312 @@
+# in-process metrics, rendered in the Prometheus text format on /metrics
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+# seconds; covers a cached JSON read (~1ms) up to a big clone
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(float(4 ** n * 1024) for n in range(0, 11))   # 1 KiB .. 1 GiB
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        # sync endpoints run in the threadpool, so updates can come from several threads
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (non-cumulative, +Inf last), sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            running = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                running += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {running}")
+        return lines
+
+
+class Registry:
+    """
+    Named metrics plus collectors: callbacks run at scrape time that refresh
+    gauges from state owned elsewhere (pools, caches, the git scheduler).
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Iterable[str] = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ~~~ the metrics themselves
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time from request start to the last body byte sent.",
+    ("method", "route", "status"))
+HTTP_IN_FLIGHT = registry.gauge("http_requests_in_flight", "Requests currently being served.")
+
+GIT_SPAWN_SECONDS = registry.histogram(
+    "git_spawn_duration_seconds", "Time to start a git subprocess.", ("command",))
+GIT_RUN_SECONDS = registry.histogram(
+    "git_process_duration_seconds", "Git subprocess wall time, spawn to exit.", ("command", "outcome"))
+GIT_BYTES_IN = registry.counter(
+    "git_bytes_in_total", "Bytes piped into git stdin.", ("command",))
+GIT_BYTES_OUT = registry.counter(
+    "git_bytes_out_total", "Bytes read from git stdout.", ("command",))
+GIT_PACK_BYTES = registry.histogram(
+    "git_response_bytes", "Size of each git response body (packs, advertisements).", ("command",),
+    buckets=BYTES_BUCKETS)
+
+DB_QUERY_SECONDS = registry.histogram(
+    "db_query_duration_seconds", "SQL statement execution time.", ("engine", "statement"))
+DB_POOL = registry.gauge(
+    "db_pool_connections", "SQLAlchemy pool connections by state.", ("engine", "state"))
+MONGO_OP_SECONDS = registry.histogram(
+    "mongo_operation_duration_seconds", "Issue store operation time.", ("operation", "outcome"))
+
+
+# ~~~ ASGI middleware
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware buffering): times every HTTP
+    request until its last body chunk is sent, labelled by route template so
+    /repos/1/issues and /repos/2/issues share a series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                         method=scope["method"],
+                                         route=getattr(route, "path", "unmatched"),
+                                         status=status)
+
+
+# ~~~ SQLAlchemy instrumentation
+def _statement_kind(statement: str) -> str:
+    head = statement.lstrip().split(None, 1)
+    return head[0].upper() if head else "OTHER"
+
+
+def instrument_engine(engine, name: str) -> None:
+    """Time every statement on a (sync) Engine and report its pool on scrape."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, engine=name, statement=_statement_kind(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        stack = context.connection.info.get("query_started") if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+    def collect_pool() -> None:
+        pool = engine.pool
+        for state, probe in (("size", "size"), ("checked_out", "checkedout"),
+                             ("checked_in", "checkedin"), ("overflow", "overflow")):
+            value = getattr(pool, probe, None)
+            if value is not None:
+                # QueuePool.overflow() goes negative while the base pool isn't full yet
+                DB_POOL.set(max(value(), 0), engine=name, state=state)
+
+    registry.add_collector(collect_pool)
+
+
+@contextmanager
+def timed_mongo(operation: str):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        MONGO_OP_SECONDS.observe(time.perf_counter() - started, operation=operation, outcome=outcome)
+
+
+def stats_collector(prefix: str, help_text: str, stats: Callable[[], dict],
+                    labels: Optional[dict] = None) -> None:
+    """
+    Export a component's stats() dict as gauges: flat numeric keys become
+    `<prefix>_<key>`; nested dicts (e.g. scheduler queues) become a label.
+    """
+    gauges: dict[str, Gauge] = {}
+
+    def gauge_for(key: str, label_names: tuple) -> Gauge:
+        if key not in gauges:
+            gauges[key] = registry.gauge(f"{prefix}_{key}", f"{help_text} ({key})", label_names)
+        return gauges[key]
+
+    def collect() -> None:
+        base = labels or {}
+        for key, value in stats().items():
+            if isinstance(value, dict):
+                for sub, sub_stats in value.items():
+                    for field, v in sub_stats.items():
+                        gauge_for(f"{key}_{field}", (*base, "kind")).set(v, **base, kind=sub)
+            elif isinstance(value, (int, float)):
+                gauge_for(key, tuple(base)).set(value, **base)
+
+    registry.add_collector(collect)
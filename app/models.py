@@ -1,11 +1,18 @@
 # tables are defined as objects here
 
-from sqlalchemy import Table, Column, Integer, String, Boolean, DateTime, Enum, ForeignKey, UniqueConstraint, func
+from sqlalchemy import Table, Column, Integer, String, Text, Boolean, DateTime, Enum, ForeignKey, ForeignKeyConstraint, Index, UniqueConstraint, DDL, event, false
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship, declarative_base
-from datetime import datetime
+from datetime import datetime, timezone
 import enum
 Base = declarative_base()
 
+def utcnow() -> datetime:
+    # timestamps are naive UTC set here, not the database's now(): SQLite's CURRENT_TIMESTAMP
+    # has no fraction while a bound datetime always has six digits, so keyset cursors on
+    # created_at/updated_at compared two text forms and never moved past a busy second
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 # enum
 class Action(enum.Enum):
     CLONE   = "clone"
@@ -18,6 +25,13 @@ class IssueStatus(enum.Enum):
     OPEN = "open"
     CLOSED = "closed"
 
+# the only role names grant_role hands out (role.rolename)
+class RoleName(enum.Enum):
+    READ = "read"
+    TRIAGE = "triage"
+    WRITE = "write"
+    ADMIN = "admin"
+
 # ternary relationship "access"
 user_repo_roles = Table(
     'user_repo_roles',
@@ -58,6 +72,11 @@ class Repository(Base):
     reponame = Column(String, index=True, nullable=False)
     maintainer_id = Column(Integer, ForeignKey("user.user_id"), nullable=False)
     fork_of_id = Column(Integer, ForeignKey("repository.repo_id"), nullable=True)
+    next_issue_num = Column(Integer, nullable=False, default=1, server_default="1") # issue number counter
+    next_log_no = Column(Integer, nullable=False, default=1, server_default="1") # access log counter
+    # upload-pack settings, mirrored into the bare repo's git config (see git_ops.apply_upload_settings)
+    allow_filter = Column(Boolean, nullable=False, default=False, server_default=false()) # partial clone (--filter)
+    allow_any_sha1_in_want = Column(Boolean, nullable=False, default=False, server_default=false()) # lazy blob fetches
 
     # relationship
     maintainer = relationship(
@@ -102,8 +121,8 @@ class Issue(Base):
     
     assignee_id = Column(Integer, ForeignKey("user.user_id"))
     title = Column(String)
-    created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
     status = Column(Enum(IssueStatus), default=IssueStatus.OPEN, nullable=False, index=True)
 
     nosql_thread_id = Column(String)  # mongoDB object id
@@ -127,14 +146,43 @@ class Issue(Base):
 
     __table_args__ = (
         UniqueConstraint("repo_id", "issue_num"), # uniquesness
+        # keyset pagination of a repo's issues, newest first
+        Index("ix_issue_repo_created_num", repo_id, created_at.desc(), issue_num.desc()),
+        # ...and the common list filters: equality column first, then the sort keyset, so a page
+        # is a range scan that stops after size+1 rows. Only these single filters; the other
+        # combinations filter or sort on top of one of them (see crud._issues_stmt)
+        Index("ix_issue_repo_updated_num", repo_id, updated_at.desc(), issue_num.desc()),
+        Index("ix_issue_repo_status_created", repo_id, status, created_at.desc(), issue_num.desc()),
+        Index("ix_issue_repo_status_updated", repo_id, status, updated_at.desc(), issue_num.desc()),
+        Index("ix_issue_repo_assignee_created", repo_id, assignee_id, created_at.desc(), issue_num.desc()),
+        Index("ix_issue_repo_author_created", repo_id, author_id, created_at.desc(), issue_num.desc()),
     )
 
+# search index for issues, one row per issue, kept up to date by create_issue/append_comment
+class IssueSearch(Base):
+    __tablename__ = "issue_search"
+    repo_id = Column(Integer, primary_key=True)
+    issue_num = Column(Integer, primary_key=True)
+    # postgres: weighted tsvector (title A, body B, comments C); elsewhere: plain lowercased tokens
+    document = Column(Text().with_variant(TSVECTOR(), "postgresql"), nullable=False)
+
+    __table_args__ = (
+        ForeignKeyConstraint([repo_id, issue_num], [Issue.repo_id, Issue.issue_num], ondelete="CASCADE"),
+    )
+
+# repo_id inside the GIN index: a common word is looked up within one repo, not across
+# every repo's rows and filtered afterwards. btree_gin is what lets GIN take the integer column
+ix_issue_search_repo_document = Index("ix_issue_search_repo_document", IssueSearch.repo_id, IssueSearch.document,
+                                      postgresql_using="gin").ddl_if(dialect="postgresql")
+event.listen(ix_issue_search_repo_document, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS btree_gin").execute_if(dialect="postgresql"))
+
 class AccessLog(Base):
     __tablename__ = "accesslog"
     repo_id = Column(Integer, ForeignKey("repository.repo_id"), primary_key=True, index=True)
     log_no = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("user.user_id"), primary_key=True, index=True)
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
     action = Column(Enum(Action), nullable=False, index=True)
 
     # relationships
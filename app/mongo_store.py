@@ -1,36 +1,287 @@
+import copy
+import os
 from datetime import datetime, timezone
-from pymongo import MongoClient
+from typing import TYPE_CHECKING, Optional
+
 from bson import ObjectId
 
-client = MongoClient("mongodb://localhost:27017")
-db = client["issue_threads"]
+from .metrics import timed_mongo
+
+if TYPE_CHECKING:
+    from pymongo import AsyncMongoClient   # imported on first open(): pymongo is slow to import
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+MONGO_DB = os.getenv("MONGO_DB", "issue_threads")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# "mongo" for the real thing, "memory" for the in-process test double
+MONGO_BACKEND = os.getenv("MONGO_BACKEND", "mongo")
+
+
+# comments live outside the thread document, in fixed-size buckets, so a hot
+# thread never grows a single document towards Mongo's 16 MB limit
+COMMENT_BUCKET_SIZE = int(os.getenv("COMMENT_BUCKET_SIZE", "100"))
+
+
+def _bucket_range(start: int, limit: int, embedded: int) -> tuple[int, int]:
+    """Buckets holding comment seqs [start, start + limit), past the legacy embedded ones."""
+    first = max(start - embedded, 0)
+    return first // COMMENT_BUCKET_SIZE, (first + limit - 1) // COMMENT_BUCKET_SIZE
 
-def create_issue_doc(issue_id: int, title: str, body: str, author: str) -> str:
-    doc = {
+
+def _page(comments: list[dict], start: int, limit: int, total: int) -> tuple[list[dict], Optional[int]]:
+    """Trim to the page and strip seq; the cursor is the seq to resume from, None at the end."""
+    page = [c for c in comments if c["seq"] >= start][:limit]
+    next_cursor = page[-1]["seq"] + 1 if page else None
+    if next_cursor is not None and next_cursor >= total:
+        next_cursor = None
+    return [{k: v for k, v in c.items() if k != "seq"} for c in page], next_cursor
+
+
+def thread_doc(issue_id: int, title: str, body: str, author: str,
+               thread_id: Optional[ObjectId] = None, created_at: Optional[datetime] = None) -> dict:
+    return {
+        "_id": thread_id or ObjectId(),
         "issue_id": issue_id,
         "title": title,
         "author": author,
         "body": body,
-        "created_at": datetime.now(timezone.utc),
-        "comments": []
+        "created_at": created_at or datetime.now(timezone.utc),
+        "comment_count": 0,
+        "embedded_count": 0
     }
-    ins_id = db.threads.insert_one(doc).inserted_id
-    return ins_id
 
-def add_comment(thread_id: str, user: str, body: str) -> None:
-    new_comment = {
-        "user": user,
-        "body": body,
-        "timestamp": datetime.now(timezone.utc)
-    }
-    result = db.threads.update_one(
-        {"_id": ObjectId(thread_id)},
-        {"$push": {"comments": new_comment} }
-    )
-
-def get_issue(issue_id: str):
-    doc = db.threads.find_one({"_id": ObjectId(issue_id)})
-    if not doc:
-        raise ValueError("Thread not found")
-    doc["id"] = str(doc.pop("_id"))
-    return doc
\ No newline at end of file
+
+class MongoIssueStore:
+    """
+    Issue threads in MongoDB through a pooled AsyncMongoClient.
+    threads hold the issue body and a comment_count; comments go to
+    comment_buckets as {thread_id, bucket, comments: [...]} of
+    COMMENT_BUCKET_SIZE each. Older threads with an embedded comments
+    array are still read, through $slice projections.
+    """
+
+    def __init__(self,
+                 url: str = MONGO_URL,
+                 db_name: str = MONGO_DB,
+                 max_pool_size: int = MONGO_MAX_POOL_SIZE,
+                 min_pool_size: int = MONGO_MIN_POOL_SIZE):
+        self.url = url
+        self.db_name = db_name
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.client: Optional["AsyncMongoClient"] = None
+        self.db = None
+
+    async def open(self) -> None:
+        from pymongo import AsyncMongoClient
+
+        self.client = AsyncMongoClient(self.url,
+                                       maxPoolSize=self.max_pool_size,
+                                       minPoolSize=self.min_pool_size)
+        await self.client.aconnect()
+        self.db = self.client[self.db_name]
+        await self.db.comment_buckets.create_index([("thread_id", 1), ("bucket", 1)], unique=True)
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def create_issue_doc(self, issue_id: int, title: str, body: str, author: str,
+                               thread_id: Optional[ObjectId] = None) -> str:
+        result = await self.db.threads.insert_one(thread_doc(issue_id, title, body, author, thread_id))
+        return result.inserted_id
+
+    async def create_issue_docs(self, docs: list[dict]) -> None:
+        """Many thread_doc()s in one round trip (bulk import)."""
+        await self.db.threads.insert_many(docs, ordered=False)
+
+    async def delete_issue_docs(self, thread_ids: list[ObjectId]) -> None:
+        await self.db.threads.delete_many({"_id": {"$in": thread_ids}})
+
+    async def add_comment(self, thread_id: str, user: str, body: str) -> None:
+        from pymongo import ReturnDocument   # already loaded by open()
+
+        # allocate the comment's seq atomically; the pipeline also backfills the
+        # counters of legacy threads from the size of their embedded array
+        thread = await self.db.threads.find_one_and_update(
+            {"_id": ObjectId(thread_id)},
+            [{"$set": {
+                "embedded_count": {"$ifNull": ["$embedded_count", {"$size": {"$ifNull": ["$comments", []]}}]},
+                "comment_count": {"$add": [
+                    {"$ifNull": ["$comment_count", {"$size": {"$ifNull": ["$comments", []]}}]}, 1
+                ]},
+            }}],
+            projection={"comment_count": 1, "embedded_count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if thread is None:
+            raise ValueError("Thread not found")
+        seq = thread["comment_count"] - 1
+        new_comment = {
+            "seq": seq,
+            "user": user,
+            "body": body,
+            "timestamp": datetime.now(timezone.utc)
+        }
+        await self.db.comment_buckets.update_one(
+            {"thread_id": thread["_id"], "bucket": (seq - thread["embedded_count"]) // COMMENT_BUCKET_SIZE},
+            {"$push": {"comments": {"$each": [new_comment], "$sort": {"seq": 1}}}},
+            upsert=True
+        )
+
+    async def get_issue(self, issue_id: str) -> dict:
+        """Thread header and comment_count, without loading any comments."""
+        doc = await self.db.threads.find_one({"_id": ObjectId(issue_id)}, projection={"comments": 0})
+        if not doc:
+            raise ValueError("Thread not found")
+        if "comment_count" not in doc:
+            # legacy thread that never took a bucketed comment: count on the server
+            cursor = await self.db.threads.aggregate([
+                {"$match": {"_id": doc["_id"]}},
+                {"$project": {"n": {"$size": {"$ifNull": ["$comments", []]}}}}
+            ])
+            sized = await cursor.to_list(1)
+            doc["comment_count"] = doc["embedded_count"] = sized[0]["n"] if sized else 0
+        doc["id"] = str(doc.pop("_id"))
+        return doc
+
+    async def get_comments(self, thread: dict, start: int = 0, limit: int = 50) -> tuple[list[dict], Optional[int]]:
+        """One page of comments from seq `start`, for a header returned by get_issue()."""
+        total = thread["comment_count"]
+        embedded = thread.get("embedded_count", 0)
+        comments = []
+        if start < embedded:
+            legacy = await self.db.threads.find_one(
+                {"_id": ObjectId(thread["id"])},
+                projection={"comments": {"$slice": [start, limit]}, "body": 0, "title": 0}
+            )
+            comments = [dict(c, seq=start + i) for i, c in enumerate((legacy or {}).get("comments", []))]
+        remaining = limit - len(comments)
+        if remaining > 0 and start + len(comments) < total:
+            first, last = _bucket_range(start + len(comments), remaining, embedded)
+            async for bucket in self.db.comment_buckets.find(
+                    {"thread_id": ObjectId(thread["id"]), "bucket": {"$gte": first, "$lte": last}},
+                    projection={"comments": 1}).sort("bucket", 1):
+                comments.extend(bucket["comments"])
+        return _page(comments, start, limit, total)
+
+
+class InMemoryIssueStore:
+    """Test double with the same interface and layout, for running without a live Mongo."""
+
+    def __init__(self):
+        self.threads: dict[ObjectId, dict] = {}
+        self.comment_buckets: dict[tuple[ObjectId, int], list[dict]] = {}
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def create_issue_doc(self, issue_id: int, title: str, body: str, author: str,
+                               thread_id: Optional[ObjectId] = None) -> str:
+        doc = thread_doc(issue_id, title, body, author, thread_id)
+        self.threads[doc["_id"]] = doc
+        return doc["_id"]
+
+    async def create_issue_docs(self, docs: list[dict]) -> None:
+        for doc in docs:
+            self.threads[doc["_id"]] = copy.deepcopy(doc)
+
+    async def delete_issue_docs(self, thread_ids: list[ObjectId]) -> None:
+        for thread_id in thread_ids:
+            self.threads.pop(thread_id, None)
+
+    async def add_comment(self, thread_id: str, user: str, body: str) -> None:
+        doc = self.threads.get(ObjectId(thread_id))
+        if doc is None:
+            raise ValueError("Thread not found")
+        seq = doc["comment_count"]
+        doc["comment_count"] += 1
+        bucket = self.comment_buckets.setdefault(
+            (doc["_id"], (seq - doc["embedded_count"]) // COMMENT_BUCKET_SIZE), []
+        )
+        bucket.append({
+            "seq": seq,
+            "user": user,
+            "body": body,
+            "timestamp": datetime.now(timezone.utc)
+        })
+
+    async def get_issue(self, issue_id: str) -> dict:
+        doc = self.threads.get(ObjectId(issue_id))
+        if not doc:
+            raise ValueError("Thread not found")
+        doc = copy.deepcopy(doc)
+        doc["id"] = str(doc.pop("_id"))
+        return doc
+
+    async def get_comments(self, thread: dict, start: int = 0, limit: int = 50) -> tuple[list[dict], Optional[int]]:
+        first, last = _bucket_range(start, limit, thread["embedded_count"])
+        comments = []
+        for n in range(first, last + 1):
+            comments.extend(copy.deepcopy(self.comment_buckets.get((ObjectId(thread["id"]), n), [])))
+        return _page(comments, start, limit, thread["comment_count"])
+
+
+# ~~~ process-wide store, opened and closed by the FastAPI lifespan
+_store = None
+
+
+def get_store():
+    if _store is None:
+        raise RuntimeError("Issue store is not initialised (is the app lifespan running?)")
+    return _store
+
+
+async def init_store(store=None) -> None:
+    global _store
+    if store is None:
+        store = InMemoryIssueStore() if MONGO_BACKEND == "memory" else MongoIssueStore()
+    try:
+        await store.open()
+    except BaseException:   # unreachable or timed out: don't leave a half-open client behind
+        await store.close()
+        raise
+    _store = store
+
+
+async def close_store() -> None:
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+
+async def create_issue_doc(issue_id: int, title: str, body: str, author: str,
+                           thread_id: Optional[ObjectId] = None) -> str:
+    with timed_mongo("create_issue_doc"):
+        return await get_store().create_issue_doc(issue_id, title, body, author, thread_id)
+
+
+async def create_issue_docs(docs: list[dict]) -> None:
+    with timed_mongo("create_issue_docs"):
+        await get_store().create_issue_docs(docs)
+
+
+async def delete_issue_docs(thread_ids: list[ObjectId]) -> None:
+    with timed_mongo("delete_issue_docs"):
+        await get_store().delete_issue_docs(thread_ids)
+
+
+async def add_comment(thread_id: str, user: str, body: str) -> None:
+    with timed_mongo("add_comment"):
+        await get_store().add_comment(thread_id, user, body)
+
+
+async def get_issue(issue_id: str) -> dict:
+    with timed_mongo("get_issue"):
+        return await get_store().get_issue(issue_id)
+
+
+async def get_comments(thread: dict, start: int = 0, limit: int = 50) -> tuple[list[dict], Optional[int]]:
+    with timed_mongo("get_comments"):
+        return await get_store().get_comments(thread, start, limit)
@@ -0,0 +1,269 @@
+# on-disk cache of full-clone upload-pack responses
+import hashlib
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import anyio
+
+from .git_ops import BASE_DIR
+
+PACK_CACHE_DIR = Path(os.getenv("PACK_CACHE_DIR", BASE_DIR / "tmp" / "pack-cache"))
+PACK_CACHE_MAX_BYTES = int(os.getenv("PACK_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# a full-clone negotiation is a handful of want lines; anything bigger streams straight to git
+PACK_CACHE_PEEK_LIMIT = int(os.getenv("PACK_CACHE_PEEK_LIMIT", str(64 * 1024)))
+
+# capability tokens that don't change the pack git sends back
+_IGNORED_CAPABILITIES = (b"agent=", b"session-id=")
+
+
+async def peek_request(stream: AsyncIterator[bytes], limit: int = PACK_CACHE_PEEK_LIMIT) -> tuple[bytes, bool]:
+    """
+    Buffer the start of a request body, up to `limit` bytes.
+    Returns (prefix, complete); complete means the whole body fit in the prefix.
+    """
+    buf = bytearray()
+    async for chunk in stream:
+        buf += chunk
+        if len(buf) > limit:
+            return bytes(buf), False
+    return bytes(buf), True
+
+
+async def replay(prefix: bytes, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Yield the peeked prefix, then whatever is left of the original stream."""
+    if prefix:
+        yield prefix
+    async for chunk in stream:
+        yield chunk
+
+
+def pkt_lines(body: bytes) -> list[bytes]:
+    """Split a pkt-line body into payloads; flush/delim packets come back as b''."""
+    lines, pos = [], 0
+    while pos + 4 <= len(body):
+        size = int(body[pos:pos + 4], 16)
+        if size < 4:
+            lines.append(b"")
+            pos += 4
+            continue
+        lines.append(body[pos + 4:pos + size].rstrip(b"\n"))
+        pos += size
+    if pos != len(body):
+        raise ValueError("Truncated pkt-line stream")
+    return lines
+
+
+def clone_cache_key(body: bytes, *extra: str) -> Optional[str]:
+    """
+    Content address for a full-clone negotiation: the sorted want set plus every
+    other line that shapes the pack (capabilities, shallow/deepen/filter...).
+    Returns None for anything that isn't a complete, have-less negotiation.
+    """
+    try:
+        lines = pkt_lines(body)
+    except ValueError:
+        return None
+    wants, other = [], []
+    for line in lines:
+        if line.startswith(b"have "):
+            return None
+        if line.startswith(b"want "):
+            parts = line.split(b" ")
+            wants.append(parts[1])
+            other.extend(p for p in parts[2:] if not p.startswith(_IGNORED_CAPABILITIES))
+        elif line and not line.startswith(_IGNORED_CAPABILITIES):
+            other.append(line)
+    if not wants or b"done" not in other:
+        return None
+    digest = hashlib.sha256()
+    for part in (*extra, *sorted(wants), b"--", *sorted(other)):
+        digest.update(part.encode() if isinstance(part, str) else part)
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def ls_refs_key(body: bytes) -> Optional[str]:
+    """
+    Cache variant for a protocol v2 `command=ls-refs` request: its arguments
+    (ref-prefix, peel, symrefs...) decide the reply, the agent line doesn't.
+    None for anything else.
+    """
+    try:
+        lines = pkt_lines(body)
+    except ValueError:
+        return None
+    if not lines or lines[0] != b"command=ls-refs":
+        return None
+    digest = hashlib.sha256()
+    for line in lines:
+        if not line.startswith(_IGNORED_CAPABILITIES):
+            digest.update(line + b"\n")
+    return digest.hexdigest()
+
+
+class PackSniffer:
+    """
+    A sink (like PackCacheWriter) that keeps nothing, it only notes whether the
+    reply carried a pack: "PACK" (v0, raw or in side-band) or the v2 `packfile`
+    section. Intermediate negotiation rounds only send ACK/NAK lines.
+    """
+
+    def __init__(self, limit: int = 64 * 1024):   # the pack starts right after a few ACK lines
+        self.limit = limit
+        self.head = b""
+        self.saw_pack = False
+
+    async def write(self, chunk: bytes) -> None:
+        if self.saw_pack or len(self.head) >= self.limit:
+            return
+        self.head += chunk[:self.limit - len(self.head)]
+        self.saw_pack = b"PACK" in self.head or b"packfile\n" in self.head
+
+    async def commit(self) -> None:
+        pass
+
+    async def abort(self) -> None:
+        pass
+
+
+class PackCacheWriter:
+    """Tees a git response into a temp file and publishes it only if git succeeded."""
+
+    def __init__(self, cache: "PackCache", repo_path: Path, key: str):
+        self.cache = cache
+        self.repo_path = repo_path
+        self.key = key
+        self.tmp_path = cache.repo_dir(repo_path) / f".{key}.{uuid.uuid4().hex}.tmp"
+        self.generation = cache.generation(repo_path)
+        self._file = None
+        self.size = 0
+
+    async def write(self, chunk: bytes) -> None:
+        if self._file is None:
+            self.tmp_path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = await anyio.open_file(self.tmp_path, "wb")
+        await self._file.write(chunk)
+        self.size += len(chunk)
+
+    async def commit(self) -> None:
+        if self._file is None:
+            return
+        await self._file.aclose()
+        self._file = None
+        self.cache._publish(self)
+
+    async def abort(self) -> None:
+        if self._file is not None:
+            await self._file.aclose()
+            self._file = None
+        self.tmp_path.unlink(missing_ok=True)
+
+
+class PackCache:
+    """
+    Size-bounded LRU of full-clone responses, one directory per repository.
+    Entries are addressed by clone_cache_key(); a push drops every pack of the repo.
+    """
+
+    def __init__(self, root: Path = PACK_CACHE_DIR, max_bytes: int = PACK_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple[str, str], tuple[Path, int]]" = OrderedDict()
+        self._generations: dict[str, int] = {}
+        self._loaded = False
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def repo_dir(self, repo_path: Path) -> Path:
+        return self.root / hashlib.sha1(str(repo_path).encode()).hexdigest()
+
+    def generation(self, repo_path: Path) -> int:
+        return self._generations.get(self.repo_dir(repo_path).name, 0)
+
+    def _load(self) -> None:
+        """Pick up entries left on disk by a previous worker, oldest first."""
+        self._loaded = True
+        if not self.root.exists():
+            return
+        found = []
+        for repo_dir in self.root.iterdir():
+            for leftover in repo_dir.glob(".*.tmp"):
+                leftover.unlink(missing_ok=True)
+            for entry in repo_dir.glob("*.pack"):
+                st = entry.stat()
+                found.append((st.st_mtime, (repo_dir.name, entry.stem), entry, st.st_size))
+        for _, key, path, size in sorted(found):
+            if key in self._entries:   # published here before the first lookup
+                continue
+            self._entries[key] = (path, size)
+            self.total_bytes += size
+        self._evict()
+
+    def lookup(self, repo_path: Path, key: str) -> Optional[Path]:
+        if not self._loaded:
+            self._load()
+        entry_key = (self.repo_dir(repo_path).name, key)
+        entry = self._entries.get(entry_key)
+        if entry is None or not entry[0].exists():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(entry_key)
+        self.hits += 1
+        return entry[0]
+
+    def writer(self, repo_path: Path, key: str) -> PackCacheWriter:
+        return PackCacheWriter(self, repo_path, key)
+
+    def _publish(self, writer: PackCacheWriter) -> None:
+        # too big to keep, or the repo was pushed to while git was packing
+        if writer.size > self.max_bytes or writer.generation != self.generation(writer.repo_path):
+            writer.tmp_path.unlink(missing_ok=True)
+            return
+        final_path = writer.tmp_path.with_name(f"{writer.key}.pack")
+        os.replace(writer.tmp_path, final_path)
+        entry_key = (self.repo_dir(writer.repo_path).name, writer.key)
+        previous = self._entries.pop(entry_key, None)
+        if previous is not None:
+            self.total_bytes -= previous[1]
+        self._entries[entry_key] = (final_path, writer.size)
+        self.total_bytes += writer.size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and self._entries:
+            _, (path, size) = self._entries.popitem(last=False)
+            path.unlink(missing_ok=True)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def invalidate(self, repo_path: Path) -> None:
+        """Forget every cached pack of a repo, e.g. right after a push."""
+        repo = self.repo_dir(repo_path).name
+        self._generations[repo] = self._generations.get(repo, 0) + 1
+        for entry_key in [k for k in self._entries if k[0] == repo]:
+            _, size = self._entries.pop(entry_key)
+            self.total_bytes -= size
+            self.invalidations += 1
+        # also packs published by other workers; their lookups then miss on exists()
+        for path in (self.root / repo).glob("*.pack"):
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+pack_cache = PackCache()
@@ -0,0 +1,184 @@
+# password hashing off the event loop: bcrypt runs in a process pool, behind a concurrency cap
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from fastapi import HTTPException
+
+# cost factor for new hashes; stored hashes below it are upgraded on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+# hashes in flight at once; the default leaves half the cores to git, whatever the login rate
+PASSWORD_MAX_CONCURRENCY = int(os.getenv("PASSWORD_MAX_CONCURRENCY", str(max(1, (os.cpu_count() or 1) // 2))))
+# how long a request may wait for a free slot before it gets a 503
+PASSWORD_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_QUEUE_TIMEOUT", "5"))
+PASSWORD_RETRY_AFTER = int(os.getenv("PASSWORD_RETRY_AFTER", "2"))
+PASSWORD_NICE = int(os.getenv("PASSWORD_NICE", "5"))   # a bit below git and the web workers
+
+BCRYPT_MAX_BYTES = 72  # bcrypt ignores (bcrypt>=5: refuses) anything past this
+
+logger = logging.getLogger(__name__)
+
+if not 4 <= BCRYPT_ROUNDS <= 31:
+    raise ValueError("BCRYPT_ROUNDS must be between 4 and 31")
+
+
+# ~~~ run inside the pool processes: module-level so they pickle
+def _init_worker(niceness: int) -> None:
+    os.nice(niceness)
+
+
+def _hash(plaintext: bytes, rounds: int) -> str:
+    import bcrypt   # only the pool processes need it
+
+    return bcrypt.hashpw(plaintext, bcrypt.gensalt(rounds)).decode()
+
+
+def _verify(plaintext: bytes, hashed: bytes, rounds: int) -> tuple[bool, Optional[str]]:
+    """Check, and in the same trip re-hash at `rounds` if the stored cost is lower."""
+    import bcrypt
+
+    try:
+        ok = bcrypt.checkpw(plaintext, hashed)
+    except ValueError:   # not a bcrypt hash
+        return False, None
+    if ok and hash_rounds(hashed.decode()) < rounds:
+        return True, _hash(plaintext, rounds)
+    return ok, None
+
+
+def hash_rounds(hashed: str) -> int:
+    # "$2b$12$<salt+hash>"
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+class PasswordHasher:
+    """
+    A ProcessPoolExecutor (spawned, niced) for bcrypt, behind a semaphore.
+    The pool is started lazily and shut down by the app lifespan. Waiting for
+    a slot is bounded too: a login storm gets 503s instead of a growing queue.
+    Unbounded waits (bulk imports) queue behind a second, smaller semaphore
+    first, so they never hold or wait for the last slot and logins get it.
+    """
+
+    def __init__(self,
+                 workers: int = PASSWORD_WORKERS,
+                 max_concurrency: int = PASSWORD_MAX_CONCURRENCY,
+                 queue_timeout: float = PASSWORD_QUEUE_TIMEOUT,
+                 rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.rounds = rounds
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._bulk_semaphore: Optional[asyncio.Semaphore] = None
+        self._dummy_hash: Optional[str] = None
+        self.waiting = 0
+        self.bulk_waiting = 0
+        self.rejected = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: forking a process with live threads and an event loop invites deadlocks
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker, initargs=(PASSWORD_NICE,))
+        return self._pool
+
+    async def _run(self, fn, *args, timeout: Optional[float]):
+        if timeout is None:
+            if self._bulk_semaphore is None:
+                self._bulk_semaphore = asyncio.Semaphore(max(1, self.max_concurrency - 1))
+            self.bulk_waiting += 1
+            try:
+                await self._bulk_semaphore.acquire()
+            finally:
+                self.bulk_waiting -= 1
+            try:
+                return await self._run_slot(fn, *args, timeout=None)
+            finally:
+                self._bulk_semaphore.release()
+        return await self._run_slot(fn, *args, timeout=timeout)
+
+    async def _run_slot(self, fn, *args, timeout: Optional[float]):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many password checks in flight, retry shortly",
+                                headers={"Retry-After": str(PASSWORD_RETRY_AFTER)})
+        finally:
+            self.waiting -= 1
+        try:
+            pool = self._executor()
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # a worker died (OOM killer...): a broken pool never recovers, so the next call gets a new one
+            logger.error("password pool broken, respawning")
+            if self._pool is pool:
+                self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            self._semaphore.release()
+
+    async def hash(self, plaintext: str, bounded_wait: bool = True) -> str:
+        """
+        bcrypt hash at the configured cost. bounded_wait=False (imports) waits
+        for a slot however long it takes, but only ever uses max_concurrency - 1.
+        """
+        encoded = plaintext.encode()
+        if len(encoded) > BCRYPT_MAX_BYTES:
+            raise ValueError(f"Password longer than {BCRYPT_MAX_BYTES} bytes")
+        return await self._run(_hash, encoded, self.rounds,
+                               timeout=self.queue_timeout if bounded_wait else None)
+
+    async def verify(self, plaintext: str, hashed: Optional[str]) -> tuple[bool, Optional[str]]:
+        """
+        (matches, upgraded hash or None). Unknown users (hashed=None) are
+        checked against a dummy hash, so they cost the same as a wrong password.
+        """
+        encoded = plaintext.encode()
+        if hashed is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = await self.hash("")
+            await self._run(_verify, b"", self._dummy_hash.encode(), 0, timeout=self.queue_timeout)
+            return False, None
+        if len(encoded) > BCRYPT_MAX_BYTES:
+            return False, None
+        return await self._run(_verify, encoded, hashed.encode(), self.rounds, timeout=self.queue_timeout)
+
+    def hash_blocking(self, plaintext: str) -> str:
+        """For sync callers (threadpool endpoints, scripts): still in the pool, but no cap."""
+        encoded = plaintext.encode()
+        if len(encoded) > BCRYPT_MAX_BYTES:
+            raise ValueError(f"Password longer than {BCRYPT_MAX_BYTES} bytes")
+        return self._executor().submit(_hash, encoded, self.rounds).result()
+
+    def shutdown(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "waiting": self.waiting,
+            "bulk_waiting": self.bulk_waiting,
+            "rejected": self.rejected,
+        }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,98 @@
+# store bring-up for the lifespan: warm the SQL pools, open Mongo, retry in the background, report on /ready
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from . import mongo_store
+from .database_sessions import async_engine, engine
+
+# connections opened up front per async pool, so the first requests don't pay for connecting
+DB_WARM_CONNECTIONS = int(os.getenv("DB_WARM_CONNECTIONS", "2"))
+# how long the lifespan waits for the stores before letting the worker serve anyway (not ready)
+STARTUP_WAIT = float(os.getenv("STARTUP_WAIT", "5"))
+STARTUP_ATTEMPT_TIMEOUT = float(os.getenv("STARTUP_ATTEMPT_TIMEOUT", "5"))
+STARTUP_RETRY_MAX = float(os.getenv("STARTUP_RETRY_MAX", "30"))   # seconds between attempts, at most
+
+logger = logging.getLogger(__name__)
+
+
+async def _warm_sql(connections: int = DB_WARM_CONNECTIONS) -> None:
+    async def ping():
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    # held at the same time, so the pool really ends up with that many open
+    await asyncio.gather(*(ping() for _ in range(max(1, connections))))
+
+    def ping_sync():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    await run_in_threadpool(ping_sync)
+
+
+class Readiness:
+    """
+    Brings the stores up after the worker has started instead of at import:
+    one attempt inside the lifespan (bounded by STARTUP_WAIT), then retries
+    with backoff in the background. Until every check passes /ready answers
+    503, so the load balancer keeps traffic away without the worker dying.
+    """
+
+    def __init__(self, wait: float = STARTUP_WAIT):
+        self.wait = wait
+        self.checks = {"sql": False, "mongo": False}
+        self.errors: dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return all(self.checks.values())
+
+    async def _attempt(self) -> None:
+        for name, bring_up in (("sql", _warm_sql), ("mongo", mongo_store.init_store)):
+            if self.checks[name]:
+                continue
+            try:
+                await asyncio.wait_for(bring_up(), STARTUP_ATTEMPT_TIMEOUT)
+                self.checks[name] = True
+                self.errors.pop(name, None)
+            except Exception as e:
+                self.errors[name] = f"{type(e).__name__}: {e}"[:200]
+
+    async def _run(self) -> None:
+        delay = 0.5
+        while True:
+            await self._attempt()
+            if self.ready:
+                logger.info("stores ready")
+                return
+            logger.warning("stores not ready, retrying", extra={"errors": self.errors, "retry_in": delay})
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        # wait() doesn't cancel on timeout: a slow start only stops the waiting, the bring-up carries on
+        done, _ = await asyncio.wait({self._task}, timeout=self.wait)
+        if not done:
+            logger.warning("serving before the stores are up", extra={"errors": self.errors})
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "checks": dict(self.checks), "errors": dict(self.errors)}
+
+
+readiness = Readiness()
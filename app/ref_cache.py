@@ -0,0 +1,113 @@
+# in-process cache for /info/refs advertisements
+import asyncio
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Hashable
+
+from starlette.concurrency import run_in_threadpool
+
+REF_CACHE_SIZE = int(os.getenv("REF_CACHE_SIZE", "512"))
+
+
+def ref_fingerprint(repo_path: Path) -> tuple:
+    """
+    Cheap, stat-only fingerprint of a repository's ref state.
+    git updates refs by renaming lock files into place, so the mtime of
+    HEAD, packed-refs and every directory under refs/ moves on any ref change.
+    config is in there too: upload-pack's advertised capabilities follow it.
+    Blocking (one stat per ref directory): call it from a thread, see get_or_load.
+    """
+    parts = []
+    for name in ("HEAD", "packed-refs", "config"):
+        try:
+            st = os.stat(repo_path / name)
+            parts.append((name, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            parts.append((name, 0, 0))
+    for dirpath, _, _ in os.walk(repo_path / "refs"):
+        parts.append((dirpath, os.stat(dirpath).st_mtime_ns))
+    return tuple(parts)
+
+
+class RefAdvertisementCache:
+    """
+    Bounded LRU of ref advertisements keyed by (repo path, variant).
+    An entry is only served while the repo's ref fingerprint still matches,
+    and concurrent misses for the same key share a single git invocation.
+    """
+
+    def __init__(self, max_entries: int = REF_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple[tuple, bytes]]" = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get_or_load(self,
+                          repo_path: Path,
+                          variant: Hashable,
+                          loader: Callable[[], Awaitable[bytes]]) -> bytes:
+        key = (str(repo_path), variant)
+        # the walk is a stat per nested refs/ directory: off the event loop, it runs on every fetch
+        fingerprint = await run_in_threadpool(ref_fingerprint, repo_path)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            body = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            future.set_result(body)
+            self._store(key, fingerprint, body)
+            return body
+        finally:
+            self._inflight.pop(key, None)
+
+    def _store(self, key: tuple, fingerprint: tuple, body: bytes) -> None:
+        self._entries[key] = (fingerprint, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, repo_path: Path) -> None:
+        """Drop every advertisement for a repo, e.g. right after a push."""
+        repo = str(repo_path)
+        for key in [k for k in self._entries if k[0] == repo]:
+            del self._entries[key]
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+ref_cache = RefAdvertisementCache()
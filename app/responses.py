@@ -0,0 +1,31 @@
+# fast JSON path for the hot read endpoints: DTOs straight to bytes with orjson
+from typing import Any
+
+import orjson
+from pydantic import BaseModel
+from starlette.responses import Response
+
+
+def _default(obj: Any):
+    # a DTO's __dict__ is its fields, in order; orjson calls back here for nested ones too.
+    # Fine for json_dto models (plain fields: no aliases, no custom serializers)
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class DTOResponse(Response):
+    """
+    JSON response for a DTO that crud already validated: returned from the
+    endpoint as is, so FastAPI's response_model doesn't validate the page a
+    second time, and serialized by orjson without a dict/jsonable pass.
+    Keep response_model on the route: it still documents the schema.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
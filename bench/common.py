@@ -0,0 +1,62 @@
+# shared bits for the benchmark scripts
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def use_local_stores(workdir: Path) -> None:
+    """
+    Point the app at throwaway local stores unless the caller already did:
+    a SQLite file for both engines, the in-memory Mongo double and a private
+    REPO_ROOT. Must run before anything under app/ is imported.
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    db_file = workdir / "bench.sqlite"
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{db_file}")
+    os.environ.setdefault("ASYNC_DATABASE_URL", f"sqlite+aiosqlite:///{db_file}")
+    os.environ.setdefault("MONGO_BACKEND", "memory")
+    os.environ.setdefault("REPO_ROOT", str(workdir / "repos"))
+    os.environ.setdefault("PACK_CACHE_DIR", str(workdir / "pack-cache"))
+
+
+def default_workdir(name: str) -> Path:
+    return Path(tempfile.gettempdir()) / f"cornhub-bench-{name}"
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    """Throughput and latency percentiles (milliseconds) for one scenario."""
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p90_ms": round(percentile(values, 90) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def write_results(results: dict, output: str) -> None:
+    """Machine-readable results: to a file, or stdout for '-'."""
+    results.setdefault("meta", {}).update({
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": sys.version.split()[0],
+    })
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output == "-":
+        print(text)
+    else:
+        Path(output).write_text(text + "\n")
@@ -0,0 +1,107 @@
+"""
+Sync vs async session benchmark.
+
+Runs the same read mix (list_repos, list_issues, get_user_by_id) at a fixed
+concurrency through
+  - sync:  SessionLocal in a threadpool hop, like the `def` endpoints
+  - async: AsyncSessionLocal awaited on the loop, like the `async def` endpoints
+and writes throughput and p50/p90/p99 latency per path as JSON.
+
+    python -m bench.db_sessions --concurrency 64 --duration 10
+    DATABASE_URL=postgresql+psycopg2://... ASYNC_DATABASE_URL=postgresql+asyncpg://... \
+        python -m bench.db_sessions -o db_sessions.json
+
+Without DATABASE_URL/ASYNC_DATABASE_URL it runs against a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from .common import default_workdir, summarize, use_local_stores, write_results
+
+
+def seed(n_users: int, n_repos: int, n_issues: int) -> None:
+    from app import models
+    from app.database_sessions import engine, SessionLocal
+
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        if db.query(models.Repository).count():
+            return
+        db.add_all(models.User(username=f"bench{i}", email=f"bench{i}@example.com", password_hash="x")
+                   for i in range(1, n_users + 1))
+        db.flush()
+        db.add_all(models.Repository(reponame=f"bench-repo-{i}", maintainer_id=1 + i % n_users,
+                                     next_issue_num=n_issues + 1)
+                   for i in range(1, n_repos + 1))
+        db.flush()
+        db.add_all(models.Issue(repo_id=1 + i % n_repos, issue_num=1 + i // n_repos, author_id=1 + i % n_users,
+                                title=f"bench issue {i}", nosql_thread_id="0" * 24)
+                   for i in range(n_issues))
+        db.commit()
+
+
+async def drive(call, concurrency: int, duration: float) -> dict:
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(n: int) -> None:
+        nonlocal errors
+        for i in itertools.count(n):
+            if time.perf_counter() >= deadline:
+                return
+            started = time.perf_counter()
+            try:
+                await call(i)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+async def main(args) -> dict:
+    from starlette.concurrency import run_in_threadpool
+    from app import crud
+    from app.database_sessions import AsyncSessionLocal, SessionLocal, async_engine, engine
+
+    def sync_op(i: int) -> None:
+        with SessionLocal() as db:
+            crud.list_repos(db, 1, 20)
+            crud.list_issues(db, 1 + i % args.repos, 1, 20)
+            crud.get_user_by_id(db, 1 + i % args.users)
+
+    async def async_op(i: int) -> None:
+        async with AsyncSessionLocal() as db:
+            await crud.list_repos_async(db, 1, 20)
+            await crud.list_issues_async(db, 1 + i % args.repos, 1, 20)
+            await crud.get_user_by_id_async(db, 1 + i % args.users)
+
+    results = {"meta": {"concurrency": args.concurrency, "duration_s": args.duration,
+                        "sync_url": engine.url.render_as_string(), "async_url": async_engine.url.render_as_string()}}
+    # warm both pools before measuring
+    await drive(lambda i: run_in_threadpool(sync_op, i), args.concurrency, 1)
+    await drive(async_op, args.concurrency, 1)
+    results["sync"] = await drive(lambda i: run_in_threadpool(sync_op, i), args.concurrency, args.duration)
+    results["async"] = await drive(async_op, args.concurrency, args.duration)
+    await async_engine.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per path")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repos", type=int, default=50)
+    parser.add_argument("--issues", type=int, default=5000)
+    parser.add_argument("-o", "--output", default="-", help="JSON output file, '-' for stdout")
+    args = parser.parse_args()
+
+    use_local_stores(default_workdir("db-sessions"))
+    seed(args.users, args.repos, args.issues)
+    write_results(asyncio.run(main(args)), args.output)
@@ -0,0 +1,139 @@
+"""
+Full vs. shallow vs. partial clones of a synthetic large repo.
+
+Starts the app under uvicorn against local stores (see bench/run.py), builds
+a repo with git fast-import, switches on the repo's partial clone settings
+(PATCH /repos/{id}/settings) and then clones it over smart HTTP, one clone
+at a time, in each mode:
+
+    full                git clone --bare
+    shallow             git clone --bare --depth=1
+    blobless            git clone --bare --filter=blob:none
+    treeless            git clone --bare --filter=tree:0
+    blobless.checkout   git clone --filter=blob:none   (HEAD's blobs come in a lazy fetch)
+
+and reports, per clone: bytes git sent (git_bytes_out_total on /metrics),
+server CPU seconds (the uvicorn process plus the git children it reaped,
+from /proc, so Linux only), client wall time and the size of the clone.
+The pack cache is off unless --pack-cache, so every clone makes git pack.
+
+    python -m bench.partial_clone -o partial_clone.json
+    python -m bench.partial_clone --git-commits 500 --git-files 50 --modes full,blobless
+
+Needs httpx and aiosqlite plus a git binary (>= 2.27 for tree:0 with bitmaps).
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+from .common import default_workdir, use_local_stores, write_results
+from .run import free_port, git, populate_repo, seed_sql, start_server
+
+MODES = {
+    "full": ("--bare",),
+    "shallow": ("--bare", "--depth=1"),
+    "blobless": ("--bare", "--filter=blob:none"),
+    "treeless": ("--bare", "--filter=tree:0"),
+    "blobless.checkout": ("--filter=blob:none",),
+}
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+def server_cpu_seconds(pid: int) -> float:
+    """utime + stime + cutime + cstime: the server and every git process it has waited for."""
+    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    return sum(int(v) for v in fields[11:15]) / CLK_TCK
+
+
+async def git_bytes_out(client) -> int:
+    text = (await client.get("/metrics")).text
+    return sum(int(float(line.rsplit(" ", 1)[1])) for line in text.splitlines()
+               if line.startswith("git_bytes_out_total"))
+
+
+def dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+async def measure(client, server_pid: int, url: str, mode: str, clones: int, scratch: Path) -> dict:
+    samples = []
+    for i in range(clones):
+        target = scratch / f"{mode}-{i}"
+        bytes_before, cpu_before = await git_bytes_out(client), server_cpu_seconds(server_pid)
+        started = time.perf_counter()
+        await git("clone", "--quiet", *MODES[mode], url, str(target))
+        wall = time.perf_counter() - started
+        samples.append({
+            "bytes_sent": await git_bytes_out(client) - bytes_before,
+            "server_cpu_s": server_cpu_seconds(server_pid) - cpu_before,
+            "wall_s": wall,
+            "clone_bytes": dir_bytes(target),
+        })
+        shutil.rmtree(target, ignore_errors=True)
+    return {key: round(sum(s[key] for s in samples) / len(samples), 4) for key in samples[0]} | {"clones": clones}
+
+
+async def main(args, workdir: Path) -> dict:
+    import httpx
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = await start_server(workdir, port, workers=1)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            resp = await client.post("/repos", json={"reponame": "bench-large", "maintainer_id": 1})
+            resp.raise_for_status()
+            repo_id = resp.json()["repo_id"]
+            repo_path = Path(os.environ["REPO_ROOT"]) / "bench-large.git"
+            populate_repo(repo_path, args.git_commits, args.git_files, args.git_file_size)
+            if not args.no_bitmaps:
+                # what the maintenance worker leaves behind; blob:none and tree:0 are answered from bitmaps
+                subprocess.run(["git", "repack", "-a", "-d", "-q", "--write-bitmap-index"], cwd=repo_path, check=True)
+            (await client.patch(f"/repos/{repo_id}/settings",
+                                json={"allow_filter": True, "allow_any_sha1_in_want": True})).raise_for_status()
+
+            url = f"{base_url}/bench-large.git"
+            scratch = workdir / "clients"
+            await git("clone", "--quiet", "--bare", url, str(scratch / "warm-up"))
+            results = {"meta": vars(args) | {"git_repo_bytes": dir_bytes(repo_path)}, "modes": {}}
+            for mode in args.modes:
+                results["modes"][mode] = await measure(client, server.pid, url, mode, args.clones, scratch)
+            full = results["modes"].get("full")
+            if full:
+                for stats in results["modes"].values():
+                    stats["bytes_vs_full"] = round(stats["bytes_sent"] / full["bytes_sent"], 4) if full["bytes_sent"] else None
+                    stats["cpu_vs_full"] = round(stats["server_cpu_s"] / full["server_cpu_s"], 4) if full["server_cpu_s"] else None
+            return results
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default=",".join(MODES), type=lambda v: [m for m in v.split(",") if m])
+    parser.add_argument("--clones", type=int, default=3, help="clones per mode, averaged")
+    parser.add_argument("--git-commits", type=int, default=300)
+    parser.add_argument("--git-files", type=int, default=40, help="files rewritten per commit")
+    parser.add_argument("--git-file-size", type=int, default=8192)
+    parser.add_argument("--no-bitmaps", action="store_true", help="skip the bitmap repack before cloning")
+    parser.add_argument("--pack-cache", action="store_true", help="leave the full-clone pack cache on")
+    parser.add_argument("--workdir", type=Path, default=default_workdir("partial-clone"))
+    parser.add_argument("-o", "--output", default="-", help="JSON output file, '-' for stdout")
+    args = parser.parse_args()
+
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+    shutil.rmtree(args.workdir, ignore_errors=True)
+    use_local_stores(args.workdir)
+    if not args.pack_cache:
+        os.environ["PACK_CACHE_MAX_BYTES"] = "0"
+    seed_sql(1)
+    results = asyncio.run(main(args, args.workdir))
+    results["meta"]["workdir"] = str(results["meta"]["workdir"])
+    write_results(results, args.output)
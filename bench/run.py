@@ -0,0 +1,274 @@
+"""
+Load-test harness for the HTTP API and the git smart-protocol endpoints.
+
+Starts the app under uvicorn against local stores (SQLite + the in-memory
+Mongo double unless DATABASE_URL/ASYNC_DATABASE_URL/MONGO_BACKEND say
+otherwise), seeds users, repos and issues, generates a synthetic git repo
+of configurable size, then measures throughput and p50/p90/p99 latency for:
+
+    repos.list, issues.list, issues.detail, issues.comment
+    git.clone, git.fetch, git.push          (over /{repo}.git/*)
+
+Results are written as JSON so runs can be diffed for regressions:
+
+    python -m bench.run -o bench_output.json
+    python -m bench.run --scenarios repos.list,git.clone --concurrency 32 --duration 20
+
+Needs httpx and aiosqlite (pip install -r requirements-dev.txt) plus a git binary.
+--workers > 1 needs a real Mongo (MONGO_BACKEND=mongo): the in-memory double
+is per process, so each uvicorn worker would see its own issues.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from .common import default_workdir, summarize, use_local_stores, write_results
+
+HTTP_SCENARIOS = ("repos.list", "issues.list", "issues.detail", "issues.comment")
+GIT_SCENARIOS = ("git.clone", "git.fetch", "git.push")
+ROOT = Path(__file__).resolve().parent.parent
+
+
+# ~~~ synthetic data
+def fast_import_stream(commits: int, files: int, file_size: int, seed: int = 0) -> bytes:
+    """A git fast-import stream: `commits` commits on main, each rewriting `files` files of random bytes."""
+    rng = random.Random(seed)
+    out = []
+    for c in range(1, commits + 1):
+        out.append(f"commit refs/heads/main\nmark :{c}\n"
+                   f"committer Bench <bench@example.com> {1700000000 + c} +0000\n"
+                   f"data {len(f'commit {c}')}\ncommit {c}\n")
+        if c > 1:
+            out.append(f"from :{c - 1}\n")
+        for f in range(files):
+            blob = rng.randbytes(file_size).hex()[:file_size]
+            out.append(f"M 644 inline src/file_{f}.txt\ndata {len(blob)}\n{blob}\n")
+    return "".join(out).encode()
+
+
+def populate_repo(repo_path: Path, commits: int, files: int, file_size: int) -> None:
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=repo_path, check=True,
+                   input=fast_import_stream(commits, files, file_size))
+    subprocess.run(["git", "symbolic-ref", "HEAD", "refs/heads/main"], cwd=repo_path, check=True)
+
+
+def seed_sql(n_users: int) -> None:
+    """Users go straight into SQL: POST /users would spend the run inside bcrypt."""
+    from app import models
+    from app.database_sessions import engine, SessionLocal
+
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        if not db.query(models.User).count():
+            db.add_all(models.User(username=f"bench{i}", email=f"bench{i}@example.com", password_hash="x")
+                       for i in range(1, n_users + 1))
+            db.commit()
+
+
+async def seed_http(client, args) -> dict:
+    """Repos, issues and comments go through the API so Mongo threads and bare repos exist."""
+    repo_ids = []
+    for r in range(args.repos):
+        resp = await client.post("/repos", json={"reponame": f"bench-{r}", "maintainer_id": 1 + r % args.users})
+        resp.raise_for_status()
+        repo_ids.append(resp.json()["repo_id"])
+
+    sem = asyncio.Semaphore(16)
+
+    async def new_issue(repo_id: int, n: int) -> None:
+        async with sem:
+            resp = await client.post(f"/repos/{repo_id}/issues", json={"title": f"issue {n}", "body": "x" * 200})
+            resp.raise_for_status()
+            for k in range(args.comments):
+                await client.post(f"/repos/{repo_id}/issues/{resp.json()['issue_num']}/comments",
+                                  json={"body": f"comment {k}"})
+
+    await asyncio.gather(*(new_issue(repo_id, n) for repo_id in repo_ids for n in range(args.issues)))
+    return {"repo_ids": repo_ids, "git_repo": "bench-0"}
+
+
+# ~~~ server
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_server(workdir: Path, port: int, workers: int) -> subprocess.Popen:
+    import httpx
+
+    log = open(workdir / "server.log", "wb")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=os.environ.copy(), stdout=log, stderr=subprocess.STDOUT,
+    )
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+        for _ in range(200):
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited early, see {workdir / 'server.log'}")
+            try:
+                if (await client.get("/ready")).status_code == 200:   # stores up, not just listening
+                    return server
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("server did not come up")
+
+
+# ~~~ load generation
+async def drive(call, concurrency: int, duration: float, max_requests: int = 0) -> dict:
+    """Run `call(worker, i)` from `concurrency` workers until the deadline (or request cap)."""
+    latencies, errors, issued = [], 0, 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(w: int) -> None:
+        nonlocal errors, issued
+        i = 0
+        while time.perf_counter() < deadline and not (max_requests and issued >= max_requests):
+            issued += 1
+            started = time.perf_counter()
+            try:
+                await call(w, i)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+            i += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+async def git(*args: str, cwd: Path = None) -> None:
+    process = await asyncio.create_subprocess_exec(
+        "git", *args, cwd=cwd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+    )
+    _, err = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(err.decode(errors="replace"))
+
+
+def http_scenarios(client, seeded: dict, args) -> dict:
+    repo_ids = seeded["repo_ids"]
+
+    async def repos_list(w, i):
+        (await client.get("/repos", params={"size": 20})).raise_for_status()
+
+    async def issues_list(w, i):
+        (await client.get(f"/repos/{repo_ids[i % len(repo_ids)]}/issues", params={"size": 20})).raise_for_status()
+
+    async def issues_detail(w, i):
+        repo_id = repo_ids[i % len(repo_ids)]
+        (await client.get(f"/repos/{repo_id}/issues/{1 + i % args.issues}")).raise_for_status()
+
+    async def issues_comment(w, i):
+        repo_id = repo_ids[(w + i) % len(repo_ids)]
+        (await client.post(f"/repos/{repo_id}/issues/{1 + i % args.issues}/comments",
+                           json={"body": f"bench {w}/{i}"})).raise_for_status()
+
+    return {"repos.list": repos_list, "issues.list": issues_list,
+            "issues.detail": issues_detail, "issues.comment": issues_comment}
+
+
+def git_scenarios(base_url: str, seeded: dict, workdir: Path) -> dict:
+    url = f"{base_url}/{seeded['git_repo']}.git"
+    scratch = workdir / "clients"
+
+    async def clone(w, i):
+        target = scratch / f"clone-{w}-{i}"
+        try:
+            await git("clone", "--bare", "--quiet", url, str(target))
+        finally:
+            shutil.rmtree(target, ignore_errors=True)
+
+    async def fetch(w, i):
+        target = scratch / f"fetch-{w}"
+        if not target.exists():
+            await git("clone", "--bare", "--quiet", url, str(target))
+        await git("fetch", "--quiet", url, "+refs/heads/*:refs/heads/*", cwd=target)
+
+    async def push(w, i):
+        target = scratch / f"push-{w}"
+        if not target.exists():
+            await git("clone", "--quiet", url, str(target))
+            await git("config", "user.email", "bench@example.com", cwd=target)
+            await git("config", "user.name", "bench", cwd=target)
+        (target / f"worker-{w}.txt").write_text(f"{i}\n")
+        await git("add", ".", cwd=target)
+        await git("commit", "--quiet", "-m", f"bench {w}/{i}", cwd=target)
+        await git("push", "--quiet", url, f"HEAD:refs/heads/bench-{w}", cwd=target)
+
+    return {"git.clone": clone, "git.fetch": fetch, "git.push": push}
+
+
+async def main(args, workdir: Path) -> dict:
+    import httpx
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = await start_server(workdir, port, args.workers)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            seeded = await seed_http(client, args)
+            repo_path = Path(os.environ["REPO_ROOT"]) / f"{seeded['git_repo']}.git"
+            populate_repo(repo_path, args.git_commits, args.git_files, args.git_file_size)
+
+            calls = {**http_scenarios(client, seeded, args), **git_scenarios(base_url, seeded, workdir)}
+            results = {"meta": vars(args) | {"git_repo_bytes": sum(
+                p.stat().st_size for p in repo_path.rglob("*") if p.is_file())}, "scenarios": {}}
+            for name in args.scenarios:
+                git_op = name in GIT_SCENARIOS
+                concurrency = args.git_concurrency if git_op else args.concurrency
+                await drive(calls[name], concurrency, min(1.0, args.duration))  # warm-up
+                results["scenarios"][name] = await drive(
+                    calls[name], concurrency, args.duration, args.git_max_ops if git_op else 0)
+            return results
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(HTTP_SCENARIOS + GIT_SCENARIOS),
+                        type=lambda v: [s for s in v.split(",") if s])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="HTTP API workers")
+    parser.add_argument("--git-concurrency", type=int, default=4, help="concurrent git clients")
+    parser.add_argument("--git-max-ops", type=int, default=0, help="cap git operations per scenario (0 = none)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--repos", type=int, default=5)
+    parser.add_argument("--issues", type=int, default=50, help="issues per repo")
+    parser.add_argument("--comments", type=int, default=5, help="comments per issue")
+    parser.add_argument("--git-commits", type=int, default=200)
+    parser.add_argument("--git-files", type=int, default=20, help="files rewritten per commit")
+    parser.add_argument("--git-file-size", type=int, default=4096)
+    parser.add_argument("--workdir", type=Path, default=default_workdir("run"))
+    parser.add_argument("--keep", action="store_true", help="reuse --workdir instead of starting clean")
+    parser.add_argument("-o", "--output", default="-", help="JSON output file, '-' for stdout")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(HTTP_SCENARIOS + GIT_SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.workers > 1 and os.getenv("MONGO_BACKEND", "memory") == "memory":
+        parser.error("--workers > 1 needs MONGO_BACKEND=mongo: every worker gets its own in-memory issue store")
+    if not args.keep:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+    use_local_stores(args.workdir)
+    seed_sql(args.users)
+    results = asyncio.run(main(args, args.workdir))
+    results["meta"]["workdir"] = str(results["meta"]["workdir"])
+    write_results(results, args.output)
@@ -0,0 +1,143 @@
+"""
+Per-item cost of building and serializing json_dto pages.
+
+100-item IssuePage, RepoPage and IssueDetailResponse (100 comments), from
+the same synthetic rows, four ways:
+
+    stdlib          DTO per row -> response_model re-validation -> jsonable_encoder -> json.dumps
+                    (the old path)
+    pydantic_core   DTO per row -> response_model re-validation -> TypeAdapter.dump_json
+                    (FastAPI's own fast path, still validating twice)
+    construct       model_construct per row -> responses.DTOResponse.render
+                    (no validation at all, but model_construct is pure Python)
+    orjson          rows as dicts -> one model_validate per page -> responses.DTOResponse.render
+                    (what the read endpoints do now, see crud._issues_page)
+
+and reports microseconds per item (best of --repeat) plus the speed-up over stdlib.
+
+    python -m bench.serialization
+    python -m bench.serialization --items 20 --repeat 10 -o serialization.json
+
+No database or server involved, only app.json_dto and app.responses.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from .common import write_results
+
+PATHS = ("stdlib", "pydantic_core", "construct", "orjson")
+
+
+def rows(n: int) -> dict:
+    """What the SELECTs hand back: tuples/rows for the lists, dicts for Mongo comments."""
+    base = datetime(2024, 1, 1, 12, 0, 0, 123456)
+    return {
+        "issues": [SimpleNamespace(issue_num=n - i, title=f"Issue number {n - i}: something is broken",
+                                   author_id=1 + i % 7, status=SimpleNamespace(value="open" if i % 3 else "closed"),
+                                   created_at=base + timedelta(minutes=i)) for i in range(n)],
+        "repos": [(n - i, f"repo-{n - i}", f"user{i % 7}") for i in range(n)],
+        "comments": [{"user": f"user{i % 7}", "body": f"comment {i} " * 8, "timestamp": base + timedelta(seconds=i)}
+                     for i in range(n)],
+    }
+
+
+def builders(data: dict, how: str) -> dict:
+    """how: "per_row" (a validated constructor call per DTO), "construct" or "page" (dicts, one model_validate)."""
+    from app.json_dto import (CommentItem, IssueDetailResponse, IssueItem, IssuePage, PageMeta,
+                              RepoItem, RepoPage)
+
+    def make(model, **fields):
+        if how == "per_row":
+            return model(**fields)
+        if how == "construct":
+            return model.model_construct(**fields)
+        return fields if model not in (IssuePage, RepoPage, IssueDetailResponse) else model.model_validate(fields)
+
+    def meta():
+        return make(PageMeta, page=1, size=len(data["repos"]), total_size=1000, total_pages=10, next_cursor="abc")
+
+    def issue_page():
+        return make(IssuePage, meta=meta(), items=[
+            make(IssueItem, issue_num=r.issue_num, title=r.title, author_id=r.author_id,
+                 status=r.status.value, created_at=r.created_at) for r in data["issues"]])
+
+    def repo_page():
+        return make(RepoPage, meta=meta(), items=[
+            make(RepoItem, repo_id=repo_id, reponame=name, maintainer_name=user)
+            for repo_id, name, user in data["repos"]])
+
+    def issue_detail():
+        return make(IssueDetailResponse, repo_id=1, issue_num=1, title="title", author_id=1, body="body " * 50,
+                    created_at=data["comments"][0]["timestamp"], comment_count=len(data["comments"]),
+                    comments=[make(CommentItem, user=c["user"], body=c["body"], timestamp=c["timestamp"])
+                              for c in data["comments"]],
+                    next_comments_cursor=None)
+
+    return {"IssuePage": (IssuePage, issue_page), "RepoPage": (RepoPage, repo_page),
+            "IssueDetailResponse": (IssueDetailResponse, issue_detail)}
+
+
+def paths(data: dict) -> dict:
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from app.responses import DTOResponse
+
+    per_row, constructed, paged = builders(data, "per_row"), builders(data, "construct"), builders(data, "page")
+    out = {}
+    for name, (model, build) in per_row.items():
+        adapter = TypeAdapter(model)
+
+        def stdlib(build=build, adapter=adapter):
+            # response_model: dump the returned model, validate it again, then encode
+            page = adapter.validate_python(build().model_dump())
+            return json.dumps(jsonable_encoder(page)).encode()
+
+        def pydantic_core(build=build, adapter=adapter):
+            return adapter.dump_json(adapter.validate_python(build().model_dump()))
+
+        def construct(build=constructed[name][1]):
+            return DTOResponse(build()).body
+
+        def orjson(build=paged[name][1]):
+            return DTOResponse(build()).body
+
+        out[name] = {"stdlib": stdlib, "pydantic_core": pydantic_core, "construct": construct, "orjson": orjson}
+    return out
+
+
+def best_of(fn, repeat: int, number: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def main(args) -> dict:
+    data = rows(args.items)
+    results = {"meta": vars(args), "models": {}}
+    for name, calls in paths(data).items():
+        outputs = {path: json.loads(calls[path]()) for path in PATHS}
+        assert all(out == outputs["stdlib"] for out in outputs.values()), f"{name}: paths disagree"
+        per_item = {path: best_of(calls[path], args.repeat, args.number) / args.items * 1e6 for path in PATHS}
+        results["models"][name] = {
+            **{f"{path}_us_per_item": round(us, 3) for path, us in per_item.items()},
+            **{f"{path}_speedup": round(per_item["stdlib"] / per_item[path], 2) for path in PATHS[1:]},
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100, help="items (or comments) per page")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=200, help="pages per timing run")
+    parser.add_argument("-o", "--output", default="-", help="JSON output file, '-' for stdout")
+    args = parser.parse_args()
+    write_results(main(args), args.output)
@@ -0,0 +1,71 @@
+# the app against a throwaway SQLite database and the in-memory issue store:
+#   python -m pytest -q
+import os
+import subprocess
+import tempfile
+
+_workdir = tempfile.mkdtemp(prefix="cornhub-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_workdir}/db.sqlite",
+    ASYNC_DATABASE_URL=f"sqlite+aiosqlite:///{_workdir}/db.sqlite",
+    MONGO_BACKEND="memory",
+    REPO_ROOT=f"{_workdir}/repos",
+    PACK_CACHE_DIR=f"{_workdir}/pack-cache",
+    BCRYPT_ROUNDS="4",
+    PASSWORD_WORKERS="2",
+    PASSWORD_MAX_CONCURRENCY="2",
+    PASSWORD_QUEUE_TIMEOUT="1",
+)
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import models
+from app.cli import migrate
+from app.database_sessions import SessionLocal
+from app.dependency_injector import fake_current_user
+from app.main import app
+
+
+@pytest.fixture(scope="session")
+def client():
+    migrate()
+    with SessionLocal() as db:
+        # fake_current_user() is everyone's identity, so that user has to exist
+        db.add_all(models.User(username=f"user{i}", email=f"user{i}@example.com", password_hash="x")
+                   for i in range(1, fake_current_user() + 1))
+        db.commit()
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def repo(client, request) -> dict:
+    """A fresh repository named after the test (RepoResponse as a dict)."""
+    response = client.post("/repos", json={"reponame": request.node.name.replace("[", "-").rstrip("]"),
+                                           "maintainer_id": 1})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+def repo_id(repo) -> int:
+    return repo["repo_id"]
+
+
+# fixed identity and clock: commits made in a test all share one committer second
+GIT_ENV = {**os.environ, "GIT_AUTHOR_NAME": "t", "GIT_AUTHOR_EMAIL": "t@example.com",
+           "GIT_COMMITTER_NAME": "t", "GIT_COMMITTER_EMAIL": "t@example.com",
+           "GIT_AUTHOR_DATE": "2024-01-01T12:00:00Z", "GIT_COMMITTER_DATE": "2024-01-01T12:00:00Z"}
+
+
+def git(*args, cwd=None) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, env=GIT_ENV, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def worktree(tmp_path):
+    path = tmp_path / "work"
+    git("init", "-q", "-b", "main", str(path))
+    return path
@@ -0,0 +1,30 @@
+import asyncio
+
+from app import crud, main, models
+from app.pack_cache import PackSniffer
+
+
+def test_record_access_swallows_lookup_failures(client, monkeypatch):
+    async def broken(db, repo_name):
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(crud, "get_repo_id_by_name_async", broken)
+    before = main.ACCESS_LOG_EVENTS._values.get(("lookup_failed",), 0)
+    asyncio.run(main.record_access("some/repo", 1, models.Action.CLONE))   # no exception: the clone goes on
+    assert main.ACCESS_LOG_EVENTS._values.get(("lookup_failed",), 0) == before + 1
+
+
+def test_too_big_to_peek_negotiation_is_left_to_the_reply():
+    assert main.upload_pack_action(b"0032have " + b"a" * 40 + b"\n", complete=False) is None
+
+
+def test_pack_sniffer_only_sees_the_round_with_the_pack():
+    async def sniff(*chunks: bytes) -> bool:
+        sniffer = PackSniffer()
+        for chunk in chunks:
+            await sniffer.write(chunk)
+        return sniffer.saw_pack
+
+    assert not asyncio.run(sniff(b"0031ACK " + b"a" * 40 + b" common\n", b"0008NAK\n"))
+    assert asyncio.run(sniff(b"0008NAK\n", b"0010\x01PA", b"CK\x00\x00\x00\x02"))   # v0 side-band, split chunk
+    assert asyncio.run(sniff(b"0014acknowledgments\n0008ready\n0001", b"000dpackfile\n"))   # v2
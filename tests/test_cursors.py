@@ -0,0 +1,22 @@
+import pytest
+
+from app.crud import encode_cursor
+
+BAD_REPO_CURSORS = [encode_cursor([1]), encode_cursor("1"), encode_cursor(True), "not base64 json"]
+BAD_ISSUE_CURSORS = [encode_cursor("2020-01-01", "x"), encode_cursor("2020-01-01", [2]),
+                     encode_cursor("2020-01-01", True), encode_cursor(1, 2), encode_cursor("yesterday", 2)]
+
+
+@pytest.mark.parametrize("after", BAD_REPO_CURSORS)
+def test_bad_repo_cursor_is_400(client, after):
+    assert client.get("/repos", params={"after": after}).status_code == 400
+
+
+@pytest.mark.parametrize("after", BAD_ISSUE_CURSORS)
+def test_bad_issue_cursor_is_400(client, repo_id, after):
+    assert client.get(f"/repos/{repo_id}/issues", params={"after": after}).status_code == 400
+
+
+@pytest.mark.parametrize("after", [encode_cursor([1], 2), encode_cursor(0.5, "2"), encode_cursor(False, 2)])
+def test_bad_search_cursor_is_400(client, repo_id, after):
+    assert client.get(f"/repos/{repo_id}/issues/search", params={"q": "x", "after": after}).status_code == 400
@@ -0,0 +1,47 @@
+import pytest
+
+from app.crud import encode_cursor
+from app.git_ops import get_repo_path
+
+from conftest import git
+
+
+def same_second_merges(worktree, rounds: int = 6) -> None:
+    """A history where every commit shares one timestamp: two side commits and a merge per round."""
+    git("commit", "-q", "--allow-empty", "-m", "root", cwd=worktree)
+    for n in range(rounds):
+        git("checkout", "-q", "-b", f"side{n}", cwd=worktree)
+        git("commit", "-q", "--allow-empty", "-m", f"side {n}", cwd=worktree)
+        git("checkout", "-q", "main", cwd=worktree)
+        git("commit", "-q", "--allow-empty", "-m", f"main {n}", cwd=worktree)
+        git("merge", "-q", "--no-ff", "-m", f"merge {n}", f"side{n}", cwd=worktree)
+
+
+@pytest.fixture
+def merged_repo(repo, worktree):
+    same_second_merges(worktree)
+    git("push", "-q", str(get_repo_path(repo["reponame"])), "main", cwd=worktree)
+    return repo["repo_id"], git("rev-list", "--date-order", "main", cwd=worktree).split()
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 5, 100])
+def test_commit_pages_cover_history_once(client, merged_repo, limit):
+    repo_id, expected = merged_repo
+    seen, after = [], None
+    for _ in range(len(expected) + 1):
+        response = client.get(f"/repos/{repo_id}/commits",
+                              params={"ref": "main", "limit": limit, **({"after": after} if after else {})})
+        assert response.status_code == 200, response.text
+        seen += [c["sha"] for c in response.json()["items"]]
+        after = response.json()["next_cursor"]
+        if after is None:
+            break
+    assert seen == expected
+
+
+def test_commit_cursor_is_validated(client, merged_repo):
+    repo_id, _ = merged_repo
+    for after in ("a,b", encode_cursor("f" * 40, -1), encode_cursor("HEAD", 1), encode_cursor("f" * 40, "1")):
+        assert client.get(f"/repos/{repo_id}/commits", params={"after": after}).status_code == 400
+    # well formed, but not a commit of this repo
+    assert client.get(f"/repos/{repo_id}/commits", params={"after": encode_cursor("f" * 40, 1)}).status_code == 404
@@ -0,0 +1,43 @@
+import pytest
+
+
+def walk(client, repo_id: int, **params) -> list[int]:
+    """Follow next_cursor to the end, failing instead of looping if a cursor doesn't move."""
+    seen, after = [], None
+    for _ in range(20):
+        response = client.get(f"/repos/{repo_id}/issues", params={**params, **({"after": after} if after else {})})
+        assert response.status_code == 200, response.text
+        page = response.json()
+        seen += [item["issue_num"] for item in page["items"]]
+        after = page["meta"]["next_cursor"]
+        if after is None:
+            return seen
+    pytest.fail(f"cursor never ran out, got {seen}")
+
+
+@pytest.mark.parametrize("sort", ["created", "updated"])
+def test_cursor_pages_through_issues_created_in_the_same_second(client, repo_id, sort):
+    for n in range(7):
+        assert client.post(f"/repos/{repo_id}/issues", json={"title": f"t{n}", "body": "b"}).status_code == 200
+    if sort == "updated":
+        # comments bump updated_at: issue 2 becomes the most recently updated
+        assert client.post(f"/repos/{repo_id}/issues/2/comments", json={"body": "bump"}).status_code == 200
+        expected = [2, 7, 6, 5, 4, 3, 1]
+    else:
+        expected = [7, 6, 5, 4, 3, 2, 1]
+    assert walk(client, repo_id, size=3, sort=sort) == expected
+
+
+def test_new_issue_in_unknown_repo_is_404(client):
+    response = client.post("/repos/999999/issues", json={"title": "t", "body": "b"})
+    assert response.status_code == 404
+
+
+def test_unknown_issue_is_404(client, repo_id):
+    assert client.get(f"/repos/{repo_id}/issues/42").status_code == 404
+    assert client.post(f"/repos/{repo_id}/issues/42/comments", json={"body": "hi"}).status_code == 404
+
+
+def test_unknown_repo_issue_list_and_search_are_404(client):
+    assert client.get("/repos/999999/issues").status_code == 404
+    assert client.get("/repos/999999/issues/search", params={"q": "x"}).status_code == 404
@@ -0,0 +1,59 @@
+import asyncio
+from pathlib import Path
+
+from app.forks import pool_path
+from app.git_ops import get_repo_path
+from app.maintenance import maintenance_worker
+
+from conftest import git
+
+
+def commit(worktree: Path, message: str) -> str:
+    (worktree / f"{message}.txt").write_text(message * 100)
+    git("add", ".", cwd=worktree)
+    git("commit", "-q", "-m", message, cwd=worktree)
+    return git("rev-parse", "HEAD", cwd=worktree)
+
+
+def local_objects(repo_path: Path) -> set[str]:
+    """Objects in the repo's own packs, not the ones it borrows through alternates."""
+    shas = set()
+    for idx in (repo_path / "objects" / "pack").glob("*.idx"):
+        shas.update(line.split()[0] for line in git("verify-pack", "-v", str(idx), cwd=repo_path).splitlines()
+                    if line[:40].isalnum() and len(line.split()[0]) == 40)
+    return shas
+
+
+def test_fork_survives_a_force_pushed_parent_and_maintenance(client, repo, worktree, tmp_path):
+    parent_name = repo["reponame"]
+    parent = get_repo_path(parent_name)
+    a = commit(worktree, "a")
+    b = commit(worktree, "b")
+    git("push", "-q", str(parent), "main", cwd=worktree)
+
+    # the fork borrows a and b from the network pool (refreshed in the background after forking)
+    response = client.post(f"/repos/{repo['repo_id']}/fork",
+                           json={"reponame": f"{parent_name}-fork", "maintainer_id": 1})
+    assert response.status_code == 200, response.text
+    fork_name = response.json()["reponame"]
+    fork = get_repo_path(fork_name)
+    d = commit(worktree, "d")
+    git("push", "-q", str(fork), "main", cwd=worktree)
+
+    # rewrite the parent: b is now only reachable from the fork
+    git("reset", "-q", "--hard", a, cwd=worktree)
+    c = commit(worktree, "c")
+    git("push", "-q", "--force", str(parent), "main", cwd=worktree)
+
+    for name in (parent_name, fork_name):
+        asyncio.run(maintenance_worker._maintain_network(name))
+
+    # the pool caught up with both before either repacked: every commit lives there, once
+    assert {a, b, c, d} <= local_objects(pool_path(repo["repo_id"]))
+    assert not {a, b, c, d} & (local_objects(parent) | local_objects(fork))
+    for path, expected in ((parent, [c, a]), (fork, [d, b, a])):
+        git("fsck", "--full", "--strict", cwd=path)
+        clone = tmp_path / f"clone-{path.name}"
+        git("clone", "-q", "--no-local", str(path), str(clone))
+        git("fsck", "--full", cwd=clone)
+        assert git("rev-list", "origin/main", cwd=clone).split() == expected
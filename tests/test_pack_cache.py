@@ -0,0 +1,72 @@
+import asyncio
+from pathlib import Path
+
+from app.pack_cache import PackCache, clone_cache_key
+
+A, B = "a" * 40, "b" * 40
+REPO = Path("repo.git")
+
+
+def pkt(*lines: str) -> bytes:
+    """pkt-line body; '' is a flush packet."""
+    return b"".join(f"{len(line) + 5:04x}{line}\n".encode() if line else b"0000" for line in lines)
+
+
+def test_clone_cache_key_ignores_want_order_and_agent():
+    key = clone_cache_key(pkt(f"want {A} ofs-delta side-band-64k agent=git/2.39", f"want {B}", "", "done"))
+    assert key is not None
+    assert key == clone_cache_key(pkt(f"want {B} side-band-64k ofs-delta agent=git/2.45", f"want {A}", "", "done"))
+    # anything that shapes the pack is part of the key
+    assert key != clone_cache_key(pkt(f"want {A} ofs-delta side-band-64k", f"want {B}", "deepen 1", "", "done"))
+    assert key != clone_cache_key(pkt(f"want {A} ofs-delta side-band-64k", "", "done"))
+    assert key != clone_cache_key(pkt(f"want {A} ofs-delta side-band-64k", f"want {B}", "", "done"), "v2")
+
+
+def test_clone_cache_key_only_for_complete_have_less_clones():
+    assert clone_cache_key(pkt(f"want {A}", "", f"have {B}", "done")) is None   # a fetch
+    assert clone_cache_key(pkt(f"want {A}", "")) is None                       # negotiation not finished
+    assert clone_cache_key(pkt(f"want {A}", "", "done")[:-3]) is None          # truncated
+    assert clone_cache_key(pkt("", "done")) is None
+
+
+async def fill(cache: PackCache, key: str, data: bytes, invalidate_midway: bool = False) -> None:
+    writer = cache.writer(REPO, key)
+    await writer.write(data[:1])
+    if invalidate_midway:
+        cache.invalidate(REPO)   # a push landed while git was still packing
+    await writer.write(data[1:])
+    await writer.commit()
+
+
+def test_writer_publishes_only_finished_current_packs(tmp_path):
+    cache = PackCache(root=tmp_path, max_bytes=1024)
+    asyncio.run(fill(cache, "one", b"PACK one"))
+    assert cache.lookup(REPO, "one").read_bytes() == b"PACK one"
+
+    asyncio.run(fill(cache, "stale", b"PACK stale", invalidate_midway=True))
+    assert cache.lookup(REPO, "stale") is None and cache.lookup(REPO, "one") is None
+
+    async def aborted():
+        writer = cache.writer(REPO, "aborted")
+        await writer.write(b"PACK partial")
+        await writer.abort()
+
+    asyncio.run(aborted())
+    assert cache.lookup(REPO, "aborted") is None
+    assert not list(tmp_path.rglob("*.tmp")) and not list(tmp_path.rglob("*.pack"))
+    assert cache.total_bytes == 0
+
+
+def test_evicts_oldest_and_reloads_from_disk(tmp_path):
+    cache = PackCache(root=tmp_path, max_bytes=30)   # room for two of them
+    for key in ("one", "two", "three"):
+        asyncio.run(fill(cache, key, b"PACK " + key.encode() * 2))
+        cache.lookup(REPO, "one")   # keep "one" recently used
+    assert cache.lookup(REPO, "two") is None and cache.evictions == 1
+    (cache.repo_dir(REPO) / ".left.over.tmp").write_bytes(b"PACK")   # a worker died mid-write
+
+    restarted = PackCache(root=tmp_path, max_bytes=30)
+    assert restarted.lookup(REPO, "one").read_bytes() == b"PACK oneone"
+    assert restarted.lookup(REPO, "three") is not None
+    assert restarted.total_bytes == cache.total_bytes
+    assert not list(tmp_path.rglob("*.tmp"))
@@ -0,0 +1,27 @@
+import json
+import threading
+import time
+
+from app.passwords import password_hasher
+
+
+def test_login_during_user_import_is_not_queued_out(client, monkeypatch):
+    assert client.post("/users", json={"username": "alice", "email": "alice@example.com",
+                                       "password": "hunter22"}).status_code == 200
+    # imported passwords at a real cost: the whole import takes well over PASSWORD_QUEUE_TIMEOUT
+    monkeypatch.setattr(password_hasher, "rounds", 10)
+    body = "\n".join(json.dumps({"username": f"imported{n}", "email": f"imported{n}@example.com",
+                                 "password": "secret"}) for n in range(40))
+    imported = {}
+    importer = threading.Thread(target=lambda: imported.update(
+        response=client.post("/import/users", content=body.encode())))
+    importer.start()
+    try:
+        time.sleep(0.3)   # let the import fill the queue first
+        assert password_hasher.bulk_waiting > 0
+        response = client.post("/login", json={"username": "alice", "password": "hunter22"})
+        assert response.status_code == 200, response.text
+    finally:
+        importer.join()
+    assert imported["response"].status_code == 200
+    assert imported["response"].json()["errors"] == []
@@ -0,0 +1,36 @@
+import asyncio
+import threading
+
+from app import ref_cache as ref_cache_module
+from app.ref_cache import RefAdvertisementCache
+from conftest import git
+
+
+def test_nested_ref_update_invalidates_and_the_walk_stays_off_the_loop(worktree, tmp_path, monkeypatch):
+    git("commit", "-q", "--allow-empty", "-m", "one", cwd=worktree)
+    bare = tmp_path / "repo.git"
+    git("clone", "-q", "--bare", str(worktree), str(bare))
+
+    walked_on = []
+    fingerprint = ref_cache_module.ref_fingerprint
+    monkeypatch.setattr(ref_cache_module, "ref_fingerprint",
+                        lambda path: walked_on.append(threading.current_thread()) or fingerprint(path))
+
+    async def advertise(cache: RefAdvertisementCache) -> bytes:
+        async def load() -> bytes:
+            return git("for-each-ref", cwd=bare).encode()
+        return await cache.get_or_load(bare, "refs", load)
+
+    async def run():
+        cache = RefAdvertisementCache()
+        first = await advertise(cache)
+        assert await advertise(cache) == first and cache.hits == 1
+        git("update-ref", "refs/heads/feature/deep/x", "main", cwd=bare)
+        assert b"refs/heads/feature/deep/x" in await advertise(cache)
+        # feature/deep/ exists now: only its own mtime moves
+        git("update-ref", "refs/heads/feature/deep/y", "main", cwd=bare)
+        assert b"refs/heads/feature/deep/y" in await advertise(cache)
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(run())
+    assert walked_on and loop_thread not in walked_on
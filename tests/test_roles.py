@@ -0,0 +1,46 @@
+import pytest
+
+from app import cache
+from app.dependency_injector import fake_current_user
+
+
+@pytest.fixture
+def own_repo(client, request) -> int:
+    """A repo maintained by the (fake) current user, so role changes are allowed."""
+    response = client.post("/repos", json={"reponame": request.node.name, "maintainer_id": fake_current_user()})
+    assert response.status_code == 200, response.text
+    return response.json()["repo_id"]
+
+
+def test_grant_and_revoke(client, own_repo):
+    assert client.put(f"/repos/{own_repo}/roles/2", json={"role": "write"}).json()["roles"] == ["write"]
+    assert client.get(f"/repos/{own_repo}/roles/2").json()["roles"] == ["write"]
+    assert client.delete(f"/repos/{own_repo}/roles/2", params={"role": "write"}).json()["roles"] == []
+
+
+def test_only_known_role_names(client, own_repo):
+    assert client.put(f"/repos/{own_repo}/roles/2", json={"role": "superuser"}).status_code == 422
+    assert client.delete(f"/repos/{own_repo}/roles/2", params={"role": "superuser"}).status_code == 422
+
+
+def test_unknown_repo_or_user_is_404(client, own_repo):
+    for method in ("put", "delete"):
+        kwargs = {"json": {"role": "read"}} if method == "put" else {}
+        assert client.request(method, f"/repos/999999/roles/2", **kwargs).status_code == 404
+        assert client.request(method, f"/repos/{own_repo}/roles/999999", **kwargs).status_code == 404
+
+
+def test_only_the_maintainer_changes_roles(client, repo_id):
+    # repo_id's maintainer is user 1, the current user is not
+    assert client.put(f"/repos/{repo_id}/roles/2", json={"role": "read"}).status_code == 403
+    assert client.delete(f"/repos/{repo_id}/roles/2").status_code == 403
+
+
+def test_misses_are_cached_briefly(monkeypatch):
+    monkeypatch.setattr(cache, "cache", cache.LocalCache())
+    monkeypatch.setattr(cache, "CACHE_MISS_TTL", 0)
+    found = iter([None, {"repo_id": 1}])
+    assert cache.read_through("repo:1", lambda: next(found)) is None
+    # another worker created it: the miss is already gone here
+    assert cache.read_through("repo:1", lambda: next(found)) == {"repo_id": 1}
+    assert cache.read_through("repo:1", lambda: next(found)) == {"repo_id": 1}   # hits stay cached
@@ -0,0 +1,100 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+from app.git_ops import GitScheduler
+
+READ, WRITE = GitScheduler.READ, GitScheduler.WRITE
+A, B = Path("a.git"), Path("b.git")
+
+
+async def queued(scheduler: GitScheduler, repo: Path, kind: str) -> asyncio.Task:
+    """acquire() in a task, checked to be waiting rather than granted."""
+    task = asyncio.create_task(scheduler.acquire(repo, kind))
+    await asyncio.sleep(0)
+    assert not task.done()
+    return task
+
+
+def test_global_and_per_repo_caps():
+    async def run():
+        scheduler = GitScheduler(max_processes=3, max_per_repo=2, max_queue=8, queue_timeout=5)
+        a1, a2 = await scheduler.acquire(A, READ), await scheduler.acquire(A, READ)
+        third_on_a = await queued(scheduler, A, READ)   # a.git is at its cap
+        b1 = await queued(scheduler, B, READ)           # FIFO: nobody jumps the queue on arrival
+        a1.release()
+        # ...but a release hands out every slot it can, skipping waiters whose repo is full
+        a3, b1 = await third_on_a, await b1
+        assert scheduler.active == 3 and scheduler.active_per_repo == {str(A): 2, str(B): 1}
+        b2 = await queued(scheduler, B, READ)           # global cap
+        a2.release()
+        b2 = await b2
+        for slot in (a3, b1, b2, b2):   # release() is idempotent
+            slot.release()
+        assert scheduler.active == 0 and not scheduler.active_per_repo
+
+    asyncio.run(run())
+
+
+def test_reads_and_writes_take_turns():
+    async def run():
+        scheduler = GitScheduler(max_processes=1, max_per_repo=1, max_queue=8, queue_timeout=5)
+        slot = await scheduler.acquire(A, READ)
+        waiters = [await queued(scheduler, A, kind) for kind in (READ, READ, WRITE, WRITE)]
+        order = []
+        for _ in waiters:
+            slot.release()
+            done, _ = await asyncio.wait([w for w in waiters if not w.done()], return_when=asyncio.FIRST_COMPLETED)
+            slot = done.pop().result()
+            order.append(slot.kind)
+        slot.release()
+        assert order == [READ, WRITE, READ, WRITE]   # two reads queued first still don't run back to back
+
+    asyncio.run(run())
+
+
+def test_full_queue_and_queue_timeout_are_503():
+    async def run():
+        scheduler = GitScheduler(max_processes=1, max_per_repo=1, max_queue=1, queue_timeout=0.05)
+        slot = await scheduler.acquire(A, WRITE)
+        waiting = await queued(scheduler, A, WRITE)
+        with pytest.raises(HTTPException) as full:
+            await scheduler.acquire(A, WRITE)
+        with pytest.raises(HTTPException) as timed_out:
+            await waiting
+        slot.release()
+        return full.value, timed_out.value, scheduler
+
+    full, timed_out, scheduler = asyncio.run(run())
+    assert full.status_code == timed_out.status_code == 503
+    assert "Retry-After" in full.headers
+    assert scheduler.rejected[WRITE] == scheduler.timed_out[WRITE] == 1
+    assert scheduler.active == 0 and not scheduler.queues[WRITE]
+
+
+def test_maintenance_holds_writes_not_reads():
+    async def run():
+        scheduler = GitScheduler(max_processes=4, max_per_repo=4, max_queue=8, queue_timeout=5)
+        running_write = await scheduler.acquire(A, WRITE)
+        entered = asyncio.Event()
+
+        async def maintain():
+            async with scheduler.maintenance(A):
+                entered.set()
+                await asyncio.sleep(0.05)
+
+        job = asyncio.create_task(maintain())
+        await asyncio.sleep(0)
+        assert not entered.is_set()   # waits the in-flight push out
+        new_write = await queued(scheduler, A, WRITE)
+        running_write.release()
+        await entered.wait()
+        (await scheduler.acquire(A, READ)).release()   # reads carry on meanwhile
+        assert not new_write.done()
+        await job
+        (await new_write).release()
+        assert scheduler.active == 0
+
+    asyncio.run(run())